@@ -0,0 +1,139 @@
+# === Bot update delivery benchmark: polling vs webhook ===
+# Delivers the same synthetic updates (a /start message and a balance tap per
+# user) to the real Dispatcher both ways and reports handled updates/sec:
+#
+#   polling - dp.start_polling against a fake Bot API whose getUpdates hands
+#             out batches of up to 100 after --poll-rtt-ms
+#   webhook - POSTs to BOT_WEBHOOK_PATH on the aiohttp app from
+#             build_web_app(), with the X-Telegram-Bot-Api-Secret-Token header
+#
+# Bot API replies go to simulate.FakeSession, so nothing leaves the machine.
+#
+#   python benchmarks/bench_bot_webhook.py --users 2000 --concurrency 100
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from simulate import FakeSession, _prepare_environment, callback_update, message_update
+
+class PollingSession(FakeSession):
+    """FakeSession whose getUpdates serves queued updates in batches"""
+
+    def __init__(self, updates, poll_rtt=0.0):
+        super().__init__()
+        self.updates = list(updates)
+        self.poll_rtt = poll_rtt
+
+    async def make_request(self, bot, method):
+        from aiogram import methods
+        from aiogram.types import User
+
+        if isinstance(method, methods.GetMe):
+            return User(id=42, is_bot=True, first_name="bench", username="bench_bot")
+        if isinstance(method, methods.GetUpdates):
+            await asyncio.sleep(self.poll_rtt)
+            batch, self.updates = self.updates[:method.limit or 100], self.updates[method.limit or 100:]
+            return batch
+        return await super().make_request(bot, method)
+
+def synthetic_updates(users):
+    updates = []
+    for user_id in range(1000, 1000 + users):
+        updates.append(message_update(user_id, "/start"))
+        updates.append(callback_update(user_id, "balance"))
+    return updates
+
+class Completion:
+    """Outer update middleware that fires once `target` updates were handled"""
+
+    def __init__(self):
+        self.handled = 0
+        self.target = 0
+        self.done = None
+
+    def reset(self, target):
+        self.handled = 0
+        self.target = target
+        self.done = asyncio.Event()
+
+    async def __call__(self, handler, event, data):
+        try:
+            return await handler(event, data)
+        finally:
+            self.handled += 1
+            if self.handled >= self.target:
+                self.done.set()
+
+async def bench_polling(m, completion, users, poll_rtt):
+    updates = synthetic_updates(users)
+    session = PollingSession(updates, poll_rtt)
+    m.bot.session = session.session
+    completion.reset(len(updates))
+    started = time.perf_counter()
+    polling = asyncio.create_task(m.dp.start_polling(m.bot, handle_signals=False, polling_timeout=0))
+    await completion.done.wait()
+    seconds = time.perf_counter() - started
+    await m.dp.stop_polling()
+    await polling
+    return len(updates), seconds
+
+async def bench_webhook(m, completion, users, concurrency):
+    from aiohttp.test_utils import TestClient, TestServer
+
+    updates = synthetic_updates(users)
+    m.bot.session = FakeSession().session
+    m.BOT_MODE = "webhook"
+    headers = {"X-Telegram-Bot-Api-Secret-Token": m.TELEGRAM_WEBHOOK_SECRET}
+    semaphore = asyncio.Semaphore(concurrency)
+    completion.reset(len(updates))
+    async with TestClient(TestServer(m.build_web_app())) as client:
+        async def post(update):
+            async with semaphore:
+                body = update.model_dump_json(exclude_none=True)
+                response = await client.post(m.BOT_WEBHOOK_PATH, data=body, headers=headers)
+                assert response.status == 200, response.status
+
+        forged = await client.post(m.BOT_WEBHOOK_PATH, data="{}", headers={"X-Telegram-Bot-Api-Secret-Token": "wrong"})
+        assert forged.status == 401, forged.status
+
+        started = time.perf_counter()
+        await asyncio.gather(*(post(u) for u in updates))
+        await completion.done.wait()
+        seconds = time.perf_counter() - started
+    return len(updates), seconds
+
+async def bench(users, concurrency, poll_rtt):
+    import telegram_otp_bot as m
+
+    m.startup()
+    await m.init_db()
+    completion = Completion()
+    m.dp.update.outer_middleware(completion)
+    try:
+        for name, run in (
+            ("polling", lambda: bench_polling(m, completion, users, poll_rtt)),
+            ("webhook", lambda: bench_webhook(m, completion, users, concurrency)),
+        ):
+            count, seconds = await run()
+            print(f"{name:<8} {count} updates in {seconds:.2f}s: {count / seconds:,.0f} updates/s")
+    finally:
+        m.db.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Bot update delivery benchmark: polling vs webhook")
+    parser.add_argument("--users", type=int, default=2000, help="users sending /start and a balance tap")
+    parser.add_argument("--concurrency", type=int, default=100, help="webhook requests in flight at once")
+    parser.add_argument("--poll-rtt-ms", type=float, default=50.0, help="round trip of each getUpdates call")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory(prefix="otp-bench-") as workdir:
+        _prepare_environment(workdir)
+        asyncio.run(bench(args.users, args.concurrency, args.poll_rtt_ms / 1000))
+
+if __name__ == "__main__":
+    main()
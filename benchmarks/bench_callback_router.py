@@ -0,0 +1,88 @@
+# === Callback router throughput benchmark ===
+# Callbacks per second through callback_router.dispatch with stubbed I/O:
+# query.answer / message.answer are no-op coroutines and the database is
+# only touched by the balance route (served from BalanceCache after the
+# first tap). Mixes:
+#
+#   plain   - literal buttons ('owner', 'balance')
+#   typed   - UtrDecision payloads, parsed then refused by require_owner
+#   legacy  - approve_<user>_<amount> data upgraded to UtrDecision first
+#   unknown - data no route matches
+#
+# Then prints callback_router.stats() as the owner's /perf command shows it.
+#
+#   python benchmarks/bench_callback_router.py --callbacks 100000
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ["METRICS_ENABLED"] = "1"
+
+import telegram_otp_bot as m
+
+class StubUser:
+    def __init__(self, user_id):
+        self.id = user_id
+        self.username = f"user{user_id}"
+
+class StubMessage:
+    def __init__(self, user_id):
+        self.from_user = StubUser(user_id)
+        self.chat = self.from_user
+        self.message_id = 1
+
+    async def answer(self, text, **kwargs):
+        pass
+
+    async def edit_text(self, text, **kwargs):
+        pass
+
+class StubQuery:
+    def __init__(self, user_id, data):
+        self.from_user = StubUser(user_id)
+        self.message = StubMessage(user_id)
+        self.data = data
+
+    async def answer(self, text=None, **kwargs):
+        pass
+
+def mixes(users):
+    decision = m.UtrDecision(action="approve", user_id=5, amount=100, request_id=9).pack()
+    return {
+        'plain': [StubQuery(1000 + i % users, ('owner', 'balance')[i % 2]) for i in range(users * 2)],
+        'typed': [StubQuery(1000 + i, decision) for i in range(users)],
+        'legacy': [StubQuery(1000 + i, "approve_5_100") for i in range(users)],
+        'unknown': [StubQuery(1000 + i, f"nope_{i}") for i in range(users)],
+    }
+
+async def bench(callbacks, users):
+    await m.init_db()
+    try:
+        for name, queries in mixes(users).items():
+            started = time.perf_counter()
+            for i in range(callbacks):
+                await m.callback_router.dispatch(queries[i % len(queries)], None)
+            seconds = time.perf_counter() - started
+            print(f"{name:<8} {callbacks} callbacks in {seconds:.2f}s: {callbacks / seconds:,.0f}/s")
+    finally:
+        m.db.close()
+    print()
+    print(m.format_callback_stats(m.callback_router.stats(), m.callback_backpressure.stats()))
+
+def main():
+    parser = argparse.ArgumentParser(description="Callback router throughput benchmark")
+    parser.add_argument("--callbacks", type=int, default=100_000, help="dispatches per mix")
+    parser.add_argument("--users", type=int, default=1000, help="distinct users tapping")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory(prefix="otp-bench-") as workdir:
+        os.chdir(workdir)
+        asyncio.run(bench(args.callbacks, args.users))
+
+if __name__ == "__main__":
+    main()
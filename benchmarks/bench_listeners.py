@@ -0,0 +1,121 @@
+# === Listener memory / file descriptor harness ===
+# Drives ListenerManager with thousands of fake Telethon sessions and reports
+# connected clients, resident memory and open file descriptors at each stage:
+#
+#   eager - every session connected at startup (the original behaviour)
+#   lazy  - sessions only registered; buyers connect them on demand under
+#           MAX_CONNECTED_LISTENERS and idle ones are reaped
+#
+# Each fake client holds a socket pair and --client-kb of buffers while
+# connected, standing in for a real client's connection and state. Each mode
+# runs in its own process so their memory figures do not mix.
+#
+#   python benchmarks/bench_listeners.py --sessions 5000 --cap 100 --buyers 80
+import argparse
+import asyncio
+import logging
+import os
+import random
+import resource
+import socket
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import telegram_otp_bot as m
+from simulate import FakeTelegramClient, install_fake_clients
+
+def rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # peak, not current
+
+def open_fds():
+    try:
+        return len(os.listdir("/proc/self/fd"))
+    except OSError:
+        return -1
+
+class ConnectionClient(FakeTelegramClient):
+    """FakeTelegramClient that holds a socket pair and some buffers while connected"""
+
+    buffer_bytes = 0
+
+    async def start(self):
+        await super().start()
+        self.sockets = socket.socketpair()
+        self.buffers = bytearray(self.buffer_bytes)
+
+    async def disconnect(self):
+        await super().disconnect()
+        for sock in getattr(self, "sockets", ()):
+            sock.close()
+        self.sockets = ()
+        self.buffers = None
+
+def report(stage, listeners, started):
+    stats = listeners.stats()
+    print(
+        f"  {stage:<10} {time.perf_counter() - started:7.2f}s  connected {stats['connected']:>6}  "
+        f"rss {rss_mb():8.1f} MB  fds {open_fds():>6}"
+    )
+
+async def run(mode, sessions, cap, buyers):
+    phones = [f"+91{9000000000 + i}" for i in range(sessions)]
+    listeners = m.ListenerManager(max_connected=sessions if mode == "eager" else cap, idle_ttl=0)
+    print(f"{mode}: {sessions} sessions, cap {listeners.max_connected}")
+    report("baseline", listeners, time.perf_counter())
+
+    started = time.perf_counter()
+    for phone in phones:
+        if mode == "eager":
+            await listeners.acquire(phone, session=phone)
+            listeners.release(phone)
+        else:
+            listeners.register(phone)
+            listeners.sessions[phone] = phone
+    report("startup", listeners, started)
+
+    started = time.perf_counter()
+    sold = random.Random(1).sample(phones, buyers)
+    await asyncio.gather(*(listeners.acquire(phone, session=phone) for phone in sold))
+    report("buyers", listeners, started)
+
+    started = time.perf_counter()
+    for phone in sold:
+        listeners.release(phone)
+    await listeners.reap_idle()
+    report("reaped", listeners, started)
+    for phone in list(listeners.clients):
+        await listeners.disconnect(phone)
+
+def main():
+    parser = argparse.ArgumentParser(description="Listener memory and file descriptor harness")
+    parser.add_argument("--sessions", type=int, default=5000, help="stored sessions")
+    parser.add_argument("--cap", type=int, default=100, help="MAX_CONNECTED_LISTENERS for the lazy mode")
+    parser.add_argument("--buyers", type=int, default=80, help="purchases waiting for an OTP at once")
+    parser.add_argument("--client-kb", type=int, default=64, help="buffers held per connected fake client")
+    parser.add_argument("--mode", choices=("both", "eager", "lazy"), default="both")
+    args = parser.parse_args()
+
+    if args.mode == "both":
+        argv = [f"--sessions={args.sessions}", f"--cap={args.cap}", f"--buyers={args.buyers}", f"--client-kb={args.client_kb}"]
+        for mode in ("eager", "lazy"):
+            subprocess.run([sys.executable, os.path.abspath(__file__), *argv, f"--mode={mode}"], check=True)
+        return
+
+    _, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    m.logger.setLevel(logging.ERROR)  # buyers past the cap warn once per connect
+    install_fake_clients(m, ConnectionClient)
+    ConnectionClient.buffer_bytes = args.client_kb * 1024
+    asyncio.run(run(args.mode, args.sessions, args.cap, args.buyers))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+# === Session storage startup benchmark ===
+# Startup validation of N stored sessions, with fake Telethon connections:
+#
+#   files - the original layout: one SQLite .session file per phone, each
+#           opened as a SQLiteSession and kept by its client
+#   table - the sessions table: init_db() migrating the files once, then
+#           start_existing_sessions() building clients from StringSessions
+#
+# Reports wall time, resident memory and open file descriptors after
+# startup. Each layout runs in its own process so the figures do not mix.
+#
+#   python benchmarks/bench_sessions.py --sessions 5000
+import argparse
+import asyncio
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from telethon.crypto import AuthKey
+from telethon.sessions import SQLiteSession
+
+import telegram_otp_bot as m
+from simulate import FakeTelegramClient
+
+def rss_mb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+def open_fds():
+    return len(os.listdir("/proc/self/fd"))
+
+def make_session_files(directory, count):
+    os.makedirs(directory)
+    template = os.path.join(directory, "template")
+    session = SQLiteSession(template)
+    session.set_dc(2, "149.154.167.51", 443)
+    session.auth_key = AuthKey(os.urandom(256))
+    session.save()
+    session.close()
+    for i in range(count):
+        shutil.copy(template + ".session", os.path.join(directory, f"+91{9000000000 + i}.session"))
+    os.remove(template + ".session")
+
+def report(layout, seconds, detail):
+    print(f"{layout:<6} {seconds:6.2f}s  rss {rss_mb():7.1f} MB  fds {open_fds():>6}  {detail}")
+
+async def start_files(directory):
+    # The pre-table startup: a client per file, each holding its SQLite session open
+    started = time.perf_counter()
+    clients = {}
+    for name in sorted(os.listdir(directory)):
+        client = FakeTelegramClient(SQLiteSession(os.path.join(directory, name[:-len(".session")])))
+        await client.connect()
+        if await client.is_user_authorized():
+            clients[name] = client
+    report("files", time.perf_counter() - started, f"{len(clients)} clients")
+
+async def start_table(directory):
+    m.TelegramClient = FakeTelegramClient
+    started = time.perf_counter()
+    await m.init_db()  # migrates SESSION_DIR, i.e. `directory`, once
+    migrate_seconds = time.perf_counter() - started
+    migrated, = await m.db.fetchone("SELECT COUNT(*) FROM sessions")
+    started = time.perf_counter()
+    summary = await m.start_existing_sessions()
+    report("table", time.perf_counter() - started, f"{summary} (one-time migration of {migrated}: {migrate_seconds:.2f}s)")
+    m.db.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Session storage startup benchmark")
+    parser.add_argument("--sessions", type=int, default=5000)
+    parser.add_argument("--layout", choices=("both", "files", "table"), default="both")
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.layout == "both":
+        for layout in ("files", "table"):
+            with tempfile.TemporaryDirectory(prefix="otp-bench-") as workdir:
+                make_session_files(os.path.join(workdir, "sessions"), args.sessions)
+                subprocess.run(
+                    [sys.executable, os.path.abspath(__file__), f"--layout={layout}", f"--workdir={workdir}"],
+                    check=True,
+                )
+        return
+
+    _, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    os.chdir(args.workdir)
+    run = start_files if args.layout == "files" else start_table
+    asyncio.run(run(os.path.join(args.workdir, "sessions")))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+# === Import / cold start benchmark ===
+# Imports telegram_otp_bot in fresh interpreters under `python -X importtime`
+# and reports the median wall time of the import, the module's own share,
+# the heaviest packages it pulls in, and whether optional dependencies that
+# should load lazily (razorpay, qrcode, the aiohttp webhook helpers) were
+# imported anyway.
+#
+#   python benchmarks/bench_startup.py --runs 5 --top 10
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LAZY = ("razorpay", "qrcode", "aiogram.webhook.aiohttp_server")
+PROBE = (
+    "import sys, time; started = time.perf_counter(); import telegram_otp_bot; "
+    "print(time.perf_counter() - started); "
+    f"print(','.join(name for name in {LAZY!r} if name in sys.modules))"
+)
+_IMPORTTIME = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+def run_once():
+    env = dict(os.environ, LOG_LEVEL="WARNING")
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", PROBE],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True,
+    )
+    seconds, loaded = result.stdout.splitlines()[-2:]
+    packages = {}  # top-level import -> cumulative microseconds
+    own = 0
+    for line in result.stderr.splitlines():
+        match = _IMPORTTIME.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, name = match.groups()
+        if name == "telegram_otp_bot":
+            own = int(self_us)
+        elif len(indent) == 3:  # imported directly by the module
+            packages[name] = int(cumulative_us)
+    return float(seconds), own, packages, [name for name in loaded.split(",") if name]
+
+def main():
+    parser = argparse.ArgumentParser(description="Import / cold start benchmark")
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters to time")
+    parser.add_argument("--top", type=int, default=10, help="heaviest direct imports to list")
+    args = parser.parse_args()
+
+    runs = [run_once() for _ in range(args.runs)]
+    print(f"import telegram_otp_bot: median {statistics.median(r[0] for r in runs) * 1000:.0f} ms over {args.runs} runs "
+          f"(module's own code {statistics.median(r[1] for r in runs) / 1000:.1f} ms)")
+    last = runs[-1][2]
+    for name, cumulative in sorted(last.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"  {cumulative / 1000:8.1f} ms  {name}")
+    loaded = sorted({name for r in runs for name in r[3]})
+    print(f"lazy dependencies loaded at import: {', '.join(loaded) or 'none'}")
+
+if __name__ == "__main__":
+    main()
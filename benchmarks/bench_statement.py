@@ -0,0 +1,121 @@
+# === Bank statement reconciliation benchmark ===
+# Generates an HDFC-style statement CSV (account preamble, then Date /
+# Narration / Ref / Withdrawal / Deposit / Balance rows) against a set of
+# pending UTR requests, and times:
+#
+#   match   - match_statement alone under tracemalloc, for its peak memory
+#   dry run - reconcile_statement(dry_run=True)
+#   full    - reconcile_statement, approving every match in one transaction
+#   rerun   - the same statement again, which must approve nothing
+#
+# Paid requests carry their UTR in the reference column or, for half of
+# them, only in the narration; the rest of the rows are debits and other
+# people's credits whose narrations contain IFSC codes and names.
+#
+#   python benchmarks/bench_statement.py --rows 100000 --pending 5000 --paid 4000 --mismatched 200
+import argparse
+import asyncio
+import csv
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import telegram_otp_bot as m
+
+NAMES = ("RAMESH KUMAR", "PRIYA SHARMA", "ANIL GUPTA", "SUNITA DEVI", "MOHD IRFAN", "KAVYA NAIR")
+BANKS = ("HDFC", "ICIC", "SBIN", "UTIB", "KKBK", "PUNB")
+
+def pending_requests(count, rng):
+    """(user_id, utr, amount) for `count` pending deposits, a third of them NEFT references"""
+    requests = []
+    for i in range(count):
+        if i % 3:
+            utr = f"{rng.randrange(10**11, 10**12)}"
+        else:
+            utr = f"{rng.choice(BANKS)}N{rng.randrange(10**16, 10**17)}"
+        requests.append((10_000 + i, utr, rng.choice((100, 200, 500, 1000, 2000))))
+    return requests
+
+def write_statement(path, rows, requests, paid, mismatched, rng):
+    """Write `rows` statement lines paying the first `paid` requests, `mismatched` of them short"""
+    payments = []
+    for i, (user_id, utr, amount) in enumerate(requests[:paid]):
+        payments.append((utr, amount - 1 if i < mismatched else amount, i % 2 == 0))
+    slots = set(rng.sample(range(rows), len(payments)))
+    payments = iter(payments)
+    balance = 1_000_000.0
+    with open(path, "w", newline="") as f:
+        f.write("HDFC BANK Ltd.\nAccount No :50100123456789\nStatement From : 01/10/26 To : 31/10/26\n\n")
+        writer = csv.writer(f)
+        writer.writerow(["Date", "Narration", "Chq./Ref.No.", "Value Dt", "Withdrawal Amt.", "Deposit Amt.", "Closing Balance"])
+        for row in range(rows):
+            date = f"{1 + row * 30 // rows:02d}/10/26"
+            name = rng.choice(NAMES)
+            ifsc = f"{rng.choice(BANKS)}0{rng.randrange(10**5, 10**6)}"
+            if row in slots:
+                utr, amount, in_reference = next(payments)
+                narration = f"UPI-{name}-{name.split()[0].lower()}@okbank-{ifsc}-{utr}-PAYMENT"
+                reference = utr.rjust(16, "0") if in_reference else ""
+                balance += amount
+                writer.writerow([date, narration, reference, date, "", f"{amount:.2f}", f"{balance:.2f}"])
+            elif row % 3 == 0:
+                amount = rng.randrange(50, 5000)
+                balance -= amount
+                writer.writerow([date, f"POS 4XXXXXX1234 {name} STORE", f"{rng.randrange(10**11, 10**12)}", date, f"{amount:.2f}", "", f"{balance:.2f}"])
+            else:
+                amount = rng.randrange(100, 20000)
+                balance += amount
+                utr = f"{rng.randrange(10**11, 10**12)}"
+                writer.writerow([date, f"NEFT CR-{ifsc}-{name}-SALARY", utr.rjust(16, "0"), date, "", f"{amount:.2f}", f"{balance:.2f}"])
+
+async def bench(rows, pending, paid, mismatched):
+    rng = random.Random(1)
+    await m.init_db()
+    requests = pending_requests(pending, rng)
+
+    def seed(conn):
+        conn.executemany("INSERT INTO utr_requests (user_id, utr, amount, status) VALUES (?, ?, ?, 'pending')", requests)
+    await m.db.transaction(seed)
+    statement = os.path.abspath("statement.csv")
+    write_statement(statement, rows, requests, paid, mismatched, rng)
+    print(f"statement: {rows} rows, {os.path.getsize(statement) / 2**20:.1f} MiB; {pending} pending, {paid} paid, {mismatched} short")
+
+    snapshot = {utr: (i, user_id, amount, utr) for i, (user_id, utr, amount) in enumerate(requests)}
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = m.match_statement(statement, snapshot)
+    seconds = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"match    {seconds:5.2f}s  {rows / seconds:,.0f} rows/s (traced)  peak {peak / 2**20:.2f} MiB  "
+          f"matched {len(result['matched'])}, mismatched {len(result['mismatched'])}")
+
+    try:
+        for name, dry_run in (("dry run", True), ("full", False), ("rerun", False)):
+            summary = await m.reconcile_statement(statement, dry_run=dry_run)
+            approved = summary['matched'] if dry_run else summary['approved']
+            print(f"{name:<8} {summary['seconds']:5.2f}s  approved {len(approved)}, "
+                  f"mismatched {len(summary['mismatched'])}, not found {len(summary['not_found'])}")
+    finally:
+        m.db.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Bank statement reconciliation benchmark")
+    parser.add_argument("--rows", type=int, default=100_000, help="statement lines")
+    parser.add_argument("--pending", type=int, default=5000, help="pending UTR requests")
+    parser.add_argument("--paid", type=int, default=4000, help="pending requests that appear in the statement")
+    parser.add_argument("--mismatched", type=int, default=200, help="paid requests whose amount is off by one rupee")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory(prefix="otp-bench-") as workdir:
+        os.chdir(workdir)
+        asyncio.run(bench(args.rows, args.pending, args.paid, args.mismatched))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+# === Storage layer benchmark ===
+# Fires thousands of concurrent "handlers" (a balance check, or a balance
+# check followed by a purchase) and reports p50/p99 handler latency for:
+#
+#   before - the original helpers: a fresh sqlite3.connect per call, run
+#            synchronously on the event loop (rollback journal)
+#   after  - the pooled, off-loop Storage (get_balance / claim_account)
+#
+#   python benchmarks/bench_storage.py --handlers 4000
+import argparse
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import telegram_otp_bot as m
+
+PRICE = 50
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+def report(name, latencies, seconds):
+    print(
+        f"{name:<7} {len(latencies)} handlers in {seconds:.2f}s ({len(latencies) / seconds:.0f}/s)  "
+        f"p50 {percentile(latencies, 0.5) * 1000:.1f} ms  p99 {percentile(latencies, 0.99) * 1000:.1f} ms  "
+        f"max {max(latencies) * 1000:.1f} ms"
+    )
+
+# The pre-storage helpers, kept verbatim in spirit: one connection per call
+def legacy_get_balance(path, user_id):
+    conn = sqlite3.connect(path)
+    res = conn.execute("SELECT balance FROM users WHERE id=?", (user_id,)).fetchone()
+    conn.close()
+    return res[0] if res else 0
+
+def legacy_purchase(path, user_id):
+    conn = sqlite3.connect(path)
+    res = conn.execute("SELECT id, phone FROM stock_queue ORDER BY id LIMIT 1").fetchone()
+    conn.execute("DELETE FROM stock_queue WHERE id=?", (res[0],))
+    conn.commit()
+    conn.close()
+    conn = sqlite3.connect(path)
+    conn.execute("UPDATE users SET balance = balance - ? WHERE id=?", (PRICE, user_id))
+    conn.commit()
+    conn.close()
+    conn = sqlite3.connect(path)
+    conn.execute("INSERT INTO purchases (user_id, number, status, otp) VALUES (?, ?, 'pending', '')", (user_id, res[1]))
+    conn.commit()
+    conn.close()
+
+def seed(conn, users):
+    conn.executemany("INSERT INTO users (id, balance) VALUES (?, ?)", [(u, PRICE * 2) for u in range(users)])
+    conn.executemany("INSERT INTO stock_queue (phone) VALUES (?)", [(f"+91{u:010d}",) for u in range(users)])
+    conn.execute("INSERT INTO dashboard_stats (name, day, value) VALUES ('stock_available', '', ?)", (users,))
+
+async def run_handlers(handler, count):
+    async def timed(i):
+        started = time.perf_counter()
+        await handler(i)
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    latencies = await asyncio.gather(*(timed(i) for i in range(count)))
+    return latencies, time.perf_counter() - started
+
+async def bench_before(path, count):
+    async def handler(i):
+        legacy_get_balance(path, i)
+        await asyncio.sleep(0)  # the real handler awaits the Bot API in between
+        if i % 2:
+            legacy_purchase(path, i)
+    return await run_handlers(handler, count)
+
+async def bench_after(count):
+    await m.init_db()
+    await m.db.transaction(seed, count)
+
+    async def handler(i):
+        await m.get_balance(i)
+        await asyncio.sleep(0)
+        if i % 2:
+            await m.claim_account(i, PRICE)
+    try:
+        return await run_handlers(handler, count)
+    finally:
+        m.db.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Storage layer latency benchmark")
+    parser.add_argument("--handlers", type=int, default=4000, help="concurrent handlers; every second one also buys")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="otp-bench-") as workdir:
+        os.chdir(workdir)
+        legacy = os.path.join(workdir, "legacy.db")
+        conn = sqlite3.connect(legacy, isolation_level=None)
+        m._migrate(conn)
+        seed(conn, args.handlers)
+        conn.close()
+        report("before", *asyncio.run(bench_before(legacy, args.handlers)))
+        report("after", *asyncio.run(bench_after(args.handlers)))
+
+if __name__ == "__main__":
+    main()
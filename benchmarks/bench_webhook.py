@@ -0,0 +1,76 @@
+# === Razorpay webhook throughput benchmark ===
+# Posts locally signed payment.captured webhooks to the real aiohttp app over
+# HTTP and reports verified webhooks per second and p50/p99 latency. A share
+# of the requests are retries of earlier payments, which must not credit.
+#
+#   python benchmarks/bench_webhook.py --webhooks 5000 --concurrency 100
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from aiohttp.test_utils import TestClient, TestServer
+
+import telegram_otp_bot as m
+
+SECRET = "bench-webhook-secret"
+
+def signed_capture(payment_id, user_id, amount):
+    body = json.dumps({
+        "event": "payment.captured",
+        "payload": {"payment": {"entity": {"id": payment_id, "amount": amount * 100, "notes": {"user_id": str(user_id)}}}},
+    }).encode()
+    return body, {"X-Razorpay-Signature": hmac.new(SECRET.encode(), body, hashlib.sha256).hexdigest()}
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+async def bench(count, concurrency, retry_share):
+    m.WEBHOOK_SECRET = SECRET
+    m.RAZORPAY_WEBHOOK_ENABLED = True
+    await m.init_db()
+    unique = int(count * (1 - retry_share))
+    requests = [signed_capture(f"pay_{i % unique}", i % unique, 100) for i in range(count)]
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with TestClient(TestServer(m.build_web_app())) as client:
+        async def post(body, headers):
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.post(m.RAZORPAY_WEBHOOK_PATH, data=body, headers=headers)
+                assert response.status == 200
+                return time.perf_counter() - started
+
+        started = time.perf_counter()
+        latencies = await asyncio.gather(*(post(*r) for r in requests))
+        seconds = time.perf_counter() - started
+
+    credited = await m.db.fetchone("SELECT COUNT(*), SUM(amount) FROM payments")
+    m.db.close()
+    print(
+        f"{count} webhooks ({count - unique} retries) in {seconds:.2f}s: {count / seconds:,.0f}/s  "
+        f"p50 {percentile(latencies, 0.5) * 1000:.1f} ms  p99 {percentile(latencies, 0.99) * 1000:.1f} ms"
+    )
+    print(f"credited {credited[0]} payments, ₹{credited[1]} (expected {unique}, ₹{unique * 100})")
+
+def main():
+    parser = argparse.ArgumentParser(description="Razorpay webhook throughput benchmark")
+    parser.add_argument("--webhooks", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=100, help="requests in flight at once")
+    parser.add_argument("--retry-share", type=float, default=0.2, help="fraction of requests that repeat a payment")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory(prefix="otp-bench-") as workdir:
+        os.chdir(workdir)
+        asyncio.run(bench(args.webhooks, args.concurrency, args.retry_share))
+
+if __name__ == "__main__":
+    main()
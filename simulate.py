@@ -0,0 +1,597 @@
+# === Offline load simulation for telegram_otp_bot ===
+# Drives the real Dispatcher with a fake Bot API session and fake Telethon
+# clients, so whole-bot throughput and latency can be compared across
+# commits without network access or real accounts:
+#
+#   python simulate.py --users 500 --output run.json
+#
+# Every run works in a fresh temporary directory (database, sessions).
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+SIM_OWNER_ID = 1
+
+def _prepare_environment(workdir):
+    os.environ.update({
+        "API_TOKEN": "123456:SIMULATED",
+        "API_ID": "1",
+        "API_HASH": "simulated",
+        "OWNER_ID": str(SIM_OWNER_ID),
+        "OWNER_USERNAME": "@owner",
+        "UPI_ID": os.environ.get("UPI_ID", "simulated@upi"),
+        "BOT_MODE": "polling",
+        "FSM_STORAGE": os.environ.get("FSM_STORAGE", "sqlite"),
+        "LOG_LEVEL": os.environ.get("LOG_LEVEL", "WARNING"),
+    })
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.chdir(workdir)
+
+# === Fakes ===
+class FakeSession:
+    """Bot API session that answers every method locally and records sends"""
+
+    def __init__(self, latency=0.0):
+        from aiogram.client.session.base import BaseSession
+
+        class _Session(BaseSession):
+            async def make_request(inner, bot, method, timeout=None):
+                return await self.make_request(bot, method)
+
+            async def stream_content(inner, *args, **kwargs):
+                yield b""
+
+            async def close(inner):
+                pass
+
+        self.session = _Session()
+        self.latency = latency
+        self.message_ids = itertools.count(1)
+        self.calls = {}
+        self.delivered_at = {}  # chat_id -> monotonic time of the last send/edit
+
+    async def make_request(self, bot, method):
+        from aiogram import methods
+        from aiogram.types import Chat, Message, PhotoSize
+
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        name = type(method).__name__
+        self.calls[name] = self.calls.get(name, 0) + 1
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is not None:
+            self.delivered_at[chat_id] = time.monotonic()
+        if isinstance(method, (methods.SendMessage, methods.SendPhoto, methods.EditMessageText)):
+            message_id = getattr(method, "message_id", None) or next(self.message_ids)
+            photo = None
+            if isinstance(method, methods.SendPhoto):
+                # Uploads get a fresh file_id; resent file_ids come back unchanged
+                file_id = method.photo if isinstance(method.photo, str) else f"photo-{message_id}"
+                photo = [PhotoSize(file_id=file_id, file_unique_id=file_id, width=320, height=320)]
+            return Message(
+                message_id=message_id,
+                date=datetime.now(),
+                chat=Chat(id=chat_id or 0, type="private"),
+                text=getattr(method, "text", None),
+                photo=photo,
+            ).as_(bot)
+        return True
+
+class FakeEvent:
+    def __init__(self, raw_text, sender_id=777000):
+        self.raw_text = raw_text
+        self.sender_id = sender_id
+
+class FakeTelegramClient:
+    """Enough of telethon.TelegramClient for listeners, validation and login.
+
+    faults[phone] is raised from start() and get_me() to inject FloodWait,
+    auth-key or network errors; drop() simulates the connection dying.
+    """
+
+    instances = {}
+    faults = {}
+
+    def __init__(self, session, api_id=None, api_hash=None, **kwargs):
+        self.session = session
+        self.phone = os.path.basename(str(session))
+        self.handlers = []
+        self.connected = False
+        self._disconnected = None
+        FakeTelegramClient.instances[self.phone] = self
+
+    def on(self, event):
+        def register(handler):
+            self.handlers.append(handler)
+            return handler
+        return register
+
+    async def connect(self):
+        self.connected = True
+
+    async def start(self):
+        self._raise_fault()
+        self.connected = True
+
+    async def get_me(self, input_peer=False):
+        self._raise_fault()
+        return True
+
+    def _raise_fault(self):
+        fault = FakeTelegramClient.faults.get(self.phone)
+        if fault is not None:
+            raise fault
+
+    def is_connected(self):
+        return self.connected
+
+    async def is_user_authorized(self):
+        return True
+
+    async def run_until_disconnected(self):
+        self._disconnected = asyncio.Event()
+        await self._disconnected.wait()
+
+    async def disconnect(self):
+        self.connected = False
+        if self._disconnected is not None:
+            self._disconnected.set()
+
+    async def log_out(self):
+        await self.disconnect()
+        return True
+
+    def drop(self):
+        self.connected = False
+        if self._disconnected is not None:
+            self._disconnected.set()
+
+    async def emit(self, text, sender_id=777000):
+        for handler in self.handlers:
+            await handler(FakeEvent(text, sender_id))
+
+CHATTER = [
+    "Hey, are we still meeting tomorrow at 5? Let me know 👍",
+    "Your order #48213 has been shipped and will arrive by 12/10",
+    "Forwarded: Meeting notes - budget review moved to room 4021, bring the Q3 numbers",
+    "lol that video was hilarious 😂 send me the link again",
+    "Reminder: electricity bill of Rs 1,245.00 is due on 15th",
+]
+
+class ChattyTelegramClient(FakeTelegramClient):
+    """Fake client that receives `chatter` ordinary messages, then its login code"""
+
+    chatter = 200
+
+    async def run_until_disconnected(self):
+        self._disconnected = asyncio.Event()
+        for i in range(self.chatter):
+            await self.emit(CHATTER[i % len(CHATTER)], sender_id=42)
+            if i % 20 == 0:
+                await asyncio.sleep(0)  # let the worker answer commands meanwhile
+        await self.emit(f"Login code: {self.phone[-5:]}. Do not give this code to anyone")
+        await self._disconnected.wait()
+
+def install_fake_clients(m, client_class=FakeTelegramClient):
+    m.TelegramClient = client_class
+    m.StringSession = lambda session=None: session  # the stored "session" is just the phone
+
+def fake_listener_worker_main(worker_id, commands, events_queue, max_connected):
+    """listener_worker_main with fake clients, for the spawned worker processes"""
+    import telegram_otp_bot as m
+
+    install_fake_clients(m, ChattyTelegramClient)
+    m.listener_worker_main(worker_id, commands, events_queue, max_connected)
+
+# === Update builders ===
+_update_ids = itertools.count(1)
+
+def _user(user_id):
+    from aiogram.types import User
+    return User(id=user_id, is_bot=False, first_name=f"user{user_id}", username=f"user{user_id}")
+
+def message_update(user_id, text):
+    from aiogram.types import Chat, Message, Update
+    return Update(update_id=next(_update_ids), message=Message(
+        message_id=next(_update_ids),
+        date=datetime.now(),
+        chat=Chat(id=user_id, type="private"),
+        from_user=_user(user_id),
+        text=text,
+    ))
+
+def callback_update(user_id, data, text="menu"):
+    from aiogram.types import CallbackQuery, Chat, Message, Update
+    return Update(update_id=next(_update_ids), callback_query=CallbackQuery(
+        id=str(next(_update_ids)),
+        from_user=_user(user_id),
+        chat_instance="sim",
+        data=data,
+        message=Message(
+            message_id=next(_update_ids),
+            date=datetime.now(),
+            chat=Chat(id=user_id, type="private"),
+            from_user=_user(user_id),
+            text=text,
+        ),
+    ))
+
+# === Measurement ===
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+def summarize(name, latencies, seconds):
+    return {
+        "scenario": name,
+        "operations": len(latencies),
+        "seconds": round(seconds, 4),
+        "ops_per_second": round(len(latencies) / seconds, 1) if seconds else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 0.50) * 1000, 3),
+            "p95": round(percentile(latencies, 0.95) * 1000, 3),
+            "p99": round(percentile(latencies, 0.99) * 1000, 3),
+            "max": round(max(latencies) * 1000, 3) if latencies else 0.0,
+        },
+    }
+
+class Simulation:
+    def __init__(self, bot_module, users, concurrency):
+        self.m = bot_module
+        self.users = users
+        self.concurrency = concurrency
+        self.user_ids = [1000 + i for i in range(users)]
+
+    async def feed(self, update):
+        started = time.perf_counter()
+        await self.m.dp.feed_update(self.m.bot, update)
+        return time.perf_counter() - started
+
+    async def run_all(self, coroutines):
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def limited(coro):
+            async with semaphore:
+                return await coro
+
+        started = time.perf_counter()
+        latencies = await asyncio.gather(*(limited(c) for c in coroutines))
+        return list(latencies), time.perf_counter() - started
+
+    async def deposit_flow(self, user_id, amount, round=0):
+        elapsed = await self.feed(callback_update(user_id, "deposit"))
+        elapsed += await self.feed(message_update(user_id, str(amount)))
+        utr = f"{round:02d}{user_id:010d}"  # 12 digits, like a UPI RRN
+        elapsed += await self.feed(message_update(user_id, utr))
+        # The owner's button addresses the request by id
+        request_id, = await self.m.db.fetchone("SELECT id FROM utr_requests WHERE utr=?", (utr,))
+        decision = self.m.UtrDecision(action="approve", user_id=user_id, amount=amount, request_id=request_id).pack()
+        elapsed += await self.feed(callback_update(SIM_OWNER_ID, decision, text="🔔 New UTR Verification Request"))
+        return elapsed
+
+    async def scenario_deposits(self, rounds=2):
+        # Every user tops up the same amount each round, so later rounds reuse the uploaded QR
+        latencies, seconds = [], 0.0
+        for round in range(rounds):
+            done, took = await self.run_all(self.deposit_flow(u, 100, round) for u in self.user_ids)
+            latencies += done
+            seconds += took
+        return summarize("deposit_utr_approval", latencies, seconds)
+
+    async def scenario_purchases(self):
+        for i in range(self.users):
+            phone = f"+9100000{i:05d}"
+            await self.m.session_store.save(phone, phone)
+            await self.m.add_to_stock(phone)
+        latencies, seconds = await self.run_all(self.feed(callback_update(u, "get_account")) for u in self.user_ids)
+        return summarize("bulk_purchases", latencies, seconds)
+
+    async def scenario_otp_burst(self, fake_session):
+        # Let the listener tasks spawned by the purchases connect
+        for _ in range(100):
+            if self.m.listeners.stats()["connected"] >= len(self.m.otp_waits.by_phone):
+                break
+            await asyncio.sleep(0.01)
+        waits = list(self.m.otp_waits.by_phone.values())
+        started = time.perf_counter()
+        emitted = {}
+        for index, wait in enumerate(waits):
+            client = FakeTelegramClient.instances.get(wait.phone)
+            if client is None:
+                continue
+            emitted[wait.user_id] = time.monotonic()
+            await client.emit(f"Login code: {10000 + index}. Do not give this code to anyone")
+        # Delivery is complete once every waiting message has been edited
+        deadline = time.monotonic() + 60
+        while time.monotonic() < deadline:
+            if all(fake_session.delivered_at.get(u, 0) >= t for u, t in emitted.items()):
+                break
+            await asyncio.sleep(0.005)
+        latencies = [fake_session.delivered_at.get(u, deadline) - t for u, t in emitted.items()]
+        return summarize("otp_burst", latencies, time.perf_counter() - started)
+
+    async def scenario_cancels(self):
+        # Re-buy, then cancel every purchase that is still pending
+        buyers = self.user_ids[: self.users // 2]
+        for u in buyers:
+            await self.m.add_balance(u, self.m.ACCOUNT_PRICE, "simulation")
+        await self.run_all(self.feed(callback_update(u, "get_account")) for u in buyers)
+        latencies, seconds = await self.run_all(self.feed(callback_update(u, "cancel")) for u in buyers)
+        return summarize("cancels", latencies, seconds)
+
+    async def scenario_session_faults(self, accounts=60, passes=4):
+        """Inject disconnects, FloodWait and revoked auth keys into live listeners"""
+        from telethon import errors
+
+        phones = [f"+9200000{i:05d}" for i in range(accounts)]
+        buyers = [5000 + i for i in range(accounts)]
+        for phone in phones:
+            await self.m.session_store.save(phone, phone)
+            await self.m.add_to_stock(phone)
+        for u in buyers:
+            await self.m.add_balance(u, self.m.ACCOUNT_PRICE, "simulation")
+        await self.run_all(self.feed(callback_update(u, "get_account")) for u in buyers)
+        await asyncio.sleep(0.05)
+        self.m.listeners.health.base = 0  # retry on every pass instead of waiting out the backoff
+
+        dropped, flooded, revoked = phones[0::3], phones[1::3], phones[2::3]
+        for phone in dropped:
+            FakeTelegramClient.instances[phone].drop()
+        for phone in flooded:
+            FakeTelegramClient.faults[phone] = errors.FloodWaitError(request=None, capture=0)
+        for phone in revoked:
+            FakeTelegramClient.faults[phone] = errors.AuthKeyUnregisteredError(request=None)
+        await asyncio.sleep(0.01)
+
+        latencies = []
+        for _ in range(passes):
+            started = time.perf_counter()
+            await self.m.listeners.check_health()
+            latencies.append(time.perf_counter() - started)
+        # Flood waits end; the next pass should reconnect those listeners
+        for phone in flooded:
+            FakeTelegramClient.faults.pop(phone)
+        started = time.perf_counter()
+        await self.m.listeners.check_health()
+        latencies.append(time.perf_counter() - started)
+        # Buyers of dead numbers cancel: the refund must not restock them
+        owners = dict(await self.m.db.fetchall("SELECT number, user_id FROM purchases WHERE status='pending'"))
+        await self.run_all(self.feed(callback_update(owners[p], "cancel")) for p in revoked if p in owners)
+
+        stocked = {row[0] for row in await self.m.db.fetchall("SELECT phone FROM stock_queue")}
+        result = summarize("session_faults", latencies, sum(latencies))
+        result.update({
+            'reconnected_after_drop': sum(1 for p in dropped if p in self.m.listeners),
+            'reconnected_after_flood': sum(1 for p in flooded if p in self.m.listeners),
+            'revoked_connected': sum(1 for p in revoked if p in self.m.listeners),
+            'revoked_in_stock': len(stocked.intersection(revoked)),
+            'breakers': self.m.listeners.health.stats(),
+            'session_statuses': await self.m.session_store.counts(),
+        })
+        return result
+
+    async def scenario_callback_flood(self, fake_session, taps=3000, batch=100, poll_ms=20, interval=0.005):
+        """One user spam-clicks while everyone else taps once; measures event loop lag.
+
+        The flood arrives the way polling delivers it: getUpdates batches of
+        up to 100, each handled as concurrent tasks, one round trip apart.
+        Alongside it, as many buyers whose OTP has not arrived tap "Get OTP".
+        """
+        abuser = 9000
+        buttons = ["get_otp", "get_account", "balance"]
+        lags = []
+
+        buyers = [30000 + i for i in range(self.users)]
+        for i, u in enumerate(buyers):
+            phone = f"+9400000{i:05d}"
+            await self.m.session_store.save(phone, phone)
+            await self.m.add_to_stock(phone)
+            await self.m.add_balance(u, self.m.ACCOUNT_PRICE, "simulation")
+        await self.run_all(self.feed(callback_update(u, "get_account")) for u in buyers)
+        waiting = [u for u in buyers if (w := self.m.otp_waits.for_user(u)) and not w.future.done()]
+
+        async def ticker():
+            while True:
+                expected = time.perf_counter() + interval
+                await asyncio.sleep(interval)
+                lags.append(max(0.0, time.perf_counter() - expected))
+
+        before = dict(self.m.callback_backpressure.stats()["shed"])
+        calls_before = dict(fake_session.calls)
+        probe = asyncio.create_task(ticker())
+        started = time.perf_counter()
+
+        async def poll():
+            tasks = []
+            for first in range(0, taps, batch):
+                tasks += [
+                    asyncio.create_task(self.feed(callback_update(abuser, buttons[i % len(buttons)])))
+                    for i in range(first, min(taps, first + batch))
+                ]
+                await asyncio.sleep(poll_ms / 1000)
+            await asyncio.gather(*tasks)
+
+        flood = asyncio.create_task(poll())
+        (latencies, seconds), (otp_latencies, _) = await asyncio.gather(
+            self.run_all(self.feed(callback_update(u, "balance")) for u in self.user_ids),
+            self.run_all(self.feed(callback_update(u, "get_otp")) for u in waiting),
+        )
+        await flood
+        elapsed = time.perf_counter() - started
+        probe.cancel()
+
+        shed = {k: v - before[k] for k, v in self.m.callback_backpressure.stats()["shed"].items()}
+        result = summarize("callback_flood", latencies, seconds)
+        result.update({
+            'abusive_taps': taps,
+            'abusive_handled': taps - sum(shed.values()),
+            'shed': shed,
+            'flood_seconds': round(elapsed, 4),
+            'waiting_buyers': len(waiting),
+            'get_otp_latency_ms': {
+                "p50": round(percentile(otp_latencies, 0.50) * 1000, 3),
+                "p99": round(percentile(otp_latencies, 0.99) * 1000, 3),
+                "max": round(max(otp_latencies) * 1000, 3) if otp_latencies else 0.0,
+            },
+            'api_calls': {k: v - calls_before.get(k, 0) for k, v in fake_session.calls.items() if v != calls_before.get(k, 0)},
+            'loop_lag_ms': {
+                "p50": round(percentile(lags, 0.50) * 1000, 3),
+                "p99": round(percentile(lags, 0.99) * 1000, 3),
+                "max": round(max(lags) * 1000, 3) if lags else 0.0,
+            },
+        })
+        return result
+
+    async def scenario_listener_workers(self, worker_counts, phones=200):
+        """Listener throughput against OTP_WORKERS, with chatty fake clients.
+
+        Each phone has a pending purchase and receives ChattyTelegramClient.chatter
+        messages before its login code; the run ends when every purchase has its
+        OTP. 0 workers is the in-process ListenerManager. Worker start-up is not
+        timed. Only meaningful with at least as many free cores as workers.
+        """
+        in_process = self.m.listeners
+        runs = []
+        for workers in worker_counts:
+            numbers = [f"+93{workers:02d}{i:08d}" for i in range(phones)]
+            for i, phone in enumerate(numbers):
+                await self.m.session_store.save(phone, phone)
+                await self.m.db.execute(
+                    "INSERT INTO purchases (user_id, number, status, otp) VALUES (?, ?, 'pending', '')",
+                    (20000 + workers * phones + i, phone),
+                )
+            if workers:
+                self.m.listener_worker_main = fake_listener_worker_main
+                listeners = self.m.ListenerCoordinator(workers, max_connected=phones * workers)  # no shard hits its cap
+                listeners.start()
+            else:
+                install_fake_clients(self.m, ChattyTelegramClient)
+                listeners = self.m.ListenerManager(phones, self.m.LISTENER_IDLE_TTL)
+            self.m.listeners = listeners
+            runner = asyncio.create_task(listeners.run())
+            while len(getattr(listeners, "worker_stats", ())) < workers:
+                await asyncio.sleep(0.05)
+
+            placeholders = ",".join("?" * phones)
+            started = time.perf_counter()
+            await asyncio.gather(*(listeners.acquire(phone) for phone in numbers))
+            done = 0
+            while done < phones and time.perf_counter() - started < 120:
+                await asyncio.sleep(0.01)
+                done, = await self.m.db.fetchone(
+                    f"SELECT COUNT(*) FROM purchases WHERE status='otp_received' AND number IN ({placeholders})", numbers
+                )
+            seconds = time.perf_counter() - started
+
+            await asyncio.gather(*(listeners.disconnect(phone) for phone in numbers))
+            runner.cancel()
+            listeners.stop()
+            runs.append({
+                "otp_workers": workers,
+                "otps": done,
+                "seconds": round(seconds, 4),
+                "otps_per_second": round(done / seconds, 1),
+                "messages_per_second": round(done * (ChattyTelegramClient.chatter + 1) / seconds, 1),
+            })
+        install_fake_clients(self.m)
+        self.m.listeners = in_process
+        return {
+            "scenario": "listener_workers",
+            "phones": phones,
+            "messages_per_phone": ChattyTelegramClient.chatter + 1,
+            "cpu_count": os.cpu_count(),
+            "runs": runs,
+        }
+
+def _git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL,
+        ).decode().strip()
+    except Exception:
+        return None
+
+async def simulate(args):
+    import telegram_otp_bot as m
+
+    m.startup()
+    install_fake_clients(m)
+    fake_session = FakeSession(latency=args.api_latency_ms / 1000)
+    m.bot.session = fake_session.session
+    if args.unthrottled:
+        m.outbox.global_bucket = m.TokenBucket(1e9)
+        m.outbox.chat_rate = 1e9
+
+    await m.init_db()
+    background = [asyncio.create_task(m.outbox.run()), asyncio.create_task(m.scheduler.run())]
+    sim = Simulation(m, args.users, args.concurrency)
+
+    tracemalloc.start()
+    results = [await sim.scenario_deposits(), await sim.scenario_purchases()]
+    results.append(await sim.scenario_otp_burst(fake_session))
+    results.append(await sim.scenario_cancels())
+    results.append(await sim.scenario_session_faults())
+    _, peak_traced = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    # Tracing slows every allocation, which would inflate the loop lag it measures
+    results.append(await sim.scenario_callback_flood(fake_session))
+    if args.otp_workers:
+        results.append(await sim.scenario_listener_workers(args.otp_workers))
+
+    for task in background:
+        task.cancel()
+    m.db.close()
+    return {
+        "revision": _git_revision(),
+        "python": sys.version.split()[0],
+        "users": args.users,
+        "concurrency": args.concurrency,
+        "api_latency_ms": args.api_latency_ms,
+        "unthrottled": args.unthrottled,
+        "otp_workers": args.otp_workers,
+        "scenarios": results,
+        "api_calls": fake_session.calls,
+        "outbox": m.outbox.stats(),
+        "deposit_qr": m.deposit_qr_cache.stats(),
+        "peak_traced_mib": round(peak_traced / 2**20, 2),
+        "max_rss_mib": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 2),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load simulation for telegram_otp_bot")
+    parser.add_argument("--users", type=int, default=200, help="simulated users per scenario")
+    parser.add_argument("--concurrency", type=int, default=50, help="updates in flight at once")
+    parser.add_argument("--api-latency-ms", type=float, default=0.0, help="simulated Bot API round trip")
+    parser.add_argument("--unthrottled", action="store_true", help="disable outbox rate limits")
+    parser.add_argument("--otp-workers", type=lambda v: [int(n) for n in v.split(",") if n], default=[0, 1, 2, 4],
+                        help="comma-separated OTP_WORKERS values to compare listener throughput across (empty to skip)")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+    output = os.path.abspath(args.output) if args.output else None
+
+    with tempfile.TemporaryDirectory(prefix="otp-sim-") as workdir:
+        _prepare_environment(workdir)
+        report = asyncio.run(simulate(args))
+
+    text = json.dumps(report, indent=2)
+    if output:
+        with open(output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main()
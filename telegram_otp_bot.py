@@ -1,22 +1,43 @@
 # === Required Libraries ===
-from aiogram import Bot, Dispatcher, types
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram import Bot, Dispatcher, F, types
+from aiogram.types import BufferedInputFile, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.filters import Command
-from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiogram.filters.callback_data import CallbackData
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.fsm.storage.base import BaseStorage
+from aiogram.exceptions import TelegramBadRequest, TelegramNetworkError, TelegramRetryAfter
 from aiohttp import web
 import sqlite3
+import argparse
 import asyncio
-from telethon import TelegramClient, events
-import os, re, hmac, hashlib
-from io import BytesIO
-import qrcode
-
-from flask import Flask, request
-import razorpay
+import bisect
+import csv
+import functools
+import logging
+import heapq
+import io
+import itertools
+import multiprocessing
+import queue
+import random
+import shutil
+import tarfile
+import tempfile
+import time
+import urllib.parse
+from collections import OrderedDict, deque
+from decimal import Decimal, InvalidOperation
+from concurrent.futures import ThreadPoolExecutor
+from telethon import TelegramClient, errors, events
+from telethon.sessions import SQLiteSession, StringSession
+import os, re, sys, hmac, hashlib, json, secrets
 
 # === Configuration ===
 def check_env_vars():
     required_vars = ["API_TOKEN", "API_ID", "API_HASH", "OWNER_ID", "OWNER_USERNAME"]
+    if os.getenv("BOT_MODE", "polling") == "webhook":
+        required_vars.append("WEBHOOK_BASE_URL")
     missing_vars = []
     
     for var in required_vars:
@@ -28,34 +49,305 @@ def check_env_vars():
         print("Please set these environment variables in the Secrets tab")
         exit(1)
 
-check_env_vars()
-
+# Read at import so handlers can be declared; validated by startup()
 API_TOKEN = os.getenv("API_TOKEN")
-API_ID = int(os.getenv("API_ID"))
+API_ID = int(os.getenv("API_ID") or 0)
 API_HASH = os.getenv("API_HASH")
-OWNER_ID = int(os.getenv("OWNER_ID"))
+OWNER_ID = int(os.getenv("OWNER_ID") or 0)
 OWNER_USERNAME = os.getenv("OWNER_USERNAME")
 ACCOUNT_PRICE = 45  # This can stay hardcoded or be made env too
 UPI_ID = os.getenv("UPI_ID")
 RAZORPAY_KEY_ID = os.getenv("RAZORPAY_KEY_ID")
-RAZORPAY_KEY_SECRET = os.getenv("RAZORPAY_KEY_SECRET")
 WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
 
-SESSION_DIR = "sessions"
-os.makedirs(SESSION_DIR, exist_ok=True)
-
-# === Razorpay Setup (Optional) ===
-client_rzp = None
-if RAZORPAY_KEY_ID and RAZORPAY_KEY_SECRET:
-    client_rzp = razorpay.Client(auth=(RAZORPAY_KEY_ID, RAZORPAY_KEY_SECRET))
-    print("✅ Razorpay client initialized")
-else:
-    print("⚠️ Razorpay credentials not found - webhook functionality disabled")
+# Update delivery: "polling" (default) or "webhook"
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL", "").rstrip("/")
+BOT_WEBHOOK_PATH = os.getenv("BOT_WEBHOOK_PATH", "/telegram-webhook")
+# Telegram echoes this in X-Telegram-Bot-Api-Secret-Token; a random one is used if unset
+TELEGRAM_WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+WEB_SERVER_HOST = os.getenv("WEB_SERVER_HOST", "0.0.0.0")
+WEB_SERVER_PORT = int(os.getenv("WEB_SERVER_PORT", "8080"))
+
+SESSION_DIR = "sessions"  # legacy .session files, migrated into the database at startup
+
+# === Logging & Metrics ===
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")  # "text" or "json"
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "0") == "1"
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+
+class JsonLogFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+def setup_logging():
+    handler = logging.StreamHandler()
+    if LOG_FORMAT == "json":
+        handler.setFormatter(JsonLogFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    logging.basicConfig(level=LOG_LEVEL, handlers=[handler], force=True)
+
+logger = logging.getLogger("otp_bot")
+
+class _NullMetric:
+    """Stand-in for every metric when instrumentation is disabled"""
+
+    def inc(self, amount=1, **labels):
+        pass
+
+    def set(self, value, **labels):
+        pass
+
+    def observe(self, value, **labels):
+        pass
+
+    def count(self, **labels):
+        return 0
+
+    def quantile(self, q, **labels):
+        return 0.0
+
+_NULL_METRIC = _NullMetric()
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        for key, value in self.values.items():
+            yield self.name, key, value
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def __init__(self, name, help, function=None):
+        super().__init__(name, help)
+        self.function = function
+
+    def set(self, value, **labels):
+        self.values[tuple(sorted(labels.items()))] = value
+
+    def samples(self):
+        if self.function is not None:
+            self.set(self.function())
+        yield from super().samples()
+
+class Histogram:
+    kind = 'histogram'
+    DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.series = {}  # labels -> [bucket counts..., sum, count]
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = [0] * (len(self.buckets) + 2)
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            series[index] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def count(self, **labels):
+        series = self.series.get(tuple(sorted(labels.items())))
+        return series[-1] if series else 0
+
+    def quantile(self, q, **labels):
+        """Upper bucket bound containing the q-th observation"""
+        series = self.series.get(tuple(sorted(labels.items())))
+        if not series:
+            return 0.0
+        target = q * series[-1]
+        seen = 0
+        for bound, count in zip(self.buckets, series):
+            seen += count
+            if count and seen >= target:
+                return bound
+        return float('inf')
+
+    def samples(self):
+        for key, series in self.series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                yield f"{self.name}_bucket", key + (('le', repr(bound)),), cumulative
+            yield f"{self.name}_bucket", key + (('le', '+Inf'),), series[-1]
+            yield f"{self.name}_sum", key, series[-2]
+            yield f"{self.name}_count", key, series[-1]
+
+class MetricsRegistry:
+    """Process-local metrics rendered in the Prometheus text format.
+
+    With enabled=False every factory returns a shared no-op metric, so
+    instrumented code costs one method call per sample.
+    """
+
+    def __init__(self, enabled):
+        self.enabled = enabled
+        self.metrics = []
+
+    def _register(self, metric):
+        if not self.enabled:
+            return _NULL_METRIC
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help):
+        return self._register(Counter(name, help))
+
+    def gauge(self, name, help, function=None):
+        return self._register(Gauge(name, help, function))
+
+    def histogram(self, name, help, buckets=Histogram.DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                if labels:
+                    label_text = ",".join(f'{k}="{v}"' for k, v in labels)
+                    lines.append(f"{name}{{{label_text}}} {value}")
+                else:
+                    lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry(METRICS_ENABLED)
+UPDATE_SECONDS = metrics.histogram("otp_bot_update_seconds", "Time spent handling an update, by handler")
+SQL_SECONDS = metrics.histogram("otp_bot_sql_seconds", "Database call time including pool wait, by query")
+OTP_DELIVERY_SECONDS = metrics.histogram("otp_bot_otp_delivery_seconds", "OTP detection to user notification")
+OTPS_DETECTED = metrics.counter("otp_bot_otps_detected_total", "OTPs extracted from incoming messages")
+OUTBOX_SEND_SECONDS = metrics.histogram("otp_bot_outbox_send_seconds", "Enqueue to delivery time of outbound messages, by lane")
+OUTBOX_FAILURES = metrics.counter("otp_bot_outbox_failures_total", "Outbound messages dropped after errors")
+CALLBACKS_SHED = metrics.counter("otp_bot_callbacks_shed_total", "Callback queries answered without running a handler, by reason")
+STOCK_AVAILABLE = metrics.gauge("otp_bot_stock_available", "Numbers waiting in stock_queue")
+FSM_ENTRIES = metrics.gauge("otp_bot_fsm_entries", "Conversation states held by the FSM storage")
+FSM_BYTES = metrics.gauge("otp_bot_fsm_bytes", "Approximate size of the FSM storage")
+
+_SQL_NAME = re.compile(r"^\s*(SELECT|INSERT|UPDATE|DELETE)\b.*?\b(?:FROM|INTO|UPDATE)\s+(\w+)", re.IGNORECASE | re.DOTALL)
+
+@functools.lru_cache(maxsize=256)
+def sql_query_name(sql):
+    """Low-cardinality metric label for a SQL statement, e.g. 'select:purchases'"""
+    match = _SQL_NAME.match(sql)
+    if not match:
+        return sql.split(None, 1)[0].lower()
+    verb, table = match.groups()
+    if verb.upper() == "UPDATE":
+        table = re.match(r"\s*UPDATE\s+(\w+)", sql, re.IGNORECASE).group(1)
+    return f"{verb.lower()}:{table}"
 
 # === Database Setup ===
-def init_db():
-    os.makedirs("data", exist_ok=True)
-    conn = sqlite3.connect("data/users.db")
+DB_PATH = "data/users.db"
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "4"))
+
+class Storage:
+    """Pool of long-lived SQLite connections (WAL mode) used from worker threads.
+
+    Queries never run on the event loop: every call is handed to a small
+    thread pool and awaited, so a writer holding the file lock only delays
+    the coroutine that asked for it.
+    """
+
+    def __init__(self, path, pool_size=4):
+        self.path = path
+        self.pool_size = pool_size
+        self._pool = queue.Queue()
+        self._executor = None
+
+    def open(self):
+        if self._executor is not None:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        for _ in range(self.pool_size):
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=10000")
+            self._pool.put(conn)
+        self._executor = ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix="db")
+
+    def close(self):
+        if self._executor is None:
+            return
+        self._executor.shutdown(wait=True)
+        self._executor = None
+        while not self._pool.empty():
+            self._pool.get_nowait().close()
+
+    def _call(self, fn, *args):
+        conn = self._pool.get()
+        try:
+            return fn(conn, *args)
+        finally:
+            self._pool.put(conn)
+
+    async def run(self, fn, *args, name=None):
+        """Run fn(conn, *args) on a pooled connection off the event loop"""
+        loop = asyncio.get_running_loop()
+        if not METRICS_ENABLED:
+            return await loop.run_in_executor(self._executor, self._call, fn, *args)
+        started = time.perf_counter()
+        try:
+            return await loop.run_in_executor(self._executor, self._call, fn, *args)
+        finally:
+            SQL_SECONDS.observe(time.perf_counter() - started, query=name or fn.__name__.strip('_'))
+
+    @staticmethod
+    def _transaction(conn, fn, *args):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = fn(conn, *args)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return result
+
+    async def transaction(self, fn, *args):
+        """Run fn(conn, *args) inside BEGIN IMMEDIATE ... COMMIT"""
+        return await self.run(self._transaction, fn, *args, name=fn.__name__.strip('_'))
+
+    async def execute(self, sql, params=()):
+        return await self.run(lambda conn: conn.execute(sql, params).rowcount, name=sql_query_name(sql))
+
+    async def fetchone(self, sql, params=()):
+        return await self.run(lambda conn: conn.execute(sql, params).fetchone(), name=sql_query_name(sql))
+
+    async def fetchall(self, sql, params=()):
+        return await self.run(lambda conn: conn.execute(sql, params).fetchall(), name=sql_query_name(sql))
+
+db = Storage(DB_PATH, pool_size=DB_POOL_SIZE)
+
+# Schema migrations, applied in order and tracked with PRAGMA user_version.
+# Never edit a released migration; append a new one instead.
+def _migration_1_base_schema(conn):
     c = conn.cursor()
     c.execute('''CREATE TABLE IF NOT EXISTS users (id INTEGER PRIMARY KEY, balance INTEGER)''')
     c.execute('''CREATE TABLE IF NOT EXISTS purchases (
@@ -75,262 +367,2170 @@ def init_db():
         status TEXT,
         requested_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
     )''')
-    conn.commit()
-    conn.close()
 
-def get_balance(user_id):
-    conn = sqlite3.connect("data/users.db")
+def _migration_2_ids_and_indexes(conn):
     c = conn.cursor()
-    c.execute("SELECT balance FROM users WHERE id=?", (user_id,))
-    res = c.fetchone()
-    conn.close()
+    # Rebuild purchases with an explicit id; old rowids are kept so ordering is preserved
+    c.execute('''CREATE TABLE purchases_new (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        number TEXT NOT NULL,
+        status TEXT NOT NULL,
+        otp TEXT NOT NULL DEFAULT '',
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''')
+    c.execute('''INSERT INTO purchases_new (id, user_id, number, status, otp)
+        SELECT rowid, user_id, number, status, COALESCE(otp, '') FROM purchases ORDER BY rowid''')
+    c.execute("DROP TABLE purchases")
+    c.execute("ALTER TABLE purchases_new RENAME TO purchases")
+    # get_user_by_phone: number+status, newest first (rowid is implicit in the index)
+    c.execute("CREATE INDEX idx_purchases_number_status ON purchases (number, status)")
+    # get_pending_purchase / set_otp / cancel_purchase: covers number+status
+    c.execute("CREATE INDEX idx_purchases_user_status ON purchases (user_id, status, number)")
+    # get_latest_otp: user_id+number, newest first
+    c.execute("CREATE INDEX idx_purchases_user_number ON purchases (user_id, number)")
+
+    c.execute('''CREATE TABLE utr_requests_new (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        utr TEXT NOT NULL,
+        amount INTEGER NOT NULL,
+        status TEXT NOT NULL,
+        requested_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''')
+    c.execute('''INSERT INTO utr_requests_new (id, user_id, utr, amount, status, requested_at)
+        SELECT rowid, user_id, utr, amount, status, requested_at FROM utr_requests ORDER BY rowid''')
+    c.execute("DROP TABLE utr_requests")
+    c.execute("ALTER TABLE utr_requests_new RENAME TO utr_requests")
+    # approve_/reject_: user_id+status
+    c.execute("CREATE INDEX idx_utr_user_status ON utr_requests (user_id, status)")
+
+def _migration_3_stock_queue(conn):
+    # Sellable stock as a FIFO queue; popping the lowest id is a primary key seek
+    conn.execute('''CREATE TABLE stock_queue (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        phone TEXT NOT NULL UNIQUE,
+        added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''')
+
+def _migration_4_payments(conn):
+    conn.execute('''CREATE TABLE payments (
+        payment_id TEXT PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        amount INTEGER NOT NULL,
+        credited_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''')
+
+def _migration_5_scheduled_jobs(conn):
+    conn.execute('''CREATE TABLE scheduled_jobs (
+        kind TEXT NOT NULL,
+        key TEXT NOT NULL,
+        due_at REAL NOT NULL,
+        PRIMARY KEY (kind, key)
+    )''')
+
+def _migration_6_ledger(conn):
+    # Append-only record of every wallet movement; users.balance is its running total
+    conn.execute('''CREATE TABLE ledger (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        delta INTEGER NOT NULL,
+        reason TEXT NOT NULL,
+        ref TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''')
+    conn.execute("CREATE INDEX idx_ledger_user ON ledger (user_id)")
+    conn.execute("UPDATE users SET balance = 0 WHERE balance IS NULL")
+    conn.execute("INSERT INTO ledger (user_id, delta, reason) SELECT id, balance, 'opening' FROM users WHERE balance != 0")
+
+def _migration_7_fsm_state(conn):
+    conn.execute('''CREATE TABLE fsm_state (
+        key TEXT PRIMARY KEY,
+        state TEXT,
+        data TEXT NOT NULL DEFAULT '{}',
+        expires_at REAL NOT NULL
+    )''')
+    conn.execute("CREATE INDEX idx_fsm_state_expires ON fsm_state (expires_at)")
+
+def _migration_8_sessions(conn):
+    conn.execute('''CREATE TABLE sessions (
+        phone TEXT PRIMARY KEY,
+        session TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'unchecked',
+        error TEXT,
+        checked_at TIMESTAMP,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''')
+    conn.execute("CREATE INDEX idx_sessions_status ON sessions (status)")
+
+def _migration_9_dashboard(conn):
+    conn.execute("ALTER TABLE purchases ADD COLUMN otp_at TIMESTAMP")
+    conn.execute('''CREATE TABLE dashboard_stats (
+        name TEXT NOT NULL,
+        day TEXT NOT NULL,
+        value INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (name, day)
+    )''')
+    conn.executemany(
+        "INSERT INTO dashboard_stats (name, day, value) VALUES (?, ?, ?)",
+        [(name, day, value) for (name, day), value in rebuild_dashboard_stats(conn).items()],
+    )
+
+def _migration_10_unique_utr(conn):
+    # One UTR pays once. Existing copies of a live (pending/approved) UTR are set
+    # aside as 'duplicate', keeping the approved one or else the oldest request.
+    conn.execute("UPDATE utr_requests SET utr = UPPER(REPLACE(utr, ' ', ''))")
+    conn.execute('''UPDATE utr_requests SET status='duplicate', updated_at=CURRENT_TIMESTAMP
+        WHERE status IN ('pending', 'approved') AND id != (
+            SELECT keep.id FROM utr_requests AS keep
+            WHERE keep.utr = utr_requests.utr AND keep.status IN ('pending', 'approved')
+            ORDER BY keep.status = 'approved' DESC, keep.id LIMIT 1
+        )''')
+    # Rejected and expired UTRs may be submitted again
+    conn.execute("CREATE UNIQUE INDEX idx_utr_live ON utr_requests (utr) WHERE status IN ('pending', 'approved')")
+
+def _migration_11_status_indexes(conn):
+    # get_pending_numbers (listeners at startup) and reconcile_statement look up by status alone
+    conn.execute("CREATE INDEX idx_purchases_status_number ON purchases (status, number)")
+    conn.execute("CREATE INDEX idx_utr_status ON utr_requests (status)")
+
+MIGRATIONS = [
+    _migration_1_base_schema,
+    _migration_2_ids_and_indexes,
+    _migration_3_stock_queue,
+    _migration_4_payments,
+    _migration_5_scheduled_jobs,
+    _migration_6_ledger,
+    _migration_7_fsm_state,
+    _migration_8_sessions,
+    _migration_9_dashboard,
+    _migration_10_unique_utr,
+    _migration_11_status_indexes,
+]
+
+def _migrate(conn):
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        migration(conn)
+        conn.execute(f"PRAGMA user_version = {number}")
+    return version, len(MIGRATIONS)
+
+async def init_db():
+    db.open()
+    old_version, new_version = await db.transaction(_migrate)
+    if old_version != new_version:
+        logger.info(f"✅ Database migrated from v{old_version} to v{new_version}")
+    await import_stock_file()
+    await migrate_session_files()
+
+STOCK_FILE = "data/account_stock.txt"
+
+async def import_stock_file(path=STOCK_FILE):
+    """One-time import of the legacy text stock file into stock_queue"""
+    if not os.path.exists(path):
+        return
+    with open(path) as f:
+        phones = [line.strip() for line in f if line.strip()]
+
+    def insert_stock_rows(conn):
+        added = conn.executemany("INSERT OR IGNORE INTO stock_queue (phone) VALUES (?)", [(p,) for p in phones]).rowcount
+        _bump(conn, 'stock_available', added, daily=False)
+        conn.executemany("INSERT OR IGNORE INTO stock_log (phone) VALUES (?)", [(p,) for p in phones])
+
+    await db.transaction(insert_stock_rows)
+    os.replace(path, path + ".imported")
+    logger.info(f"✅ Imported {len(phones)} numbers from {path} into stock queue")
+
+# === Session Store ===
+SESSION_STATUSES = ('unchecked', 'valid', 'quarantined', 'unauthorized', 'banned', 'corrupt', 'error')
+
+SESSION_SQL = "SELECT session FROM sessions WHERE phone=?"
+SESSION_PHONES_SQL = "SELECT phone FROM sessions WHERE status IN ({marks})"
+
+class SessionStore:
+    """Telethon auth keys for every number, kept as StringSession strings in one table.
+
+    Replaces the one-SQLite-file-per-phone layout under SESSION_DIR. Each row
+    carries an explicit status set by validation instead of guessing
+    corruption from file sizes; rows are only deleted on logout.
+    """
+
+    async def get(self, phone):
+        row = await db.fetchone(SESSION_SQL, (phone,))
+        return row[0] if row else None
+
+    async def save(self, phone, session, status='valid'):
+        await db.execute(
+            "INSERT INTO sessions (phone, session, status, checked_at) VALUES (?, ?, ?, CURRENT_TIMESTAMP) "
+            "ON CONFLICT(phone) DO UPDATE SET session=excluded.session, status=excluded.status, "
+            "checked_at=excluded.checked_at, error=NULL, updated_at=CURRENT_TIMESTAMP",
+            (phone, session, status),
+        )
+
+    async def mark_error(self, phone, error):
+        """Record a transient failure without losing a quarantine (which decides restocking)"""
+        await db.execute(
+            "UPDATE sessions SET status=CASE WHEN status='quarantined' THEN status ELSE 'error' END, "
+            "error=?, checked_at=CURRENT_TIMESTAMP, updated_at=CURRENT_TIMESTAMP WHERE phone=?",
+            (error, phone),
+        )
+
+    async def mark(self, phone, status, error=None):
+        await db.execute(
+            "UPDATE sessions SET status=?, error=?, checked_at=CURRENT_TIMESTAMP, updated_at=CURRENT_TIMESTAMP WHERE phone=?",
+            (status, error, phone),
+        )
+
+    async def delete(self, phone):
+        await db.execute("DELETE FROM sessions WHERE phone=?", (phone,))
+
+    async def phones(self, statuses=None):
+        if statuses is None:
+            rows = await db.fetchall("SELECT phone FROM sessions")
+        else:
+            marks = ",".join("?" * len(statuses))
+            rows = await db.fetchall(SESSION_PHONES_SQL.format(marks=marks), tuple(statuses))
+        return [row[0] for row in rows]
+
+    async def counts(self):
+        rows = await db.fetchall("SELECT status, COUNT(*) FROM sessions GROUP BY status")
+        return dict(rows)
+
+session_store = SessionStore()
+
+def new_client(session=None, **kwargs):
+    """TelegramClient backed by a StringSession (a fresh one if session is None)"""
+    return TelegramClient(StringSession(session or None), API_ID, API_HASH, **kwargs)
+
+def session_file_to_string(path):
+    """StringSession string of a legacy Telethon .session file, or None if it holds no auth key"""
+    session = SQLiteSession(path[:-len(".session")] if path.endswith(".session") else path)
+    try:
+        return StringSession.save(session) or None
+    finally:
+        session.close()
+
+async def migrate_session_files(directory=SESSION_DIR):
+    """One-time move of legacy .session files into the sessions table.
+
+    Migrated files are renamed to *.session.migrated; files without an auth
+    key (or that SQLite cannot read) are stored as 'corrupt' so they show up
+    in the counts rather than silently disappearing.
+    """
+    if not os.path.isdir(directory):
+        return 0
+    files = [f for f in os.listdir(directory) if f.endswith(".session")]
+    if not files:
+        return 0
+
+    def convert():
+        rows = []
+        for name in files:
+            try:
+                string = session_file_to_string(os.path.join(directory, name))
+            except Exception:
+                string = None
+            rows.append((name[:-len(".session")], string or "", 'unchecked' if string else 'corrupt'))
+        return rows
+
+    rows = await asyncio.to_thread(convert)
+
+    def insert_sessions(conn):
+        conn.executemany("INSERT OR IGNORE INTO sessions (phone, session, status) VALUES (?, ?, ?)", rows)
+
+    await db.transaction(insert_sessions)
+    for name in files:
+        os.replace(os.path.join(directory, name), os.path.join(directory, name + ".migrated"))
+    logger.info(f"✅ Migrated {len(rows)} session files from {directory} into the sessions table")
+    return len(rows)
+
+class BalanceCache:
+    """Bounded LRU of wallet balances, invalidated after every ledger write.
+
+    invalidate() stamps the user with a fresh value of one global counter;
+    a reader only caches what it fetched if no write landed while its query
+    was in flight. Stamps are bounded like the balances: forgetting one
+    raises the floor that unstamped users report, so a forgotten user never
+    goes back to a version an in-flight reader already holds.
+    """
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self._balances = OrderedDict()
+        self._versions = OrderedDict()
+        self._counter = 0
+        self._floor = 0
+
+    def version(self, user_id):
+        return self._versions.get(user_id, self._floor)
+
+    def get(self, user_id):
+        balance = self._balances.get(user_id)
+        if balance is not None:
+            self._balances.move_to_end(user_id)
+        return balance
+
+    def put(self, user_id, balance, version):
+        if self.version(user_id) != version:
+            return
+        self._balances[user_id] = balance
+        self._balances.move_to_end(user_id)
+        if len(self._balances) > self.max_size:
+            self._balances.popitem(last=False)
+
+    def invalidate(self, user_id):
+        self._balances.pop(user_id, None)
+        self._counter += 1
+        self._versions[user_id] = self._counter
+        self._versions.move_to_end(user_id)
+        if len(self._versions) > self.max_size:
+            _, self._floor = self._versions.popitem(last=False)
+
+balance_cache = BalanceCache()
+
+def _balance(conn, user_id):
+    res = conn.execute("SELECT balance FROM users WHERE id=?", (user_id,)).fetchone()
     return res[0] if res else 0
 
-def add_balance(user_id, amount):
-    conn = sqlite3.connect("data/users.db")
-    c = conn.cursor()
-    c.execute("INSERT OR IGNORE INTO users (id, balance) VALUES (?, ?)", (user_id, 0))
-    c.execute("UPDATE users SET balance = balance + ? WHERE id=?", (amount, user_id))
-    conn.commit()
-    conn.close()
+def _credit(conn, user_id, amount, reason='credit', ref=None):
+    conn.execute("INSERT INTO users (id, balance) VALUES (?, ?) ON CONFLICT(id) DO UPDATE SET balance = balance + excluded.balance", (user_id, amount))
+    conn.execute("INSERT INTO ledger (user_id, delta, reason, ref) VALUES (?, ?, ?, ?)", (user_id, amount, reason, ref))
+    _bump_ledger(conn, reason, amount)
+
+def _debit(conn, user_id, amount, reason, ref=None):
+    """Debit only if the balance covers it; returns False (and writes nothing) otherwise"""
+    debited = conn.execute("UPDATE users SET balance = balance - ? WHERE id=? AND balance >= ?", (amount, user_id, amount)).rowcount
+    if debited:
+        conn.execute("INSERT INTO ledger (user_id, delta, reason, ref) VALUES (?, ?, ?, ?)", (user_id, -amount, reason, ref))
+        _bump_ledger(conn, reason, -amount)
+    return bool(debited)
+
+async def get_balance(user_id):
+    balance = balance_cache.get(user_id)
+    if balance is None:
+        version = balance_cache.version(user_id)
+        balance = await db.run(_balance, user_id)
+        balance_cache.put(user_id, balance, version)
+    return balance
+
+async def add_balance(user_id, amount, reason='credit', ref=None):
+    try:
+        await db.transaction(_credit, user_id, amount, reason, ref)
+    finally:
+        balance_cache.invalidate(user_id)
 
-def deduct_balance(user_id, amount):
-    conn = sqlite3.connect("data/users.db")
-    c = conn.cursor()
-    c.execute("UPDATE users SET balance = balance - ? WHERE id=?", (amount, user_id))
-    conn.commit()
-    conn.close()
+# Hot-path queries are module constants so tests/test_query_plans.py checks the SQL that actually runs
+PENDING_PURCHASE_SQL = "SELECT number, status FROM purchases WHERE user_id=? AND status='pending'"
+USER_BY_PHONE_SQL = "SELECT user_id FROM purchases WHERE number=? AND status='pending' ORDER BY id DESC LIMIT 1"
 
-def save_purchase(user_id, number):
-    conn = sqlite3.connect("data/users.db")
-    c = conn.cursor()
-    c.execute("INSERT INTO purchases (user_id, number, status, otp) VALUES (?, ?, ?, ?)", (user_id, number, 'pending', ''))
-    conn.commit()
-    conn.close()
+async def get_pending_purchase(user_id):
+    return await db.fetchone(PENDING_PURCHASE_SQL, (user_id,))
 
-def get_pending_purchase(user_id):
-    conn = sqlite3.connect("data/users.db")
-    c = conn.cursor()
-    c.execute("SELECT number, status FROM purchases WHERE user_id=? AND status='pending'", (user_id,))
-    res = c.fetchone()
-    conn.close()
-    return res
+async def get_user_by_phone(phone):
+    res = await db.fetchone(USER_BY_PHONE_SQL, (phone,))
+    return res[0] if res else None
 
-def get_user_by_phone(phone):
-    conn = sqlite3.connect("data/users.db", timeout=10)
+async def get_stock_summary():
+    """Numbers available for sale (stock_log also keeps sold ones)"""
+    res = await db.fetchone("SELECT value FROM dashboard_stats WHERE name='stock_available' AND day=''")
+    return res[0] if res else 0
+
+async def add_to_stock(phone):
+    def insert_stock(conn):
+        added = conn.execute("INSERT OR IGNORE INTO stock_queue (phone) VALUES (?)", (phone,)).rowcount
+        _bump(conn, 'stock_available', added, daily=False)
+        conn.execute("INSERT OR IGNORE INTO stock_log (phone) VALUES (?)", (phone,))
+    await db.transaction(insert_stock)
+
+NEXT_STOCK_SQL = "SELECT id, phone FROM stock_queue ORDER BY id LIMIT 1"
+
+def _claim_account(conn, user_id, price):
+    res = conn.execute(NEXT_STOCK_SQL).fetchone()
+    if not res:
+        balance = _balance(conn, user_id)
+        return ('insufficient_balance' if balance < price else 'out_of_stock'), None, balance
+    stock_id, number = res
+    if not _debit(conn, user_id, price, 'purchase', number):
+        return 'insufficient_balance', None, _balance(conn, user_id)
+    conn.execute("DELETE FROM stock_queue WHERE id=?", (stock_id,))
+    _bump(conn, 'stock_available', -1, daily=False)
+    conn.execute("INSERT INTO purchases (user_id, number, status, otp) VALUES (?, ?, ?, ?)", (user_id, number, 'pending', ''))
+    return 'ok', number, _balance(conn, user_id)
+
+async def claim_account(user_id, price):
+    """Atomically pop a number from stock, charge the user and record the purchase.
+
+    Returns (status, number, balance) where status is 'ok',
+    'insufficient_balance' or 'out_of_stock'.
+    """
     try:
-        c = conn.cursor()
-        c.execute("SELECT user_id FROM purchases WHERE number=? AND status='pending' ORDER BY rowid DESC LIMIT 1", (phone,))
-        res = c.fetchone()
-        return res[0] if res else None
+        return await db.transaction(_claim_account, user_id, price)
     finally:
-        conn.close()
+        balance_cache.invalidate(user_id)
 
-def set_otp(user_id, otp):
-    conn = sqlite3.connect("data/users.db")
-    c = conn.cursor()
-    c.execute("UPDATE purchases SET otp=?, status='otp_received' WHERE user_id=? AND status='pending'", (otp, user_id))
-    conn.commit()
-    conn.close()
+CANCEL_PURCHASE_SQL = "UPDATE purchases SET status='cancelled', updated_at=CURRENT_TIMESTAMP WHERE user_id=? AND number=? AND status='pending'"
 
-def cancel_purchase(user_id):
-    conn = sqlite3.connect("data/users.db")
-    c = conn.cursor()
-    c.execute("UPDATE purchases SET status='cancelled' WHERE user_id=? AND status='pending'", (user_id,))
-    conn.commit()
-    conn.close()
+def _refund_purchase(conn, user_id, number, price):
+    cancelled = conn.execute(CANCEL_PURCHASE_SQL, (user_id, number)).rowcount
+    if not cancelled:
+        return False
+    _credit(conn, user_id, price, 'refund', number)
+    return True
 
-def get_stock_summary():
-    conn = sqlite3.connect("data/users.db")
-    c = conn.cursor()
-    c.execute("SELECT COUNT(*) FROM stock_log")
-    count = c.fetchone()[0]
-    conn.close()
-    return count
-
-def add_to_stock(phone):
-    os.makedirs("data", exist_ok=True)
-    with open("data/account_stock.txt", "a") as f:
-        f.write(phone + "\n")
-    conn = sqlite3.connect("data/users.db")
-    c = conn.cursor()
-    c.execute("INSERT OR IGNORE INTO stock_log (phone) VALUES (?)", (phone,))
-    conn.commit()
-    conn.close()
+async def refund_purchase(user_id, number, price):
+    """Cancel a pending purchase and refund it in one transaction.
 
-def set_otp_for_phone(phone, otp):
-    user_id = get_user_by_phone(phone)
+    The number does not go back to stock: every caller logs its session
+    out next, so it could never be sold again.
+    """
+    try:
+        return await db.transaction(_refund_purchase, user_id, number, price)
+    finally:
+        balance_cache.invalidate(user_id)
+
+# === Dashboard ===
+# Owner figures are running totals in dashboard_stats, bumped inside the
+# same transaction as the change they count, so reading them never scans
+# purchases or the ledger. Rows are keyed by (name, day): day is a UTC date
+# for daily figures and '' for all-time ones. rebuild_dashboard_stats()
+# recomputes everything from the raw tables for the consistency check.
+OTP_WAIT_BUCKETS = (5, 10, 20, 30, 45, 60, 90, 120, 180, 300, 600, 1200, float('inf'))
+# ledger reason -> (count stat, amount stat, sign applied to the ledger delta)
+LEDGER_STATS = {
+    'purchase': ('purchases', 'revenue', -1),
+    'refund': ('refunds', 'revenue', -1),
+    'utr': ('deposits', 'deposited', 1),
+    'razorpay': ('deposits', 'deposited', 1),
+}
+
+def otp_wait_stat(seconds):
+    bound = OTP_WAIT_BUCKETS[bisect.bisect_left(OTP_WAIT_BUCKETS, seconds)]
+    return f"otp_wait_le_{bound:g}"
+
+def _bump(conn, name, delta=1, daily=True):
+    if not delta:
+        return
+    sql = "INSERT INTO dashboard_stats (name, day, value) VALUES (?, {}, ?) ON CONFLICT(name, day) DO UPDATE SET value = value + excluded.value"
+    conn.execute(sql.format("''"), (name, delta))
+    if daily:
+        conn.execute(sql.format("date('now')"), (name, delta))
+
+def _bump_ledger(conn, reason, delta):
+    stats = LEDGER_STATS.get(reason)
+    if stats:
+        count_name, amount_name, sign = stats
+        _bump(conn, count_name)
+        _bump(conn, amount_name, sign * delta)
+
+def rebuild_dashboard_stats(conn):
+    """Every dashboard figure recomputed from the raw tables, as {(name, day): value}"""
+    stats = {}
+
+    def add(name, day, value):
+        for key in ((name, day), (name, '')):
+            stats[key] = stats.get(key, 0) + value
+
+    stats[('stock_available', '')] = conn.execute("SELECT COUNT(*) FROM stock_queue").fetchone()[0]
+    reasons = tuple(LEDGER_STATS)
+    rows = conn.execute(
+        f"SELECT reason, date(created_at), COUNT(*), SUM(delta) FROM ledger WHERE reason IN ({','.join('?' * len(reasons))}) GROUP BY reason, date(created_at)",
+        reasons,
+    )
+    for reason, day, count, total in rows:
+        count_name, amount_name, sign = LEDGER_STATS[reason]
+        add(count_name, day, count)
+        add(amount_name, day, sign * total)
+    rows = conn.execute("SELECT date(otp_at), (julianday(otp_at) - julianday(created_at)) * 86400 FROM purchases WHERE otp_at IS NOT NULL")
+    for day, wait in rows:
+        add('otps', day, 1)
+        stats[(otp_wait_stat(wait), '')] = stats.get((otp_wait_stat(wait), ''), 0) + 1
+    return {key: value for key, value in stats.items() if value}
+
+PENDING_PURCHASE_ID_SQL = "SELECT id FROM purchases WHERE user_id=? AND number=? AND status='pending'"
+
+def _record_otp(conn, user_id, phone, otp):
+    """Store the OTP on the pending purchase and count its wait; False if nothing was pending"""
+    row = conn.execute(PENDING_PURCHASE_ID_SQL, (user_id, phone)).fetchone()
+    if not row:
+        return False
+    conn.execute("UPDATE purchases SET otp=?, status='otp_received', otp_at=CURRENT_TIMESTAMP, updated_at=CURRENT_TIMESTAMP WHERE id=?", (otp, row[0]))
+    wait = conn.execute("SELECT (julianday(otp_at) - julianday(created_at)) * 86400 FROM purchases WHERE id=?", (row[0],)).fetchone()[0]
+    _bump(conn, 'otps')
+    _bump(conn, otp_wait_stat(wait), daily=False)
+    return True
+
+async def dashboard_snapshot():
+    """Today's and all-time figures, read from the running totals"""
+    rows = await db.fetchall("SELECT name, day, value FROM dashboard_stats WHERE day IN ('', date('now'))")
+    today = {name: value for name, day, value in rows if day}
+    total = {name: value for name, day, value in rows if not day}
+    purchases = total.get('purchases', 0)
+    otps = sum(total.get(otp_wait_stat(bound), 0) for bound in OTP_WAIT_BUCKETS)
+    median_wait = None
+    seen = 0
+    for bound in OTP_WAIT_BUCKETS:
+        seen += total.get(otp_wait_stat(bound), 0)
+        if otps and seen * 2 >= otps:
+            median_wait = bound
+            break
+    return {
+        'stock_available': total.get('stock_available', 0),
+        'sold_today': today.get('purchases', 0) - today.get('refunds', 0),
+        'revenue_today': today.get('revenue', 0),
+        'revenue_total': total.get('revenue', 0),
+        'deposited_today': today.get('deposited', 0),
+        'refund_rate': total.get('refunds', 0) / purchases if purchases else 0.0,
+        'otps_total': otps,
+        'median_otp_wait': median_wait,
+    }
+
+def format_dashboard(snapshot):
+    wait = snapshot['median_otp_wait']
+    if wait is None:
+        wait_text = "n/a"
+    elif wait == float('inf'):
+        wait_text = f"> {OTP_WAIT_BUCKETS[-2]}s"
+    else:
+        wait_text = f"≤ {wait:g}s"
+    return (
+        f"📊 Dashboard (UTC day)\n"
+        f"📦 Available stock: {snapshot['stock_available']}\n"
+        f"🛒 Sold today: {snapshot['sold_today']}\n"
+        f"💰 Revenue: ₹{snapshot['revenue_today']} today, ₹{snapshot['revenue_total']} total\n"
+        f"💳 Deposited today: ₹{snapshot['deposited_today']}\n"
+        f"↩️ Refund rate: {snapshot['refund_rate']:.1%}\n"
+        f"⏱️ Median OTP wait: {wait_text} ({snapshot['otps_total']} OTPs)"
+    )
+
+def _check_dashboard(conn, fix):
+    expected = rebuild_dashboard_stats(conn)
+    stored = {(name, day): value for name, day, value in conn.execute("SELECT name, day, value FROM dashboard_stats") if value}
+    diffs = [(key, stored.get(key, 0), expected.get(key, 0)) for key in sorted(set(stored) | set(expected)) if stored.get(key, 0) != expected.get(key, 0)]
+    if fix and diffs:
+        conn.execute("DELETE FROM dashboard_stats")
+        conn.executemany("INSERT INTO dashboard_stats (name, day, value) VALUES (?, ?, ?)", [(n, d, v) for (n, d), v in expected.items()])
+    return diffs
+
+async def check_dashboard(fix=False):
+    """Diff the running totals against a rebuild; returns [((name, day), stored, expected)].
+
+    With fix=True the totals are replaced by the rebuild in the same transaction.
+    """
+    return await db.transaction(_check_dashboard, fix)
+
+def format_dashboard_check(diffs, fixed=False):
+    if not diffs:
+        return "✅ Dashboard totals match the raw tables"
+    lines = [f"⚠️ {len(diffs)} dashboard totals differ from the raw tables" + (" (rebuilt)" if fixed else "")]
+    for (name, day), stored, expected in diffs[:30]:
+        lines.append(f"{name} [{day or 'total'}]: stored {stored}, expected {expected}")
+    return "\n".join(lines)
+
+class OtpWait:
+    """A buyer waiting for the OTP of one purchased number"""
+
+    def __init__(self, phone, user_id, chat_id, message_id):
+        self.phone = phone
+        self.user_id = user_id
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.future = asyncio.get_running_loop().create_future()
+
+class OtpRendezvous:
+    """In-memory meeting point between OTP listeners and waiting buyers.
+
+    get_account opens a wait on the message it sent; the listener resolves
+    it when the OTP arrives and edits that message, and "Get OTP" clicks are
+    answered from here without touching the database.
+    """
+
+    def __init__(self):
+        self.by_phone = {}
+        self.by_user = {}
+
+    def open(self, phone, user_id, chat_id, message_id):
+        wait = OtpWait(phone, user_id, chat_id, message_id)
+        self.by_phone[phone] = wait
+        self.by_user[user_id] = wait
+        return wait
+
+    def for_user(self, user_id):
+        return self.by_user.get(user_id)
+
+    def resolve(self, phone, otp):
+        wait = self.by_phone.get(phone)
+        if wait and not wait.future.done():
+            wait.future.set_result(otp)
+        return wait
+
+    def close(self, phone):
+        wait = self.by_phone.pop(phone, None)
+        if wait is None:
+            return
+        if self.by_user.get(wait.user_id) is wait:
+            del self.by_user[wait.user_id]
+        if not wait.future.done():
+            wait.future.cancel()
+
+otp_waits = OtpRendezvous()
+
+def otp_received_text(phone, otp):
+    return (
+        f"📱 **OTP Received!**\n"
+        f"📞 Number: `{phone}`\n"
+        f"🔢 OTP: `{otp}`\n\n"
+        f"✅ Use this OTP for your verification.\n"
+        f"🔒 Account will be automatically logged out after use."
+    )
+
+async def set_otp_for_phone(phone, otp, detected_at=None):
+    user_id = await get_user_by_phone(phone)
     if user_id:
-        conn = sqlite3.connect("data/users.db", timeout=10)
         try:
-            c = conn.cursor()
-            c.execute("UPDATE purchases SET otp=?, status='otp_received' WHERE user_id=? AND number=? AND status='pending'", (otp, user_id, phone))
-            conn.commit()
-            print(f"📲 OTP {otp} set for user {user_id} and number {phone}")
+            await db.transaction(_record_otp, user_id, phone, otp)
+            logger.debug(f"📲 OTP {otp} set for user {user_id} and number {phone}")
             
+            listeners.release(phone)
+            wait = otp_waits.resolve(phone, otp)
+
             # Notify user immediately
-            asyncio.create_task(notify_user_otp_received(user_id, phone, otp))
+            asyncio.create_task(notify_user_otp_received(user_id, phone, otp, wait, detected_at))
+            # The purchase is used now, so it can no longer expire
+            await scheduler.cancel('expire_purchase', f"{user_id}:{phone}")
         except Exception as e:
-            print(f"Error setting OTP: {e}")
-        finally:
-            conn.close()
+            logger.error(f"Error setting OTP: {e}")
 
-async def notify_user_otp_received(user_id, phone, otp):
-    """Notify user immediately when OTP is received"""
+async def notify_user_otp_received(user_id, phone, otp, wait=None, detected_at=None):
+    """Notify user immediately when OTP is received, editing the purchase message in place"""
     try:
-        await bot.send_message(
-            user_id,
-            f"📱 **OTP Received!**\n"
-            f"📞 Number: `{phone}`\n"
-            f"🔢 OTP: `{otp}`\n\n"
-            f"✅ Use this OTP for your verification.\n"
-            f"🔒 Account will be automatically logged out after use.",
-            parse_mode='Markdown'
-        )
+        edited = False
+        if wait is not None:
+            try:
+                await outbox.edit(wait.chat_id, wait.message_id, otp_received_text(phone, otp), lane=LANE_OTP, parse_mode='Markdown')
+                edited = True
+            except Exception as e:
+                logger.warning(f"Could not edit purchase message for {phone}: {e}")
+        if not edited:
+            await outbox.send(user_id, otp_received_text(phone, otp), lane=LANE_OTP, parse_mode='Markdown')
+        if detected_at is not None:
+            OTP_DELIVERY_SECONDS.observe(time.perf_counter() - detected_at)
         
         # Auto logout after 5 minutes of OTP being received
-        asyncio.create_task(auto_logout_after_delay(phone, 300))  # 5 minutes delay
+        await scheduler.schedule('logout', phone, AUTO_LOGOUT_DELAY)
         
     except Exception as e:
-        print(f"Failed to notify user {user_id}: {e}")
-
-async def auto_logout_after_delay(phone, delay):
-    """Automatically logout session after delay"""
-    await asyncio.sleep(delay)
-    await logout_session(phone)
-    print(f"🔒 Auto-logged out {phone} after {delay} seconds")
+        logger.error(f"Failed to notify user {user_id}: {e}")
 
 async def logout_session(phone):
     """Logout and disconnect a specific phone session"""
+    otp_waits.close(phone)
     try:
         # Disconnect active listener if exists
-        if phone in active_listeners:
-            client = active_listeners[phone]
-            if client.is_connected():
-                await client.log_out()
-                await client.disconnect()
-            del active_listeners[phone]
-            print(f"🔒 Disconnected active listener for {phone}")
+        if await listeners.disconnect(phone, log_out=True):
+            logger.info(f"🔒 Disconnected active listener for {phone}")
         
-        # Also logout from session file
-        session_path = f"{SESSION_DIR}/{phone}.session"
-        if os.path.exists(session_path):
-            client = TelegramClient(f"{SESSION_DIR}/{phone}", API_ID, API_HASH)
+        # Also log out the stored session in case no listener was connected
+        session = await session_store.get(phone)
+        if session is not None:
+            client = new_client(session)
             await client.connect()
             if await client.is_user_authorized():
                 await client.log_out()
             await client.disconnect()
-            
-            # Remove session file
-            os.remove(session_path)
-            print(f"🔒 Logged out and removed session for {phone}")
+
+            await session_store.delete(phone)
+            logger.info(f"🔒 Logged out and removed session for {phone}")
         
     except Exception as e:
-        print(f"Error logging out {phone}: {e}")
+        logger.error(f"Error logging out {phone}: {e}")
+    finally:
+        # A logged-out number must not stay for sale
+        await db.transaction(_unstock, phone)
 
-def save_utr_request(user_id, utr, amount):
-    conn = sqlite3.connect("data/users.db")
-    c = conn.cursor()
-    c.execute("INSERT INTO utr_requests (user_id, utr, amount, status) VALUES (?, ?, ?, ?)", (user_id, utr, amount, 'pending'))
-    conn.commit()
-    conn.close()
+UNSTOCK_SQL = "DELETE FROM stock_queue WHERE phone=?"
 
-async def start_otp_listener(phone):
-    """Start OTP listener for a specific phone number"""
-    # Prevent multiple listeners for the same phone
-    if phone in active_listeners:
-        print(f"⚠️ Listener already active for {phone}")
-        return
-    
+def _unstock(conn, phone):
+    removed = conn.execute(UNSTOCK_SQL, (phone,)).rowcount
+    _bump(conn, 'stock_available', -removed, daily=False)
+    return removed
+
+def normalize_utr(utr):
+    """Canonical form used for the unique index and statement matching"""
+    return re.sub(r"\s+", "", utr).upper()
+
+# A 12-digit UPI RRN, or a 16-22 character IMPS/NEFT/RTGS reference with at
+# least one digit. Anything shorter (IFSC codes, names) could be read off
+# someone else's statement line.
+_UTR_FORMAT = re.compile(r"\d{12}|(?=[A-Z]*\d)[A-Z0-9]{16,22}")
+
+def is_valid_utr(utr):
+    """Whether a normalized UTR has the shape of a bank transaction reference"""
+    return _UTR_FORMAT.fullmatch(utr) is not None
+
+async def save_utr_request(user_id, utr, amount):
+    """Record a pending request; returns its id, or None if the UTR is already pending or approved"""
+    def insert_utr_request(conn):
+        return conn.execute("INSERT INTO utr_requests (user_id, utr, amount, status) VALUES (?, ?, ?, ?)", (user_id, normalize_utr(utr), amount, 'pending')).lastrowid
     try:
-        client = TelegramClient(f"{SESSION_DIR}/{phone}", API_ID, API_HASH, 
-                              connection_retries=5, retry_delay=1)
-        active_listeners[phone] = client
-        
+        return await db.run(insert_utr_request)
+    except sqlite3.IntegrityError:
+        return None
+
+UTR_REQUEST_BY_AMOUNT_SQL = "SELECT id FROM utr_requests WHERE user_id=? AND status='pending' AND amount=? ORDER BY id LIMIT 1"
+UTR_REQUEST_BY_USER_SQL = "SELECT id FROM utr_requests WHERE user_id=? AND status='pending' ORDER BY id LIMIT 1"
+PENDING_UTR_REQUEST_SQL = "SELECT user_id, amount FROM utr_requests WHERE id=? AND status='pending'"
+
+def _find_utr_request(conn, user_id, amount):
+    # Owner buttons sent before they carried a request id: the user's oldest pending request, same amount first
+    res = (
+        conn.execute(UTR_REQUEST_BY_AMOUNT_SQL, (user_id, amount)).fetchone()
+        or conn.execute(UTR_REQUEST_BY_USER_SQL, (user_id,)).fetchone()
+    )
+    return res[0] if res else None
+
+def _approve_utr_request(conn, request_id):
+    """Approve a pending request and credit its amount; returns (user_id, amount), or None if already decided"""
+    res = conn.execute(PENDING_UTR_REQUEST_SQL, (request_id,)).fetchone()
+    if not res:
+        return None
+    conn.execute("UPDATE utr_requests SET status='approved', updated_at=CURRENT_TIMESTAMP WHERE id=?", (request_id,))
+    _credit(conn, res[0], res[1], 'utr', str(request_id))
+    return res
+
+def _reject_utr_request(conn, request_id):
+    res = conn.execute("SELECT user_id FROM utr_requests WHERE id=? AND status='pending'", (request_id,)).fetchone()
+    if not res:
+        return None
+    conn.execute("UPDATE utr_requests SET status='rejected', updated_at=CURRENT_TIMESTAMP WHERE id=?", (request_id,))
+    return res[0]
+
+async def approve_utr_request(request_id):
+    approved = await db.transaction(_approve_utr_request, request_id)
+    if approved:
+        balance_cache.invalidate(approved[0])
+    return approved
+
+async def reject_utr_request(request_id):
+    return await db.transaction(_reject_utr_request, request_id)
+
+# === Scheduler ===
+AUTO_LOGOUT_DELAY = 300  # seconds after the OTP is delivered
+PURCHASE_EXPIRY = int(os.getenv("PURCHASE_EXPIRY", "1200"))  # seconds without an OTP before refund
+UTR_REQUEST_TIMEOUT = int(os.getenv("UTR_REQUEST_TIMEOUT", "86400"))  # seconds before a UTR request expires
+
+DELETE_JOB_SQL = "DELETE FROM scheduled_jobs WHERE kind=? AND key=?"
+
+class Scheduler:
+    """One timer task for every delayed job, persisted in scheduled_jobs.
+
+    Jobs are identified by (kind, key); scheduling the same pair again
+    moves it. Due times live in a heap with lazy deletion, so rescheduling
+    and cancelling are O(log n) and only a single task ever sleeps.
+    Handlers must be idempotent: a job due while the bot was down runs
+    once on recovery, and a crash mid-handler runs it again.
+    """
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.handlers = {}
+        self._heap = []
+        self._due = {}  # (kind, key) -> due_at, the source of truth for the heap
+        self._wakeup = None
+
+    def handler(self, kind):
+        def register(fn):
+            self.handlers[kind] = fn
+            return fn
+        return register
+
+    def __len__(self):
+        return len(self._due)
+
+    def _push(self, kind, key, due_at):
+        self._due[(kind, key)] = due_at
+        heapq.heappush(self._heap, (due_at, kind, key))
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def schedule(self, kind, key, delay):
+        due_at = self.clock() + delay
+        await db.execute("INSERT OR REPLACE INTO scheduled_jobs (kind, key, due_at) VALUES (?, ?, ?)", (kind, key, due_at))
+        self._push(kind, key, due_at)
+
+    async def cancel(self, kind, key):
+        await self.cancel_many(kind, [key])
+
+    async def cancel_many(self, kind, keys):
+        """Drop jobs whether or not this process loaded them (CLI commands never recover)"""
+        rows = [(kind, key) for key in keys]
+        for row in rows:
+            self._due.pop(row, None)
+        def delete_scheduled_jobs(conn):
+            conn.executemany(DELETE_JOB_SQL, rows)
+        if rows:
+            await db.run(delete_scheduled_jobs)
+
+    async def recover(self):
+        """Load persisted jobs; anything already overdue runs on the next tick"""
+        for kind, key, due_at in await db.fetchall("SELECT kind, key, due_at FROM scheduled_jobs"):
+            self._push(kind, key, due_at)
+        return len(self._due)
+
+    def pop_due(self, now):
+        """Remove and return every (kind, key) due at or before now"""
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            due_at, kind, key = heapq.heappop(self._heap)
+            if self._due.get((kind, key)) == due_at:
+                del self._due[(kind, key)]
+                due.append((kind, key))
+        return due
+
+    def next_due(self):
+        while self._heap and self._due.get(self._heap[0][1:]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
+
+    async def _run_job(self, kind, key):
+        try:
+            await self.handlers[kind](key)
+        except Exception as e:
+            logger.warning(f"⚠️ Scheduled job {kind}:{key} failed: {e}")
+        await db.execute("DELETE FROM scheduled_jobs WHERE kind=? AND key=? AND due_at<=?", (kind, key, self.clock()))
+
+    async def run(self):
+        self._wakeup = asyncio.Event()
+        while True:
+            for kind, key in self.pop_due(self.clock()):
+                asyncio.create_task(self._run_job(kind, key))
+            next_due = self.next_due()
+            timeout = None if next_due is None else max(0, next_due - self.clock())
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+scheduler = Scheduler()
+
+@scheduler.handler('logout')
+async def auto_logout(phone):
+    """Automatically logout session once the OTP has been used"""
+    await logout_session(phone)
+    logger.info(f"🔒 Auto-logged out {phone}")
+
+@scheduler.handler('expire_purchase')
+async def expire_purchase(key):
+    """Refund a purchase that never received an OTP"""
+    user_id, number = key.split(':', 1)
+    user_id = int(user_id)
+    if not await refund_purchase(user_id, number, ACCOUNT_PRICE):
+        return
+    await logout_session(number)
+    logger.info(f"⌛ Purchase of {number} by {user_id} expired and was refunded")
+    outbox.send(user_id, f"⌛ No OTP arrived for `{number}` in time. ₹{ACCOUNT_PRICE} has been refunded to your wallet.", parse_mode='Markdown')
+
+@scheduler.handler('utr_timeout')
+async def expire_utr_request(request_id):
+    res = await db.fetchone("SELECT user_id FROM utr_requests WHERE id=? AND status='pending'", (int(request_id),))
+    if not res:
+        return
+    await db.execute("UPDATE utr_requests SET status='expired', updated_at=CURRENT_TIMESTAMP WHERE id=? AND status='pending'", (int(request_id),))
+    outbox.send(res[0], "⌛ Your payment verification request expired. Please contact support if you have paid.")
+
+# === OTP Extraction ===
+# Telegram's own service account; login codes from it are always trusted
+TRUSTED_OTP_SENDERS = {777000}
+OTP_MIN_CONFIDENCE = 0.5
+
+# One combined pattern, scanned once per message. Alternatives are ranked by
+# how much context they carry: keyword-prefixed > "OTP for ... is 1234" >
+# "1234 is your ..." > bare digits. All of them start at a word boundary,
+# tested once up front, so most positions fail after a single check.
+_OTP_PATTERN = re.compile(r"""
+    \b(?:
+        (?:(?:login|verification|security)\s+code|code(?:\s+is)?|otp|passcode|pin)
+            \W{0,3}(?:is\W{0,2})?(?P<keyword>\d{4,8})\b
+      | (?:otp|code|passcode)\b[^\n]{0,40}?\bis\s+(?P<labelled>\d{4,8})\b
+      | (?P<suffix>\d{4,8})\s+(?:is\s+your|is\s+the)\b
+      | (?<![\d+\-/:.,])(?P<bare>\d{4,8})\b(?![\-/:]\d|[.,]\d)
+    )
+""", re.IGNORECASE | re.VERBOSE)
+_CURRENCY_PREFIX = re.compile(r"(?:₹|rs\.?|inr|\$)\s*$", re.IGNORECASE)
+_YEAR = re.compile(r"(?:19|20)\d\d")
+# Digit groups that are part of a phone number ("+91 98765 43210")
+_PHONE_BEFORE = re.compile(r"(?:\+\d{1,3}|\d{3,})\s$")
+_PHONE_AFTER = re.compile(r"\s\d{3,}")
+
+def _score_otp_match(match, text):
+    if match.group('keyword'):
+        return match.group('keyword'), 0.9
+    if match.group('labelled'):
+        return match.group('labelled'), 0.85
+    if match.group('suffix'):
+        return match.group('suffix'), 0.8
+    digits = match.group('bare')
+    if _CURRENCY_PREFIX.search(text[max(0, match.start() - 5):match.start()]):
+        return digits, 0.1
+    if _PHONE_BEFORE.search(text[max(0, match.start() - 5):match.start()]) or _PHONE_AFTER.match(text, match.end()):
+        return digits, 0.1
+    if len(digits) == 4 and _YEAR.fullmatch(digits):
+        return digits, 0.2
+    # Unlabelled digits alone stay below OTP_MIN_CONFIDENCE; only a trusted sender lifts them over
+    return digits, {4: 0.3, 5: 0.4, 6: 0.4}.get(len(digits), 0.2)
+
+def extract_otp(text, sender_id=None):
+    """Return (otp, confidence) for the best OTP candidate in text, or (None, 0.0)"""
+    best, best_score = None, 0.0
+    for match in _OTP_PATTERN.finditer(text or ""):
+        otp, score = _score_otp_match(match, text)
+        if score > best_score:
+            best, best_score = otp, score
+    if best is None:
+        return None, 0.0
+    if sender_id in TRUSTED_OTP_SENDERS:
+        best_score = min(1.0, best_score + 0.3)
+    if best_score < OTP_MIN_CONFIDENCE:
+        return None, best_score
+    return best, best_score
+
+# === Session Health ===
+HEALTH_CHECK_INTERVAL = int(os.getenv("HEALTH_CHECK_INTERVAL", "60"))  # seconds between liveness probes
+HEALTH_PROBE_TIMEOUT = 10
+HEALTH_FAILURE_THRESHOLD = int(os.getenv("HEALTH_FAILURE_THRESHOLD", "3"))  # consecutive failures before quarantine
+HEALTH_BACKOFF_BASE = 5  # seconds
+HEALTH_BACKOFF_MAX = 1800
+IDLE_PROBE_BATCH = int(os.getenv("IDLE_PROBE_BATCH", "50"))  # unconnected sessions probed per health check
+IDLE_PROBE_CONCURRENCY = 5
+
+def classify_session_error(error):
+    """'banned', 'unauthorized', 'flood_wait' or 'transient' for an exception from a client"""
+    if isinstance(error, (errors.UserDeactivatedBanError, errors.UserDeactivatedError, errors.PhoneNumberBannedError)):
+        return 'banned'
+    if isinstance(error, (errors.UnauthorizedError, errors.AuthKeyError)):
+        return 'unauthorized'
+    if isinstance(error, errors.FloodWaitError):
+        return 'flood_wait'
+    return 'transient'
+
+class AccountBreaker:
+    def __init__(self):
+        self.failures = 0
+        self.retry_at = 0.0  # no connection attempts before this (monotonic)
+        self.open = False  # quarantined: out of stock until a probe succeeds
+        self.fatal = None  # 'banned' / 'unauthorized': never retried
+
+class SessionHealth:
+    """Per-account circuit breakers with jittered exponential backoff.
+
+    Every failure pushes the next attempt back by base * 2^(failures-1),
+    capped and scaled by a random 50-100% so accounts that failed together
+    do not retry together. After `threshold` consecutive failures, or any
+    FloodWait, the breaker opens and the account is quarantined until a
+    probe succeeds; ban and auth-key errors open it for good.
+    """
+
+    def __init__(self, threshold=3, base=5, cap=1800, clock=time.monotonic):
+        self.threshold = threshold
+        self.base = base
+        self.cap = cap
+        self.clock = clock
+        self.breakers = {}
+
+    def allow(self, phone):
+        breaker = self.breakers.get(phone)
+        if breaker is None:
+            return True
+        return breaker.fatal is None and self.clock() >= breaker.retry_at
+
+    def is_fatal(self, phone):
+        breaker = self.breakers.get(phone)
+        return breaker is not None and breaker.fatal is not None
+
+    def success(self, phone):
+        """Reset the breaker; returns True if the account was quarantined"""
+        breaker = self.breakers.pop(phone, None)
+        return breaker is not None and breaker.open
+
+    def failure(self, phone, error):
+        """Record a failure; returns the health status to report ('quarantined', 'banned', 'unauthorized') or None"""
+        breaker = self.breakers.setdefault(phone, AccountBreaker())
+        kind = classify_session_error(error)
+        if kind in ('banned', 'unauthorized'):
+            breaker.fatal = kind
+            return kind
+        breaker.failures += 1
+        delay = min(self.cap, self.base * 2 ** (breaker.failures - 1)) * random.uniform(0.5, 1.0)
+        if kind == 'flood_wait':
+            delay = max(delay, error.seconds)
+        breaker.retry_at = self.clock() + delay
+        if not breaker.open and (kind == 'flood_wait' or breaker.failures >= self.threshold):
+            breaker.open = True
+            return 'quarantined'
+        return None
+
+    def due(self):
+        """Quarantined accounts whose backoff has expired and need a probe"""
+        now = self.clock()
+        return [p for p, b in self.breakers.items() if b.open and b.fatal is None and now >= b.retry_at]
+
+    def stats(self):
+        return {
+            'backing_off': sum(1 for b in self.breakers.values() if not b.open and b.fatal is None),
+            'quarantined': sum(1 for b in self.breakers.values() if b.open and b.fatal is None),
+            'dead': sum(1 for b in self.breakers.values() if b.fatal is not None),
+        }
+
+def _apply_session_health(conn, phone, status, error):
+    current = conn.execute("SELECT status FROM sessions WHERE phone=?", (phone,)).fetchone()
+    current = current[0] if current else None
+    if status == 'valid':
+        # Only numbers this monitor took out of stock go back in
+        if current == 'quarantined':
+            added = conn.execute("INSERT OR IGNORE INTO stock_queue (phone) VALUES (?)", (phone,)).rowcount
+            _bump(conn, 'stock_available', added, daily=False)
+    else:
+        removed = _unstock(conn, phone)
+        if status == 'quarantined' and not removed and current != 'quarantined':
+            status = 'error'  # not for sale anyway (e.g. mid-purchase): nothing to restore later
+    conn.execute(
+        "UPDATE sessions SET status=?, error=?, checked_at=CURRENT_TIMESTAMP, updated_at=CURRENT_TIMESTAMP WHERE phone=?",
+        (status, error, phone),
+    )
+    if status in ('banned', 'unauthorized'):
+        # A buyer waiting on a dead number can never get an OTP: refund now, not at expiry
+        row = conn.execute(USER_BY_PHONE_SQL, (phone,)).fetchone()
+        if row and _refund_purchase(conn, row[0], phone, ACCOUNT_PRICE):
+            return row[0]
+    return None
+
+async def apply_session_health(phone, status, error=None):
+    """Record a health change: dead and quarantined numbers leave stock, recovered ones return.
+
+    A pending purchase on a dead number is refunded in the same transaction.
+    """
+    refunded = await db.transaction(_apply_session_health, phone, status, error)
+    if status == 'valid':
+        logger.info(f"✅ Session {phone} recovered")
+    else:
+        logger.warning(f"⚠️ Session {phone} is {status}: {error}")
+    if refunded:
+        balance_cache.invalidate(refunded)
+        otp_waits.close(phone)
+        await scheduler.cancel('expire_purchase', f"{refunded}:{phone}")
+        logger.info(f"↩️ Purchase of {phone} by {refunded} refunded: session is {status}")
+        outbox.send(refunded, f"❌ `{phone}` stopped working before an OTP arrived. ₹{ACCOUNT_PRICE} has been refunded to your wallet.", parse_mode='Markdown')
+
+# === OTP Listeners ===
+MAX_CONNECTED_LISTENERS = int(os.getenv("MAX_CONNECTED_LISTENERS", "100"))
+LISTENER_IDLE_TTL = int(os.getenv("LISTENER_IDLE_TTL", "600"))  # seconds
+
+class ListenerManager:
+    """Connects Telethon clients lazily and caps how many stay connected.
+
+    A phone is "pinned" while a purchase on it is waiting for an OTP; pinned
+    clients are never evicted, so the cap can be exceeded temporarily when
+    every connected client is serving a buyer. Unpinned clients are idle and
+    are disconnected least-recently-used first, or once idle_ttl has passed.
+
+    run() also probes connected clients every health_interval, plus the next
+    IDLE_PROBE_BATCH registered sessions with no listener (stock numbers are
+    never connected otherwise), rotating through all of them over successive
+    checks. Failures go through the SessionHealth breakers: pinned phones are
+    reconnected once their backoff expires, and quarantine/recovery/death is
+    reported through on_health so the number leaves or rejoins stock.
+    """
+
+    def __init__(self, max_connected=100, idle_ttl=600, on_otp=None, on_health=None, health_interval=60):
+        self.max_connected = max_connected
+        self.idle_ttl = idle_ttl
+        self.on_otp = on_otp  # async (phone, otp, detected_at); defaults to set_otp_for_phone
+        self.on_health = on_health  # async (phone, status, error); defaults to apply_session_health
+        self.health_interval = health_interval
+        self.health = SessionHealth(HEALTH_FAILURE_THRESHOLD, HEALTH_BACKOFF_BASE, HEALTH_BACKOFF_MAX)
+        self.clients = OrderedDict()  # phone -> TelegramClient, LRU first
+        self.last_used = {}
+        self.pinned = set()
+        self.known = set()  # every phone with a usable session
+        self.sessions = {}  # phone -> session string handed to acquire()
+        self._locks = {}
+        self._idle_rotation = deque()  # unconnected phones still to probe this round
+
+    def __contains__(self, phone):
+        return phone in self.clients
+
+    def register(self, phone):
+        """Record a session as available without connecting it"""
+        self.known.add(phone)
+
+    def stats(self):
+        connected = len(self.clients)
+        busy = len(self.pinned.intersection(self.clients))
+        return {'connected': connected, 'idle': connected - busy, 'total': len(self.known), **self.health.stats()}
+
+    async def acquire(self, phone, session=None):
+        """Connect the listener for phone (if needed) and pin it until release().
+
+        Returns None if it cannot connect now; the phone stays pinned and the
+        health loop keeps retrying unless the account is dead.
+        """
+        self.known.add(phone)
+        self.pinned.add(phone)
+        if session:
+            self.sessions[phone] = session
+        lock = self._locks.setdefault(phone, asyncio.Lock())
+        async with lock:
+            if phone in self.clients:
+                self._touch(phone)
+                return self.clients[phone]
+            if not self.health.allow(phone):
+                if self.health.is_fatal(phone):
+                    self.pinned.discard(phone)
+                return None
+            await self._evict_for_room()
+            try:
+                client = await self._connect(phone)
+            except Exception as e:
+                logger.error(f"❌ Failed to start listener for {phone}: {e}")
+                await self._failed(phone, e)
+                return None
+            self.clients[phone] = client
+            self._touch(phone)
+            await self._succeeded(phone)
+            logger.info(f"✅ Started OTP listener for {phone} ({self.stats()})")
+            return client
+
+    def release(self, phone):
+        """Unpin phone; its client stays connected until evicted as idle"""
+        self.pinned.discard(phone)
+        if phone in self.clients:
+            self._touch(phone)
+
+    async def disconnect(self, phone, log_out=False):
+        self.pinned.discard(phone)
+        client = self.clients.pop(phone, None)
+        self.last_used.pop(phone, None)
+        if client is None:
+            return False
+        if client.is_connected():
+            if log_out:
+                await client.log_out()
+            await client.disconnect()
+        return True
+
+    async def reap_idle(self):
+        deadline = time.monotonic() - self.idle_ttl
+        for phone in [p for p, t in self.last_used.items() if t < deadline and p not in self.pinned]:
+            await self.disconnect(phone)
+            logger.info(f"💤 Disconnected idle listener for {phone}")
+
+    async def run_reaper(self, interval=60):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.reap_idle()
+            except Exception as e:
+                logger.warning(f"⚠️ Error reaping idle listeners: {e}")
+
+    async def check_health(self):
+        """Probe connected clients, reconnect dropped pinned ones and re-probe quarantined ones"""
+        for phone, client in list(self.clients.items()):
+            try:
+                if not client.is_connected():
+                    raise ConnectionError("client disconnected")
+                await asyncio.wait_for(client.get_me(input_peer=True), HEALTH_PROBE_TIMEOUT)
+            except Exception as e:
+                if self.clients.get(phone) is client:
+                    del self.clients[phone]
+                    self.last_used.pop(phone, None)
+                    await client.disconnect()
+                await self._failed(phone, e)
+            else:
+                await self._succeeded(phone)
+        for phone in self.pinned.difference(self.clients):
+            if self.health.allow(phone):
+                await self.acquire(phone)
+        due = [p for p in self.health.due() if p not in self.pinned]
+        for phone in due:
+            await self._probe(phone)
+        await self.probe_idle(skip=set(due))
+
+    async def probe_idle(self, batch=IDLE_PROBE_BATCH, concurrency=IDLE_PROBE_CONCURRENCY, skip=()):
+        """Probe the next `batch` registered phones that have no listener, a few at a time"""
+        if not self._idle_rotation:
+            self._idle_rotation.extend(self.known)
+        phones = []
+        while self._idle_rotation and len(phones) < batch:
+            phone = self._idle_rotation.popleft()
+            if phone in skip or phone in self.clients or phone in self.pinned or phone not in self.known:
+                continue
+            # Phones backing off are left to their breaker
+            if self.health.allow(phone):
+                phones.append(phone)
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def probe(phone):
+            async with semaphore:
+                await self._probe(phone)
+        await asyncio.gather(*(probe(phone) for phone in phones))
+
+    async def run_health(self):
+        while True:
+            await asyncio.sleep(self.health_interval)
+            try:
+                await self.check_health()
+            except Exception as e:
+                logger.warning(f"⚠️ Error checking listener health: {e}")
+
+    def start(self):
+        pass
+
+    async def run(self):
+        await asyncio.gather(self.run_reaper(), self.run_health())
+
+    def stop(self):
+        pass
+
+    def _touch(self, phone):
+        self.clients.move_to_end(phone)
+        self.last_used[phone] = time.monotonic()
+
+    async def _report(self, phone, status, error=None):
+        try:
+            await (self.on_health or apply_session_health)(phone, status, error)
+        except Exception as e:
+            logger.error(f"Error recording health of {phone}: {e}")
+
+    async def _succeeded(self, phone):
+        if self.health.success(phone):
+            await self._report(phone, 'valid')
+
+    async def _failed(self, phone, error):
+        status = self.health.failure(phone, error)
+        if status in ('banned', 'unauthorized'):
+            self.pinned.discard(phone)
+            self.known.discard(phone)
+            await self.disconnect(phone)
+        if status:
+            await self._report(phone, status, f"{type(error).__name__}: {error}")
+
+    async def _probe(self, phone):
+        """One-off connect and get_me for a phone with no listener"""
+        client = None
+        try:
+            client = new_client(await self._session(phone))
+            await asyncio.wait_for(client.connect(), HEALTH_PROBE_TIMEOUT)
+            if not await client.is_user_authorized():
+                raise errors.AuthKeyUnregisteredError(request=None)
+            await asyncio.wait_for(client.get_me(input_peer=True), HEALTH_PROBE_TIMEOUT)
+        except Exception as e:
+            await self._failed(phone, e)
+        else:
+            await self._succeeded(phone)
+        finally:
+            if client is not None:
+                await client.disconnect()
+
+    async def _session(self, phone):
+        session = self.sessions.get(phone) or await session_store.get(phone)
+        if not session:
+            raise LookupError("no stored session")
+        return session
+
+    async def _evict_for_room(self):
+        idle = [p for p in self.clients if p not in self.pinned]
+        while len(self.clients) >= self.max_connected and idle:
+            await self.disconnect(idle.pop(0))
+        if len(self.clients) >= self.max_connected:
+            logger.warning(f"⚠️ Listener cap {self.max_connected} exceeded: all connected sessions have pending purchases")
+
+    async def _connect(self, phone):
+        client = new_client(await self._session(phone), connection_retries=5, retry_delay=1)
+
         @client.on(events.NewMessage(incoming=True))
         async def handler(event):
             try:
+                detected_at = time.perf_counter()
                 text = event.raw_text
-                # Improved OTP detection patterns
-                patterns = [
-                    r'(?:code is|Code:|OTP|verification code|login code)[\s:]*(\d{4,8})',
-                    r'(\d{4,8})\s*(?:is your|code)',
-                    r'Your code is\s*(\d{4,8})',
-                    r'(\d{6})',  # 6-digit numbers
-                    r'(\d{5})',  # 5-digit numbers
-                    r'(\d{4})',  # 4-digit numbers
-                ]
-                
-                for pattern in patterns:
-                    match = re.search(pattern, text, re.IGNORECASE)
-                    if match:
-                        otp = match.group(1)
-                        set_otp_for_phone(phone, otp)
-                        print(f"📲 OTP {otp} received for {phone} from message: {text[:50]}...")
-                        break
+                otp, confidence = extract_otp(text, event.sender_id)
+                if otp:
+                    OTPS_DETECTED.inc()
+                    await (self.on_otp or set_otp_for_phone)(phone, otp, detected_at)
+                    logger.debug(f"📲 OTP {otp} ({confidence:.1f}) received for {phone} from message: {text[:50]}...")
             except Exception as e:
-                print(f"Error processing message for {phone}: {e}")
+                logger.error(f"Error processing message for {phone}: {e}")
 
         await client.start()
-        print(f"✅ Started OTP listener for {phone}")
-        
+
         # Run client in background
         async def run_client():
+            failure = None
             try:
                 await client.run_until_disconnected()
             except Exception as e:
-                print(f"Client disconnected for {phone}: {e}")
+                failure = e
+                logger.warning(f"Client disconnected for {phone}: {e}")
             finally:
-                if phone in active_listeners:
-                    del active_listeners[phone]
-        
+                # Still registered means nobody asked for this disconnect
+                if self.clients.get(phone) is client:
+                    del self.clients[phone]
+                    self.last_used.pop(phone, None)
+                    await self._failed(phone, failure or ConnectionError("connection dropped"))
+
         asyncio.create_task(run_client())
-        
-    except Exception as e:
-        print(f"❌ Failed to start listener for {phone}: {e}")
-        if phone in active_listeners:
-            del active_listeners[phone]
+        return client
+
+# === Listener Workers ===
+# With OTP_WORKERS > 0 the Telethon listeners run in that many worker
+# processes instead of the bot process. Phones are sharded across workers by
+# a consistent-hash ring, so when a worker dies only its own phones move to
+# the survivors. Workers send detected OTPs back to the bot process, which
+# keeps sole ownership of the database and the Bot API.
+OTP_WORKERS = int(os.getenv("OTP_WORKERS", "0"))  # 0 = listeners run in-process
+WORKER_HEARTBEAT = float(os.getenv("WORKER_HEARTBEAT", "2"))  # seconds
+WORKER_REQUEST_TIMEOUT = 60  # seconds to wait for a worker to connect a client
+WORKER_MAX_RESTARTS = 5  # respawns of one worker per WORKER_RESTART_WINDOW before its shard moves for good
+WORKER_RESTART_WINDOW = 300  # seconds
+
+class HashRing:
+    """Consistent hashing of phones onto worker ids"""
+
+    def __init__(self, nodes=(), replicas=64):
+        self.replicas = replicas
+        self._keys = []
+        self._nodes = {}  # point on the ring -> node
+        for node in nodes:
+            self.add(node)
+
+    @staticmethod
+    def _hash(value):
+        return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+
+    def add(self, node):
+        for i in range(self.replicas):
+            point = self._hash(f"{node}#{i}")
+            self._nodes[point] = node
+            bisect.insort(self._keys, point)
+
+    def remove(self, node):
+        self._keys = [k for k in self._keys if self._nodes[k] != node]
+        self._nodes = {k: n for k, n in self._nodes.items() if n != node}
+
+    def get(self, key):
+        if not self._keys:
+            return None
+        i = bisect.bisect(self._keys, self._hash(key)) % len(self._keys)
+        return self._nodes[self._keys[i]]
+
+def listener_worker_main(worker_id, commands, events_queue, max_connected):
+    """Entry point of a listener worker process"""
+    setup_logging()
+    try:
+        asyncio.run(_listener_worker(worker_id, commands, events_queue, max_connected))
+    except KeyboardInterrupt:
+        pass
+
+async def _listener_worker(worker_id, commands, events_queue, max_connected):
+    loop = asyncio.get_running_loop()
+
+    async def forward_otp(phone, otp, detected_at):
+        # perf_counter is per-process, so report how long ago it was detected
+        events_queue.put(("otp", worker_id, phone, otp, time.perf_counter() - detected_at))
 
+    async def forward_health(phone, status, error):
+        events_queue.put(("health", worker_id, phone, status, error))
 
+    manager = ListenerManager(max_connected, LISTENER_IDLE_TTL, on_otp=forward_otp,
+                              on_health=forward_health, health_interval=HEALTH_CHECK_INTERVAL)
+    background = asyncio.create_task(manager.run())
 
-# === Razorpay Webhook Server (Optional) ===
-rzp_app = None
-if WEBHOOK_SECRET and RAZORPAY_KEY_ID:
-    rzp_app = Flask(__name__)
+    async def heartbeat():
+        while True:
+            events_queue.put(("heartbeat", worker_id, manager.stats()))
+            await asyncio.sleep(WORKER_HEARTBEAT)
 
-    @rzp_app.route("/razorpay-webhook", methods=["POST"])
-    def razorpay_webhook():
-        payload = request.data
-        signature = request.headers.get("X-Razorpay-Signature")
+    async def handle(op, req_id, phone, args):
         try:
-            hmac_obj = hmac.new(WEBHOOK_SECRET.encode(), msg=payload, digestmod=hashlib.sha256)
-            if hmac.compare_digest(hmac_obj.hexdigest(), signature):
-                data = request.json
-                if data['event'] == 'payment.captured':
-                    payment = data['payload']['payment']['entity']
-                    amount = int(payment['amount']) // 100
-                    notes = payment['notes']
-                    user_id = int(notes.get("user_id"))
-                    add_balance(user_id, amount)
-                    print(f"✅ Added ₹{amount} to User ID {user_id}")
-                return "", 200
+            if op == "acquire":
+                result = await manager.acquire(phone, session=args[0]) is not None
+            elif op == "release":
+                manager.release(phone)
+                result = True
+            elif op == "disconnect":
+                result = await manager.disconnect(phone, log_out=args[0])
+            else:
+                result = False
         except Exception as e:
-            print(f"Webhook Error: {e}")
-            return "", 400
-    
-    print("✅ Webhook server initialized")
+            logger.error(f"❌ Worker {worker_id} failed to {op} {phone}: {e}")
+            result = False
+        if req_id is not None:
+            events_queue.put(("ack", worker_id, req_id, result))
+
+    beat = asyncio.create_task(heartbeat())
+    logger.info(f"✅ Listener worker {worker_id} started (pid {os.getpid()})")
+    while True:
+        try:
+            command = await loop.run_in_executor(None, functools.partial(commands.get, timeout=1))
+        except queue.Empty:
+            continue
+        op, req_id, phone, *args = command
+        if op == "stop":
+            break
+        asyncio.create_task(handle(op, req_id, phone, args))
+    beat.cancel()
+    background.cancel()
+    for phone in list(manager.clients):
+        await manager.disconnect(phone)
+
+class ListenerCoordinator:
+    """ListenerManager stand-in that forwards to sharded worker processes.
+
+    Keeps the same interface (acquire/release/disconnect/register/stats), so
+    the rest of the bot does not know where a listener runs. Pinned phones are
+    remembered here. When a worker process dies it is respawned under the same
+    id, so its shard of the ring maps to the new process, and its pinned
+    phones are re-acquired there. A worker that keeps dying (more than
+    WORKER_MAX_RESTARTS times in WORKER_RESTART_WINDOW) is left down and its
+    shard moves to the survivors.
+    """
+
+    def __init__(self, workers, max_connected=100):
+        self.worker_count = workers
+        self.max_connected = max_connected
+        self.ctx = multiprocessing.get_context("spawn")
+        self.events = self.ctx.Queue()
+        self.workers = {}  # worker id -> (Process, command queue)
+        self.ring = HashRing()
+        self.owners = {}  # phone -> worker id it was sent to
+        self.pinned = set()
+        self.known = set()
+        self.worker_stats = {}
+        self.restarts = {}  # worker id -> monotonic times of its recent respawns
+        self._pending = {}  # request id -> (worker id, Future)
+        self._request_ids = itertools.count(1)
+
+    def __contains__(self, phone):
+        return phone in self.owners
+
+    def register(self, phone):
+        self.known.add(phone)
+
+    def stats(self):
+        live = [s for w, s in self.worker_stats.items() if w in self.workers]
+        return {
+            'connected': sum(s['connected'] for s in live),
+            'idle': sum(s['idle'] for s in live),
+            'quarantined': sum(s.get('quarantined', 0) for s in live),
+            'dead': sum(s.get('dead', 0) for s in live),
+            'total': len(self.known),
+            'workers': len(self.workers),
+        }
+
+    def start(self):
+        for worker_id in range(self.worker_count):
+            self._spawn(worker_id)
+        logger.info(f"✅ Started {self.worker_count} listener workers")
+
+    def _spawn(self, worker_id):
+        per_worker = max(1, -(-self.max_connected // self.worker_count))
+        commands = self.ctx.Queue()
+        process = self.ctx.Process(
+            target=listener_worker_main,
+            args=(worker_id, commands, self.events, per_worker),
+            name=f"otp-listener-{worker_id}",
+            daemon=True,
+        )
+        process.start()
+        self.workers[worker_id] = (process, commands)
+        self.ring.add(worker_id)
+
+    def stop(self):
+        for process, commands in self.workers.values():
+            commands.put(("stop", None, None))
+        for process, _ in self.workers.values():
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self.workers.clear()
+
+    def _send(self, worker_id, op, phone, *args):
+        """Queue a command; returns a future for its ack"""
+        future = asyncio.get_running_loop().create_future()
+        if worker_id not in self.workers:
+            future.set_result(False)
+            return future
+        req_id = next(self._request_ids)
+        self._pending[req_id] = (worker_id, future)
+        self.workers[worker_id][1].put((op, req_id, phone, *args))
+        return future
+
+    async def _request(self, worker_id, op, phone, *args):
+        future = self._send(worker_id, op, phone, *args)
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), WORKER_REQUEST_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning(f"⚠️ Worker {worker_id} did not answer {op} for {phone}")
+            return False
+
+    async def acquire(self, phone):
+        self.known.add(phone)
+        self.pinned.add(phone)
+        worker_id = self.ring.get(phone)
+        if worker_id is None:
+            logger.error(f"❌ No listener worker alive for {phone}")
+            return False
+        self.owners[phone] = worker_id
+        # Workers have no database; the session travels with the command
+        session = await session_store.get(phone)
+        if not session:
+            self.pinned.discard(phone)
+            self.owners.pop(phone, None)
+            return False
+        # On failure the worker keeps the phone pinned and retries it itself
+        return await self._request(worker_id, "acquire", phone, session)
+
+    def release(self, phone):
+        self.pinned.discard(phone)
+        worker_id = self.owners.get(phone)
+        if worker_id in self.workers:
+            self.workers[worker_id][1].put(("release", None, phone))
+
+    async def disconnect(self, phone, log_out=False):
+        self.pinned.discard(phone)
+        worker_id = self.owners.pop(phone, None)
+        if worker_id is None:
+            return False
+        return await self._request(worker_id, "disconnect", phone, log_out)
+
+    async def _handle_event(self, event):
+        kind, worker_id = event[0], event[1]
+        if kind == "otp":
+            _, _, phone, otp, age = event
+            OTPS_DETECTED.inc()
+            await set_otp_for_phone(phone, otp, time.perf_counter() - age)
+        elif kind == "ack":
+            _, _, req_id, result = event
+            entry = self._pending.pop(req_id, None)
+            if entry and not entry[1].done():
+                entry[1].set_result(result)
+        elif kind == "heartbeat":
+            self.worker_stats[worker_id] = event[2]
+        elif kind == "health":
+            _, _, phone, status, error = event
+            if status in ('banned', 'unauthorized'):
+                self.pinned.discard(phone)
+                self.owners.pop(phone, None)
+                self.known.discard(phone)
+            await apply_session_health(phone, status, error)
+
+    async def _pump(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                event = await loop.run_in_executor(None, functools.partial(self.events.get, timeout=1))
+            except queue.Empty:
+                continue
+            try:
+                await self._handle_event(event)
+            except Exception as e:
+                logger.error(f"Error handling listener worker event {event[0]}: {e}")
+
+    async def _supervise(self, interval=1):
+        while True:
+            await asyncio.sleep(interval)
+            for worker_id, (process, _) in list(self.workers.items()):
+                if not process.is_alive():
+                    self._fail_over(worker_id, process.exitcode)
+
+    def _fail_over(self, worker_id, exitcode):
+        del self.workers[worker_id]
+        self.worker_stats.pop(worker_id, None)
+        self.ring.remove(worker_id)
+        for req_id, (owner, future) in list(self._pending.items()):
+            if owner == worker_id:
+                del self._pending[req_id]
+                if not future.done():
+                    future.set_result(False)
+        orphans = [p for p, w in self.owners.items() if w == worker_id]
+        for phone in orphans:
+            del self.owners[phone]
+
+        now = time.monotonic()
+        recent = [t for t in self.restarts.get(worker_id, ()) if now - t < WORKER_RESTART_WINDOW]
+        if len(recent) < WORKER_MAX_RESTARTS:
+            self.restarts[worker_id] = recent + [now]
+            self._spawn(worker_id)
+            logger.error(
+                f"❌ Listener worker {worker_id} exited ({exitcode}); respawned it "
+                f"({len(recent) + 1} restarts in {WORKER_RESTART_WINDOW}s) for {len(orphans)} listeners"
+            )
+        else:
+            self.restarts.pop(worker_id, None)
+            logger.error(
+                f"❌ Listener worker {worker_id} exited ({exitcode}) after {len(recent)} restarts; "
+                f"moving {len(orphans)} listeners to {len(self.workers)} workers"
+            )
+        for phone in orphans:
+            if phone in self.pinned:
+                asyncio.create_task(self.acquire(phone))
+
+    async def run(self):
+        await asyncio.gather(self._pump(), self._supervise())
+
+if OTP_WORKERS > 0:
+    listeners = ListenerCoordinator(OTP_WORKERS, MAX_CONNECTED_LISTENERS)
 else:
-    print("⚠️ Webhook server disabled - missing WEBHOOK_SECRET or Razorpay credentials")
+    listeners = ListenerManager(MAX_CONNECTED_LISTENERS, LISTENER_IDLE_TTL, health_interval=HEALTH_CHECK_INTERVAL)
+metrics.gauge("otp_bot_active_listeners", "Connected Telethon listener clients", function=lambda: listeners.stats()['connected'])
+
+async def start_otp_listener(phone):
+    """Start (or keep) the OTP listener for a phone with a pending purchase"""
+    await listeners.acquire(phone)
+
+PENDING_NUMBERS_SQL = "SELECT DISTINCT number FROM purchases WHERE status='pending'"
+
+async def get_pending_numbers():
+    rows = await db.fetchall(PENDING_NUMBERS_SQL)
+    return [row[0] for row in rows]
+
+# === Razorpay Webhook (Optional) ===
+RAZORPAY_WEBHOOK_PATH = os.getenv("RAZORPAY_WEBHOOK_PATH", "/razorpay-webhook")
+RAZORPAY_WEBHOOK_ENABLED = bool(WEBHOOK_SECRET and RAZORPAY_KEY_ID)
+
+def _credit_payment(conn, payment_id, user_id, amount):
+    # The payments row is the idempotency key: Razorpay retries hit the PK and credit nothing
+    inserted = conn.execute("INSERT OR IGNORE INTO payments (payment_id, user_id, amount) VALUES (?, ?, ?)", (payment_id, user_id, amount)).rowcount
+    if inserted:
+        _credit(conn, user_id, amount, 'razorpay', payment_id)
+    return bool(inserted)
+
+async def credit_payment(payment_id, user_id, amount):
+    """Credit a captured payment once; returns False if it was already credited"""
+    try:
+        return await db.transaction(_credit_payment, payment_id, user_id, amount)
+    finally:
+        balance_cache.invalidate(user_id)
+
+def verify_razorpay_signature(payload, signature):
+    expected = hmac.new(WEBHOOK_SECRET.encode(), msg=payload, digestmod=hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature or "")
+
+async def razorpay_webhook(request):
+    payload = await request.read()
+    if not verify_razorpay_signature(payload, request.headers.get("X-Razorpay-Signature")):
+        return web.Response(status=400)
+    try:
+        data = json.loads(payload)
+        if data['event'] == 'payment.captured':
+            payment = data['payload']['payment']['entity']
+            amount = int(payment['amount']) // 100
+            user_id = int(payment['notes'].get("user_id"))
+            if await credit_payment(payment['id'], user_id, amount):
+                logger.info(f"✅ Added ₹{amount} to User ID {user_id}")
+                outbox.send(user_id, f"✅ Payment received! ₹{amount} added to your wallet.")
+            else:
+                logger.info(f"↩️ Duplicate webhook for payment {payment['id']} ignored")
+    except Exception as e:
+        logger.error(f"Webhook Error: {e}")
+        return web.Response(status=400)
+    return web.Response(status=200)
+
+# === FSM Storage ===
+# Conversation state (deposit UTR flow, owner account login) lives behind
+# aiogram's BaseStorage so abandoned flows expire instead of leaking.
+FSM_STORAGE = os.getenv("FSM_STORAGE", "sqlite")  # "sqlite" or "memory"
+FSM_STATE_TTL = int(os.getenv("FSM_STATE_TTL", "3600"))  # seconds since last update
+FSM_MAX_ENTRIES = int(os.getenv("FSM_MAX_ENTRIES", "100000"))  # memory backend entries, sqlite backend cache size
+
+class DepositFlow(StatesGroup):
+    utr = State()
+    amount = State()
+
+class OwnerLogin(StatesGroup):
+    phone = State()
+    code = State()
+
+def _state_name(state):
+    return state.state if isinstance(state, State) else state
+
+class TTLMemoryStorage(BaseStorage):
+    """In-process FSM storage bounded by TTL and an LRU entry cap"""
+
+    def __init__(self, ttl=FSM_STATE_TTL, max_entries=FSM_MAX_ENTRIES, clock=time.monotonic):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        self.records = OrderedDict()  # key -> [state, data, expires_at]
+        self.evicted = 0
+
+    def _get(self, key):
+        record = self.records.get(key)
+        if record is None:
+            return None
+        if record[2] <= self.clock():
+            del self.records[key]
+            self.evicted += 1
+            return None
+        return record
+
+    def _put(self, key, state, data):
+        if state is None and not data:
+            self.records.pop(key, None)
+            return
+        self.records[key] = [state, data, self.clock() + self.ttl]
+        self.records.move_to_end(key)
+        now = self.clock()
+        # Oldest entries sit at the front: drop expired ones, then enforce the cap
+        while self.records:
+            oldest_key, oldest = next(iter(self.records.items()))
+            if oldest[2] > now and len(self.records) <= self.max_entries:
+                break
+            del self.records[oldest_key]
+            self.evicted += 1
+
+    async def set_state(self, key, state=None):
+        record = self._get(key)
+        self._put(key, _state_name(state), record[1] if record else {})
+
+    async def get_state(self, key):
+        record = self._get(key)
+        return record[0] if record else None
+
+    async def set_data(self, key, data):
+        record = self._get(key)
+        self._put(key, record[0] if record else None, dict(data))
+
+    async def get_data(self, key):
+        record = self._get(key)
+        return dict(record[1]) if record else {}
+
+    async def stats(self):
+        return {
+            'backend': 'memory',
+            'entries': len(self.records),
+            'evicted': self.evicted,
+            'approx_bytes': sys.getsizeof(self.records) + sum(sys.getsizeof(r[1]) for r in self.records.values()),
+        }
+
+    async def close(self):
+        self.records.clear()
+
+FSM_STATE_SQL = "SELECT state, data, expires_at FROM fsm_state WHERE key=?"
+
+class SQLiteStorage(BaseStorage):
+    """FSM storage in the fsm_state table, so flows survive restarts.
+
+    aiogram reads the state on every update, so reads go through a bounded
+    LRU of what the table holds for each key, "nothing" included; a user
+    tapping buttons outside any flow never reaches the database after the
+    first tap. Writes go through to the table. The bot process is the only
+    writer, so a cached miss cannot go stale.
+    """
+
+    def __init__(self, ttl=FSM_STATE_TTL, clock=time.time, cache_size=FSM_MAX_ENTRIES):
+        self.ttl = ttl
+        self.clock = clock
+        self.cache_size = cache_size
+        self.cache = OrderedDict()  # key -> (state, data, expires_at)
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(key):
+        return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id}:{key.business_connection_id}:{key.destiny}"
+
+    def _remember(self, key, state, data, expires_at):
+        self.cache[key] = (state, data, expires_at)
+        self.cache.move_to_end(key)
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    async def _get(self, key):
+        key = self._key(key)
+        cached = self.cache.get(key)
+        if cached is None:
+            self.misses += 1
+            res = await db.fetchone(FSM_STATE_SQL, (key,))
+            cached = (res[0], json.loads(res[1]), res[2]) if res else (None, {}, float('inf'))
+            self._remember(key, *cached)
+        else:
+            self.hits += 1
+            self.cache.move_to_end(key)
+        state, data, expires_at = cached
+        if expires_at <= self.clock():
+            return None, {}
+        return state, dict(data)
+
+    async def _put(self, key, state, data):
+        key = self._key(key)
+        if state is None and not data:
+            await db.execute("DELETE FROM fsm_state WHERE key=?", (key,))
+            self._remember(key, None, {}, float('inf'))
+            return
+        expires_at = self.clock() + self.ttl
+        await db.execute(
+            "INSERT OR REPLACE INTO fsm_state (key, state, data, expires_at) VALUES (?, ?, ?, ?)",
+            (key, state, json.dumps(data), expires_at)
+        )
+        self._remember(key, state, dict(data), expires_at)
+
+    async def set_state(self, key, state=None):
+        _, data = await self._get(key)
+        await self._put(key, _state_name(state), data)
+
+    async def get_state(self, key):
+        state, _ = await self._get(key)
+        return state
+
+    async def set_data(self, key, data):
+        state, _ = await self._get(key)
+        await self._put(key, state, dict(data))
+
+    async def get_data(self, key):
+        _, data = await self._get(key)
+        return data
+
+    async def purge_expired(self):
+        return await db.execute("DELETE FROM fsm_state WHERE expires_at<=?", (self.clock(),))
+
+    async def run_purger(self, interval=600):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.purge_expired()
+            except Exception as e:
+                logger.warning(f"⚠️ Error purging FSM state: {e}")
+
+    async def stats(self):
+        res = await db.fetchone("SELECT COUNT(*), COALESCE(SUM(LENGTH(data)), 0) FROM fsm_state")
+        return {
+            'backend': 'sqlite',
+            'entries': res[0],
+            'approx_bytes': res[1],
+            'cached': len(self.cache),
+            'cache_hits': self.hits,
+            'cache_misses': self.misses,
+        }
+
+    async def close(self):
+        pass
+
+fsm_storage = SQLiteStorage() if FSM_STORAGE == "sqlite" else TTLMemoryStorage()
 
 # === Telegram Bot Setup ===
-bot = Bot(token=API_TOKEN)
-dp = Dispatcher()
+bot = None  # created by startup(); Bot() rejects a missing or malformed token
+dp = Dispatcher(storage=fsm_storage)
+
+# === Outbound Messages ===
+# Telegram allows ~30 messages/s per bot and ~1 message/s per chat
+OUTBOX_GLOBAL_RATE = 25
+OUTBOX_CHAT_RATE = 1
+OUTBOX_WORKERS = 4
+OUTBOX_MAX_RETRIES = 5
+OUTBOX_BACKOFF = 1  # network errors retry after backoff * 2**attempt seconds, capped at 30
+
+# Priority lanes, lowest value is sent first
+LANE_OTP = 0
+LANE_USER = 1
+LANE_ADMIN = 2
+LANE_NAMES = {LANE_OTP: 'otp', LANE_USER: 'user', LANE_ADMIN: 'admin'}
+
+class TokenBucket:
+    """Classic token bucket; take() returns how long to wait before a token is free.
+
+    take() only spends a token when one is free. reserve() always spends
+    one, letting the balance go negative, so concurrent callers queue up
+    behind each other instead of all waking for the same token.
+    """
+
+    def __init__(self, rate, capacity=None, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.clock = clock
+        self.updated = clock()
+
+    def take(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def reserve(self):
+        wait = self.take()
+        if wait:
+            self.tokens -= 1
+        return wait
+
+    def refund(self):
+        """Give back a token that was taken or reserved but not used"""
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+class OutboundMessage:
+    def __init__(self, method, chat_id, lane, kwargs):
+        self.method = method
+        self.chat_id = chat_id
+        self.lane = lane
+        self.kwargs = kwargs
+        self.attempts = 0
+        self.enqueued_at = time.monotonic()
+        self.future = asyncio.get_running_loop().create_future()
+
+class Outbox:
+    """Rate-limited outbound queue for bot.send_message / bot.edit_message_text.
+
+    Messages wait in priority lanes and are released under a global and a
+    per-chat token bucket. RetryAfter puts the message back after the delay
+    Telegram asked for; network errors back off exponentially. Callers may
+    await the returned future or fire and forget (failures are logged).
+    """
+
+    def __init__(self, global_rate=OUTBOX_GLOBAL_RATE, chat_rate=OUTBOX_CHAT_RATE, workers=OUTBOX_WORKERS, max_retries=OUTBOX_MAX_RETRIES, backoff=OUTBOX_BACKOFF):
+        self.global_bucket = TokenBucket(global_rate)
+        self.chat_rate = chat_rate
+        self.chat_buckets = OrderedDict()
+        self.workers = workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._ready = []    # (lane, seq, message)
+        self._delayed = []  # (not_before, seq, message)
+        self._seq = 0
+        self._wakeup = None
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.latencies = deque(maxlen=1000)
+
+    def send(self, chat_id, text, lane=LANE_USER, **kwargs):
+        return self.submit('send_message', chat_id, lane, text=text, **kwargs)
+
+    def edit(self, chat_id, message_id, text, lane=LANE_USER, **kwargs):
+        return self.submit('edit_message_text', chat_id, lane, message_id=message_id, text=text, **kwargs)
+
+    def submit(self, method, chat_id, lane, **kwargs):
+        message = OutboundMessage(method, chat_id, lane, kwargs)
+        self._push_ready(message)
+        return message.future
+
+    def stats(self):
+        depth = {name: 0 for name in LANE_NAMES.values()}
+        for _, _, message in self._ready + self._delayed:
+            depth[LANE_NAMES[message.lane]] += 1
+        latencies = sorted(self.latencies)
+        return {
+            'depth': depth,
+            'sent': self.sent,
+            'failed': self.failed,
+            'retries': self.retries,
+            'latency_p50': latencies[len(latencies) // 2] if latencies else 0.0,
+            'latency_p99': latencies[int(len(latencies) * 0.99)] if latencies else 0.0,
+        }
+
+    def _next_seq(self):
+        self._seq += 1
+        return self._seq
+
+    def _wake(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _push_ready(self, message):
+        heapq.heappush(self._ready, (message.lane, self._next_seq(), message))
+        self._wake()
+
+    def _push_delayed(self, message, delay):
+        heapq.heappush(self._delayed, (time.monotonic() + delay, self._next_seq(), message))
+        self._wake()
+
+    def _chat_bucket(self, chat_id):
+        bucket = self.chat_buckets.pop(chat_id, None) or TokenBucket(self.chat_rate, 3)
+        self.chat_buckets[chat_id] = bucket
+        if len(self.chat_buckets) > 10000:
+            self.chat_buckets.popitem(last=False)
+        return bucket
+
+    def _next_message(self):
+        """Pop the next sendable message, or return the seconds until one may be ready"""
+        now = time.monotonic()
+        while self._delayed and self._delayed[0][0] <= now:
+            _, _, message = heapq.heappop(self._delayed)
+            heapq.heappush(self._ready, (message.lane, self._next_seq(), message))
+        while self._ready:
+            _, _, message = heapq.heappop(self._ready)
+            wait = self._chat_bucket(message.chat_id).take()
+            if wait:
+                heapq.heappush(self._delayed, (now + wait, self._next_seq(), message))
+                continue
+            return message
+        return self._delayed[0][0] - now if self._delayed else None
 
-# Store user states (e.g., awaiting_utr, awaiting_amount)
-user_states = {}
+    async def _deliver(self, message):
+        message.attempts += 1
+        try:
+            result = await getattr(bot, message.method)(chat_id=message.chat_id, **message.kwargs)
+        except TelegramRetryAfter as e:
+            self.retries += 1
+            self._push_delayed(message, e.retry_after)
+            return
+        except TelegramNetworkError as e:
+            if message.attempts <= self.max_retries:
+                self.retries += 1
+                self._push_delayed(message, min(30, self.backoff * 2 ** message.attempts))
+                return
+            self._fail(message, e)
+            return
+        except Exception as e:
+            self._fail(message, e)
+            return
+        self.sent += 1
+        latency = time.monotonic() - message.enqueued_at
+        self.latencies.append(latency)
+        OUTBOX_SEND_SECONDS.observe(latency, lane=LANE_NAMES[message.lane])
+        if not message.future.done():
+            message.future.set_result(result)
+
+    def _fail(self, message, error):
+        self.failed += 1
+        OUTBOX_FAILURES.inc()
+        logger.warning(f"⚠️ Failed to {message.method} to {message.chat_id}: {error}")
+        if not message.future.done():
+            message.future.set_exception(error)
+            # Fire-and-forget callers never retrieve it; don't warn about that
+            message.future.exception()
+
+    async def _worker(self):
+        while True:
+            # Wait for the global token before picking a message, so one that
+            # arrives meanwhile in a more urgent lane goes out first
+            wait = self.global_bucket.reserve()
+            if wait:
+                await asyncio.sleep(wait)
+            item = self._next_message()
+            if isinstance(item, OutboundMessage):
+                await self._deliver(item)
+                continue
+            self.global_bucket.refund()
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), item)
+            except asyncio.TimeoutError:
+                pass
 
-# Store active OTP listeners to prevent multiple instances
-active_listeners = {}
+    async def run(self):
+        self._wakeup = asyncio.Event()
+        await asyncio.gather(*(self._worker() for _ in range(self.workers)))
+
+outbox = Outbox()
+metrics.gauge("otp_bot_outbox_depth", "Outbound messages waiting to be sent", function=lambda: len(outbox._ready) + len(outbox._delayed))
+
+# === Deposit QR Codes ===
+UPI_PAYEE_NAME = os.getenv("UPI_PAYEE_NAME", "OTP Bot")
+DEPOSIT_MIN_AMOUNT = int(os.getenv("DEPOSIT_MIN_AMOUNT", "10"))
+DEPOSIT_MAX_AMOUNT = int(os.getenv("DEPOSIT_MAX_AMOUNT", "50000"))
+DEPOSIT_QR_CACHE_SIZE = int(os.getenv("DEPOSIT_QR_CACHE_SIZE", "5000"))
+STATIC_DEPOSIT_QR_URL = "https://i.postimg.cc/NFMtrgNh/Phone-Pe-QR-Bank-Of-Baroda-06101.png"
+STATIC_DEPOSIT_AMOUNT = 100
+DEPOSIT_QR_RENDER_SECONDS = metrics.histogram("otp_bot_deposit_qr_render_seconds", "Time to render a deposit QR code")
+
+def upi_payment_uri(amount, user_id):
+    """upi://pay link for amount; the note lets the owner match the payment to the user"""
+    params = {
+        'pa': UPI_ID,
+        'pn': UPI_PAYEE_NAME,
+        'am': f"{amount}.00",
+        'cu': 'INR',
+        'tn': f"Deposit {user_id}",
+    }
+    return "upi://pay?" + urllib.parse.urlencode(params, quote_via=urllib.parse.quote, safe='@')
+
+def render_qr_png(data):
+    """PNG bytes of a QR code for data; returns (png, seconds spent rendering)"""
+    import qrcode
+    started = time.perf_counter()
+    image = qrcode.make(data, box_size=8, border=2)
+    buf = io.BytesIO()
+    image.save(buf)
+    return buf.getvalue(), time.perf_counter() - started
+
+class DepositQrCache:
+    """LRU of Telegram file_ids for uploaded deposit QR codes, keyed by (user_id, amount).
+
+    The first deposit of an amount renders and uploads a PNG; repeats send
+    the cached file_id, which Telegram serves without a new upload.
+    """
+
+    def __init__(self, max_size=5000):
+        self.max_size = max_size
+        self._file_ids = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.renders = 0
+        self.render_seconds = 0.0
+
+    def get(self, key):
+        file_id = self._file_ids.get(key)
+        if file_id is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._file_ids.move_to_end(key)
+        return file_id
+
+    def put(self, key, file_id):
+        self._file_ids[key] = file_id
+        self._file_ids.move_to_end(key)
+        if len(self._file_ids) > self.max_size:
+            self._file_ids.popitem(last=False)
+
+    def discard(self, key):
+        self._file_ids.pop(key, None)
+
+    async def render(self, amount, user_id):
+        png, elapsed = await asyncio.to_thread(render_qr_png, upi_payment_uri(amount, user_id))
+        self.renders += 1
+        self.render_seconds += elapsed
+        DEPOSIT_QR_RENDER_SECONDS.observe(elapsed)
+        return png
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._file_ids),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+            'renders': self.renders,
+            'avg_render_ms': round(self.render_seconds / self.renders * 1000, 3) if self.renders else 0.0,
+        }
+
+deposit_qr_cache = DepositQrCache(DEPOSIT_QR_CACHE_SIZE)
+
+async def send_deposit_qr(message, user_id, amount):
+    """Send the UPI QR for amount, reusing the uploaded photo when cached"""
+    caption = (f"💸 Pay ₹{amount} to `{UPI_ID}` by scanning this UPI QR code 👇\n\n"
+               f"After payment, send the UTR number.")
+    key = (user_id, amount)
+    file_id = deposit_qr_cache.get(key)
+    if file_id:
+        try:
+            await message.answer_photo(photo=file_id, caption=caption, parse_mode='Markdown')
+            return
+        except TelegramBadRequest:
+            deposit_qr_cache.discard(key)
+    png = await deposit_qr_cache.render(amount, user_id)
+    sent = await message.answer_photo(
+        photo=BufferedInputFile(png, filename=f"upi-{amount}.png"),
+        caption=caption,
+        parse_mode='Markdown',
+    )
+    if sent.photo:
+        deposit_qr_cache.put(key, sent.photo[-1].file_id)
 
 main_menu = InlineKeyboardMarkup(inline_keyboard=[
     [InlineKeyboardButton(text="💰 Deposit", callback_data='deposit')],
@@ -349,8 +2549,6 @@ otp_menu = InlineKeyboardMarkup(inline_keyboard=[
     [InlineKeyboardButton(text="❌ Cancel", callback_data='cancel')]
 ])
 
-owner_login_state = {}
-
 @dp.message(Command('start'))
 async def start_cmd(message: types.Message):
     if message.from_user.id == OWNER_ID:
@@ -362,339 +2560,985 @@ async def start_cmd(message: types.Message):
 async def ping_cmd(message: types.Message):
     await message.answer("🟢 Bot is alive and running!")
 
+# === Callback Routing ===
+class UtrDecision(CallbackData, prefix="utr"):
+    action: str  # 'approve' or 'reject'
+    user_id: int
+    amount: int = 0
+    request_id: int = 0  # 0 on buttons sent before requests were addressed by id
+
+async def require_owner(callback_query):
+    return callback_query.from_user.id == OWNER_ID
+
+class CallbackRoute:
+    def __init__(self, handler, middlewares, payload_type):
+        self.handler = handler
+        self.middlewares = middlewares
+        self.payload_type = payload_type
+
+class CallbackRouter:
+    """Dispatches callback_data through a prebuilt key -> route map.
+
+    Plain buttons are keyed by their literal data; typed payloads by their
+    CallbackData prefix. Each route runs its middlewares (e.g. owner
+    authorization) before the handler, and the whole route is timed once
+    into UPDATE_SECONDS under the handler's name.
+    """
+
+    def __init__(self):
+        self.routes = {}
+
+    def route(self, key, owner_only=False, payload=None):
+        middlewares = [require_owner] if owner_only else []
+        def register(handler):
+            self.routes[key] = CallbackRoute(handler, middlewares, payload)
+            return handler
+        return register
+
+    def resolve(self, data):
+        data = _upgrade_legacy_callback(data or "")
+        route = self.routes.get(data.split(':', 1)[0])
+        if route is None:
+            return None, None
+        return route, route.payload_type.unpack(data) if route.payload_type else None
+
+    async def dispatch(self, callback_query, state):
+        try:
+            route, payload = self.resolve(callback_query.data)
+        except ValueError:
+            return
+        if route is None:
+            return
+        started = time.perf_counter()
+        try:
+            for middleware in route.middlewares:
+                if not await middleware(callback_query):
+                    return
+            await route.handler(callback_query, payload, state)
+        finally:
+            UPDATE_SECONDS.observe(time.perf_counter() - started, handler=route.handler.__name__)
+
+    def stats(self):
+        """Per-route count and p50/p99 bucket bounds; all zero with metrics disabled"""
+        stats = {}
+        for key, route in self.routes.items():
+            name = route.handler.__name__
+            stats[key] = {
+                'count': UPDATE_SECONDS.count(handler=name),
+                'p50': UPDATE_SECONDS.quantile(0.5, handler=name),
+                'p99': UPDATE_SECONDS.quantile(0.99, handler=name),
+            }
+        return stats
+
+def _upgrade_legacy_callback(data):
+    # Owner messages sent before typed payloads still carry approve_<user>_<amount> / reject_<user>
+    if data.startswith(('approve_', 'reject_')):
+        parts = data.split('_')
+        amount = int(parts[2]) if len(parts) > 2 else 0
+        return UtrDecision(action=parts[0], user_id=int(parts[1]), amount=amount).pack()
+    return data
+
+callback_router = CallbackRouter()
+
+# Button taps per user: a burst of CALLBACK_BURST, then CALLBACK_RATE per second
+CALLBACK_RATE = float(os.getenv("CALLBACK_RATE", "1"))
+CALLBACK_BURST = int(os.getenv("CALLBACK_BURST", "5"))
+CALLBACK_CONCURRENCY = int(os.getenv("CALLBACK_CONCURRENCY", "64"))  # handlers running at once
+CALLBACK_QUEUE_SIZE = int(os.getenv("CALLBACK_QUEUE_SIZE", "256"))  # handlers waiting for a slot
+CALLBACK_SHED_TEXT = {
+    'duplicate': "⏳ Still working on your last tap, please wait.",
+    'rate_limited': "⏳ Too many taps. Please wait a moment and try again.",
+    'overloaded': "🚦 The bot is busy right now. Please try again in a few seconds.",
+}
+
+class CallbackBackpressure:
+    """Outer middleware that sheds callback queries before they reach a handler.
+
+    A tap identical to one still being handled (same user, same data) is
+    coalesced into it; other taps spend a token from the user's bucket
+    (the owner is exempt). Admitted handlers run under a global concurrency
+    limit, and once the bounded wait queue is full new taps are turned away.
+    Every shed tap gets an answer_callback_query explaining why.
+    """
+
+    def __init__(self, rate=CALLBACK_RATE, burst=CALLBACK_BURST, concurrency=CALLBACK_CONCURRENCY, queue_size=CALLBACK_QUEUE_SIZE):
+        self.rate = rate
+        self.burst = burst
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.buckets = OrderedDict()
+        self.in_flight = set()
+        self.waiting = 0
+        self.shed = {reason: 0 for reason in CALLBACK_SHED_TEXT}
+        self._slots = None
+
+    def _bucket(self, user_id):
+        bucket = self.buckets.pop(user_id, None) or TokenBucket(self.rate, self.burst)
+        self.buckets[user_id] = bucket
+        if len(self.buckets) > 10000:
+            self.buckets.popitem(last=False)
+        return bucket
+
+    def _admit(self, key):
+        """Return why the tap should be shed, or None to run it"""
+        user_id, _ = key
+        if key in self.in_flight:
+            return 'duplicate'
+        if user_id != OWNER_ID and self._bucket(user_id).take():
+            return 'rate_limited'
+        if self._slots.locked() and self.waiting >= self.queue_size:
+            return 'overloaded'
+        return None
+
+    async def __call__(self, handler, event, data):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.concurrency)
+        key = (event.from_user.id, event.data)
+        reason = self._admit(key)
+        if reason is not None:
+            self.shed[reason] += 1
+            CALLBACKS_SHED.inc(reason=reason)
+            try:
+                await event.answer(CALLBACK_SHED_TEXT[reason])
+            except TelegramBadRequest:
+                pass  # query too old to answer
+            return None
+
+        self.in_flight.add(key)
+        try:
+            self.waiting += 1
+            try:
+                await self._slots.acquire()
+            finally:
+                self.waiting -= 1
+            try:
+                return await handler(event, data)
+            finally:
+                self._slots.release()
+        finally:
+            self.in_flight.discard(key)
+
+    def stats(self):
+        return {
+            'in_flight': len(self.in_flight),
+            'waiting': self.waiting,
+            'shed': dict(self.shed),
+        }
+
+callback_backpressure = CallbackBackpressure()
+dp.callback_query.outer_middleware(callback_backpressure)
+metrics.gauge("otp_bot_callbacks_in_flight", "Callback handlers running", function=lambda: len(callback_backpressure.in_flight))
+metrics.gauge("otp_bot_callbacks_waiting", "Callback handlers waiting for a slot", function=lambda: callback_backpressure.waiting)
+
+async def message_timing_middleware(handler, event, data):
+    started = time.perf_counter()
+    try:
+        return await handler(event, data)
+    finally:
+        UPDATE_SECONDS.observe(time.perf_counter() - started, handler=data['handler'].callback.__name__)
+
+if METRICS_ENABLED:
+    dp.message.middleware(message_timing_middleware)
+
 @dp.callback_query()
-async def callback_handler(callback_query: types.CallbackQuery):
-    user_id = callback_query.from_user.id
-    data = callback_query.data
-
-    if data == 'deposit':
-        amount = 100
-        qr_image_url = "https://i.postimg.cc/NFMtrgNh/Phone-Pe-QR-Bank-Of-Baroda-06101.png"
-
-        # Update user state to await UTR
-        user_states[user_id] = 'awaiting_utr'
-        await callback_query.message.answer_photo(
-            photo=qr_image_url,
-            caption=f"💸 Pay ₹{amount} by scanning this PhonePe QR code 👇\n\n"
-                    f"After payment, send the UTR number."
+async def callback_handler(callback_query: types.CallbackQuery, state: FSMContext):
+    await callback_router.dispatch(callback_query, state)
+
+@callback_router.route('deposit')
+async def deposit_callback(callback_query, payload, state):
+    if UPI_ID:
+        # Amount first, so the QR can carry it; the UTR follows the payment
+        await state.set_state(DepositFlow.amount)
+        await callback_query.message.answer(
+            f"💰 How much do you want to deposit? (₹{DEPOSIT_MIN_AMOUNT}-₹{DEPOSIT_MAX_AMOUNT})"
         )
+        return
 
-    elif data == 'balance':
-        bal = get_balance(user_id)
-        await callback_query.message.answer(f"💼 Your Balance: ₹{bal}")
+    # Without a UPI ID only the fixed-amount static QR is available
+    await state.set_state(DepositFlow.utr)
+    await callback_query.message.answer_photo(
+        photo=STATIC_DEPOSIT_QR_URL,
+        caption=f"💸 Pay ₹{STATIC_DEPOSIT_AMOUNT} by scanning this PhonePe QR code 👇\n\n"
+                f"After payment, send the UTR number."
+    )
 
-    elif data == 'owner':
-        await callback_query.message.answer(f"👑 Owner: {OWNER_USERNAME}")
+@callback_router.route('balance')
+async def balance_callback(callback_query, payload, state):
+    user_id = callback_query.from_user.id
+    bal = await get_balance(user_id)
+    await callback_query.message.answer(f"💼 Your Balance: ₹{bal}")
 
-    elif data == 'get_account':
-        bal = get_balance(user_id)
-        if bal < ACCOUNT_PRICE:
-            await callback_query.message.answer(f"❌ Insufficient balance.\n\n💰 You need at least ₹{ACCOUNT_PRICE} in your wallet to buy an account.\n📊 Current balance: ₹{bal}\n\n💸 Please deposit ₹{ACCOUNT_PRICE - bal} more to proceed.")
-            return
+@callback_router.route('owner')
+async def owner_info_callback(callback_query, payload, state):
+    await callback_query.message.answer(f"👑 Owner: {OWNER_USERNAME}")
 
-        os.makedirs("data", exist_ok=True)
-        try:
-            with open("data/account_stock.txt", "r") as f:
-                lines = f.readlines()
-        except FileNotFoundError:
-            lines = []
+@callback_router.route('get_account')
+async def get_account_callback(callback_query, payload, state):
+    user_id = callback_query.from_user.id
+    status, number, bal = await claim_account(user_id, ACCOUNT_PRICE)
+    if status == 'insufficient_balance':
+        await callback_query.message.answer(f"❌ Insufficient balance.\n\n💰 You need at least ₹{ACCOUNT_PRICE} in your wallet to buy an account.\n📊 Current balance: ₹{bal}\n\n💸 Please deposit ₹{ACCOUNT_PRICE - bal} more to proceed.")
+        return
+    if status == 'out_of_stock':
+        await callback_query.message.answer("📦 No account stock available.")
+        return
+    
+    # Start OTP listener for this number
+    asyncio.create_task(start_otp_listener(number))
+    await scheduler.schedule('expire_purchase', f"{user_id}:{number}", PURCHASE_EXPIRY)
+    
+    sent = await callback_query.message.answer(f"📞 Your Number: `{number}`\n\n🔄 OTP listener started. The OTP will appear in this message as soon as it arrives.", parse_mode='Markdown', reply_markup=otp_menu)
+    otp_waits.open(number, user_id, sent.chat.id, sent.message_id)
 
-        if not lines:
-            await callback_query.message.answer("📦 No account stock available.")
+@callback_router.route('get_otp')
+async def get_otp_callback(callback_query, payload, state):
+    user_id = callback_query.from_user.id
+    wait = otp_waits.for_user(user_id)
+    if wait is None:
+        # Nothing in memory (e.g. after a restart): fall back to the database once
+        pending = await get_pending_purchase(user_id)
+        if not pending:
+            await callback_query.message.answer("❌ No pending purchase found.")
             return
-        number = lines[0].strip()
-        with open("data/account_stock.txt", "w") as f:
-            f.writelines(lines[1:])
-        deduct_balance(user_id, ACCOUNT_PRICE)
-        save_purchase(user_id, number)
-        
-        # Start OTP listener for this number
-        asyncio.create_task(start_otp_listener(number))
-        
-        await callback_query.message.answer(f"📞 Your Number: `{number}`\n\n🔄 OTP listener started. Use 'Get OTP' button to check for received OTPs.", parse_mode='Markdown', reply_markup=otp_menu)
+        number, status = pending
+        wait = otp_waits.open(number, user_id, callback_query.message.chat.id, callback_query.message.message_id)
+        if number not in listeners:
+            asyncio.create_task(start_otp_listener(number))
 
-    elif data == 'get_otp':
-        pending = get_pending_purchase(user_id)
-        if pending:
-            number, status = pending
+    if wait.future.cancelled():
+        await callback_query.answer("❌ This purchase is no longer active.")
+        return
+    if not wait.future.done():
+        # Answer now rather than hold a handler slot: the OTP edits the purchase message when it arrives
+        await callback_query.answer("⏳ Still waiting for the OTP. It will appear automatically when received.")
+        return
+
+    await callback_query.message.answer(otp_received_text(wait.phone, wait.future.result()), parse_mode='Markdown')
+
+@callback_router.route('cancel')
+async def cancel_callback(callback_query, payload, state):
+    user_id = callback_query.from_user.id
+    pending = await get_pending_purchase(user_id)
+    if pending:
+        number, status = pending
+        if status == 'pending':
+            await refund_purchase(user_id, number, ACCOUNT_PRICE)
+            await scheduler.cancel('expire_purchase', f"{user_id}:{number}")
             
-            # Check if OTP already received
-            conn = sqlite3.connect("data/users.db", timeout=10)
-            try:
-                c = conn.cursor()
-                c.execute("SELECT otp FROM purchases WHERE user_id=? AND number=? ORDER BY rowid DESC LIMIT 1", (user_id, number))
-                result = c.fetchone()
-                
-                if result and result[0] and result[0].strip():
-                    otp = result[0].strip()
-                    await callback_query.message.answer(
-                        f"📱 **OTP Received!**\n"
-                        f"📞 Number: `{number}`\n"
-                        f"🔢 OTP: `{otp}`\n\n"
-                        f"✅ Use this OTP for your verification.",
-                        parse_mode='Markdown'
-                    )
-                else:
-                    # Start listener if not already active
-                    if number not in active_listeners:
-                        asyncio.create_task(start_otp_listener(number))
-                        status_msg = "🔄 Starting OTP listener..."
-                    else:
-                        status_msg = "🔍 Listening for OTP..."
-                    
-                    await callback_query.message.answer(
-                        f"⏳ **Waiting for OTP**\n"
-                        f"📞 Number: `{number}`\n"
-                        f"{status_msg}\n\n"
-                        f"💡 The OTP will appear here automatically when received.\n"
-                        f"🔄 Click 'Get OTP' again in a few seconds to check.",
-                        parse_mode='Markdown'
-                    )
-            finally:
-                conn.close()
+            # Disconnect and logout the session
+            await logout_session(number)
+            
+            await callback_query.message.answer("✅ Purchase canceled. Amount refunded.")
         else:
-            await callback_query.message.answer("❌ No pending purchase found.")
+            # Account already used, logout session
+            await logout_session(number)
+            await callback_query.message.answer("❌ OTP already received. Cannot cancel. Account logged out from server.")
+    else:
+        await callback_query.message.answer("❌ No pending purchase found.")
+
+@callback_router.route('add_account', owner_only=True)
+async def add_account_callback(callback_query, payload, state):
+    await state.set_state(OwnerLogin.phone)
+    await callback_query.message.answer("📞 Send phone number to add (with +91)...")
+
+@callback_router.route('stock', owner_only=True)
+async def stock_callback(callback_query, payload, state):
+    await callback_query.message.answer(format_dashboard(await dashboard_snapshot()))
+
+@callback_router.route(UtrDecision.__prefix__, owner_only=True, payload=UtrDecision)
+async def utr_decision_callback(callback_query, payload, state):
+    if payload.action == 'approve':
+        await approve_utr(callback_query, payload)
+    elif payload.action == 'reject':
+        await reject_utr(callback_query, payload)
+
+async def _utr_request_id(payload):
+    if payload.request_id:
+        return payload.request_id
+    return await db.run(_find_utr_request, payload.user_id, payload.amount)
+
+async def approve_utr(callback_query, payload):
+    request_id = await _utr_request_id(payload)
+    approved = await approve_utr_request(request_id) if request_id else None
+    if approved is None:
+        await callback_query.answer("⚠️ This request was already decided.", show_alert=True)
+        return
+    target_user_id, amount = approved
+    await scheduler.cancel('utr_timeout', str(request_id))
+    
+    # Notify user
+    outbox.send(target_user_id, f"✅ Payment approved! ₹{amount} added to your wallet.")
+        
+    # Update owner message
+    await callback_query.message.edit_text(
+        callback_query.message.text + f"\n\n✅ APPROVED - ₹{amount} added to user wallet"
+    )
+
+async def reject_utr(callback_query, payload):
+    request_id = await _utr_request_id(payload)
+    target_user_id = await reject_utr_request(request_id) if request_id else None
+    if target_user_id is None:
+        await callback_query.answer("⚠️ This request was already decided.", show_alert=True)
+        return
+    await scheduler.cancel('utr_timeout', str(request_id))
+    
+    # Notify user
+    outbox.send(target_user_id, "❌ Payment verification failed. Please contact support if you believe this is an error.")
+        
+    # Update owner message
+    await callback_query.message.edit_text(
+        callback_query.message.text + f"\n\n❌ REJECTED"
+    )
+
+@dp.message(OwnerLogin.phone, F.from_user.id == OWNER_ID)
+async def owner_add_account_phone(message: types.Message, state: FSMContext):
+    phone = message.text.strip()
+    client = new_client(await session_store.get(phone))
+    await client.connect()
+    if not await client.is_user_authorized():
+        code_request = await client.send_code_request(phone)
+        await state.set_state(OwnerLogin.code)
+        # The half-finished login's auth key has to survive until the code arrives
+        await state.update_data(phone=phone, phone_code_hash=code_request.phone_code_hash, session=client.session.save())
+        await message.answer("📨 Code sent. Enter OTP:")
+    else:
+        # Owner can always re-add accounts regardless of login status
+        await message.answer("✅ Account added to stock (already logged in).")
+        await add_to_stock(phone)
+        listeners.register(phone)
+        # Clear owner state since we're done
+        await state.clear()
+    await client.disconnect()
+
+@dp.message(OwnerLogin.code, F.from_user.id == OWNER_ID)
+async def owner_add_account_code(message: types.Message, state: FSMContext):
+    code = message.text.strip()
+    data = await state.get_data()
+    phone = data['phone']
+    phone_code_hash = data['phone_code_hash']
+    client = new_client(data.get('session'))
+    await client.connect()
+    try:
+        await client.sign_in(phone, code, phone_code_hash=phone_code_hash)
+        await session_store.save(phone, client.session.save())
+        await message.answer(f"✅ Account {phone} logged in and added to stock.")
+        await add_to_stock(phone)
+        listeners.register(phone)
+    except Exception as e:
+        await message.answer(f"❌ Login failed: {e}")
+    await client.disconnect()
+    await state.clear()
 
-    elif data == 'cancel':
-        pending = get_pending_purchase(user_id)
-        if pending:
-            number, status = pending
-            if status == 'pending':
-                cancel_purchase(user_id)
-                add_balance(user_id, ACCOUNT_PRICE)
-                with open("data/account_stock.txt", "a") as f:
-                    f.write(number + "\n")
-                
-                # Disconnect and logout the session
-                await logout_session(number)
-                
-                await callback_query.message.answer("✅ Purchase canceled. Amount refunded.")
-            else:
-                # Account already used, logout session
-                await logout_session(number)
-                await callback_query.message.answer("❌ OTP already received. Cannot cancel. Account logged out from server.")
-        else:
-            await callback_query.message.answer("❌ No pending purchase found.")
+@dp.message(DepositFlow.utr)
+async def handle_utr_input(message: types.Message, state: FSMContext):
+    # Handle UTR submission
+    utr = normalize_utr(message.text)
+    if not is_valid_utr(utr):
+        await message.answer("❌ Invalid UTR. Please send the 12-digit UPI reference number, or the 16-22 character reference of an IMPS/NEFT transfer.")
+        return
 
-    elif user_id == OWNER_ID and data == 'add_account':
-        owner_login_state[user_id] = 'awaiting_phone'
-        await callback_query.message.answer("📞 Send phone number to add (with +91)...")
+    amount = (await state.get_data()).get('amount')
+    if amount is not None:
+        await submit_utr_request(message, state, utr, amount)
+        return
 
-    elif user_id == OWNER_ID and data == 'stock':
-        count = get_stock_summary()
-        await callback_query.message.answer(f"📦 Total Stock: {count} numbers")
+    # Static QR: the amount paid is asked after the UTR
+    await state.set_state(DepositFlow.amount)
+    await state.update_data(utr=utr)
+    await message.answer("💰 Please enter the amount you paid:")
 
-    # Handle UTR approval/rejection (Owner only)
-    elif user_id == OWNER_ID and data.startswith('approve_'):
-        parts = data.split('_')
-        target_user_id = int(parts[1])
-        amount = int(parts[2])
-        
-        # Add balance to user
-        add_balance(target_user_id, amount)
-        
-        # Update UTR request status
-        conn = sqlite3.connect("data/users.db")
-        c = conn.cursor()
-        c.execute("UPDATE utr_requests SET status='approved' WHERE user_id=? AND status='pending'", (target_user_id,))
-        conn.commit()
-        conn.close()
-        
-        # Notify user
-        try:
-            await bot.send_message(target_user_id, f"✅ Payment approved! ₹{amount} added to your wallet.")
-        except:
-            pass
-            
-        # Update owner message
-        await callback_query.message.edit_text(
-            callback_query.message.text + f"\n\n✅ APPROVED - ₹{amount} added to user wallet"
-        )
+@dp.message(DepositFlow.amount)
+async def handle_amount_input(message: types.Message, state: FSMContext):
+    try:
+        amount = int(message.text.strip())
+    except ValueError:
+        await message.answer("❌ Invalid amount. Please enter a valid number.")
+        return
+    if not DEPOSIT_MIN_AMOUNT <= amount <= DEPOSIT_MAX_AMOUNT:
+        await message.answer(f"❌ Amount must be between ₹{DEPOSIT_MIN_AMOUNT} and ₹{DEPOSIT_MAX_AMOUNT}.")
+        return
+    utr = (await state.get_data()).get('utr')
+    if utr is not None:
+        await submit_utr_request(message, state, utr, amount)
+        return
 
-    elif user_id == OWNER_ID and data.startswith('reject_'):
-        parts = data.split('_')
-        target_user_id = int(parts[1])
-        
-        # Update UTR request status
-        conn = sqlite3.connect("data/users.db")
-        c = conn.cursor()
-        c.execute("UPDATE utr_requests SET status='rejected' WHERE user_id=? AND status='pending'", (target_user_id,))
-        conn.commit()
-        conn.close()
-        
-        # Notify user
-        try:
-            await bot.send_message(target_user_id, "❌ Payment verification failed. Please contact support if you believe this is an error.")
-        except:
-            pass
-            
-        # Update owner message
-        await callback_query.message.edit_text(
-            callback_query.message.text + f"\n\n❌ REJECTED"
-        )
+    await state.update_data(amount=amount)
+    await state.set_state(DepositFlow.utr)
+    await send_deposit_qr(message, message.from_user.id, amount)
 
-@dp.message(lambda msg: msg.from_user.id == OWNER_ID)
-async def owner_add_account_step(message: types.Message):
-    state = owner_login_state.get(message.from_user.id)
-    if state == 'awaiting_phone':
-        phone = message.text.strip()
-        client = TelegramClient(f"{SESSION_DIR}/{phone}", API_ID, API_HASH)
-        await client.connect()
-        if not await client.is_user_authorized():
-            code_request = await client.send_code_request(phone)
-            owner_login_state[message.from_user.id] = {
-                'phone': phone, 
-                'phone_code_hash': code_request.phone_code_hash
-            }
-            await message.answer("📨 Code sent. Enter OTP:")
+async def submit_utr_request(message, state, utr, amount):
+    user_id = message.from_user.id
+    request_id = await save_utr_request(user_id, utr, amount)
+    if request_id is None:
+        # Keep the amount and ask again, whichever order the flow collected them in
+        await state.set_state(DepositFlow.utr)
+        await state.update_data(amount=amount, utr=None)
+        await message.answer("❌ This UTR has already been submitted. Please check it and send the UTR of your payment.")
+        return
+    await scheduler.schedule('utr_timeout', str(request_id), UTR_REQUEST_TIMEOUT)
+
+    # Notify owner with verification buttons
+    verify_keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [
+            InlineKeyboardButton(text="✅ Approve", callback_data=UtrDecision(action='approve', user_id=user_id, amount=amount, request_id=request_id).pack()),
+            InlineKeyboardButton(text="❌ Reject", callback_data=UtrDecision(action='reject', user_id=user_id, request_id=request_id).pack())
+        ]
+    ])
+    outbox.send(
+        OWNER_ID,
+        f"🔔 New UTR Verification Request\n"
+        f"👤 User ID: {user_id}\n"
+        f"👤 Username: @{message.from_user.username or 'N/A'}\n"
+        f"🏦 UTR: `{utr}`\n"
+        f"💰 Amount: ₹{amount}",
+        lane=LANE_ADMIN,
+        parse_mode='Markdown',
+        reply_markup=verify_keyboard
+    )
+
+    await message.answer("✅ UTR submitted for verification. You'll be notified once approved.")
+    await state.clear()
+
+# Owner only: before FSM filters this was shadowed by the catch-all message handler
+@dp.message(Command('addbal'), F.from_user.id == OWNER_ID)
+async def manual_add_balance(message: types.Message):
+    try:
+        amount = int(message.text.split()[1])
+        await add_balance(message.from_user.id, amount, 'manual')
+        await message.answer(f"✅ ₹{amount} added to your wallet.")
+    except:
+        await message.answer("❌ Usage: /addbal <amount>")
+
+@dp.message(Command('stats'), F.from_user.id == OWNER_ID)
+async def stats_cmd(message: types.Message):
+    await message.answer(format_dashboard(await dashboard_snapshot()))
+
+@dp.message(Command('checkstats'), F.from_user.id == OWNER_ID)
+async def check_stats_cmd(message: types.Message):
+    fix = message.text.split()[1:] == ['fix']
+    await message.answer(format_dashboard_check(await check_dashboard(fix), fixed=fix))
+
+def format_callback_stats(routes, pressure):
+    shed = ", ".join(f"{reason} {count}" for reason, count in pressure['shed'].items() if count) or "none"
+    lines = [f"🔘 Callbacks: {pressure['in_flight']} running, {pressure['waiting']} waiting, shed: {shed}"]
+    if not METRICS_ENABLED:
+        lines.append("Route latency needs METRICS_ENABLED=1")
+    for key, route in sorted(routes.items(), key=lambda item: -item[1]['count']):
+        if route['count']:
+            lines.append(f"{key}: {route['count']} taps, p50 ≤{route['p50'] * 1000:g} ms, p99 ≤{route['p99'] * 1000:g} ms")
+    return "\n".join(lines)
+
+@dp.message(Command('perf'), F.from_user.id == OWNER_ID)
+async def perf_cmd(message: types.Message):
+    await message.answer(format_callback_stats(callback_router.stats(), callback_backpressure.stats()))
+
+# === Statement Reconciliation ===
+# Header patterns (matched against lowercased words) in order of preference
+STATEMENT_AMOUNT_COLUMNS = (r"\bcredit\b", r"\bdeposits?\b", r"^(?!.*\b(?:withdrawal|debit|dr)\b).*\b(?:amount|amt)\b")
+STATEMENT_UTR_COLUMNS = (r"\butr\b", r"\brrn\b", r"\bref\b|\breference\b", r"\b(?:transaction|txn) id\b")
+STATEMENT_TEXT_COLUMNS = (r"\bnarration\b", r"\bdescription\b", r"\bremarks?\b", r"\bparticulars\b", r"\bdetails\b")
+STATEMENT_HEADER_ROWS = 30  # bank exports often start with account details
+STATEMENT_REPORT_LIMIT = 20
+_STATEMENT_TOKEN = re.compile(r"(?<![A-Z0-9])[A-Z0-9]{12,22}(?![A-Z0-9])")
+
+def _statement_column(header, patterns):
+    for pattern in patterns:
+        for index, name in enumerate(header):
+            if re.search(pattern, name):
+                return index
+    return None
+
+def _statement_amount(text):
+    try:
+        amount = Decimal(re.sub(r"[^\d.\-]", "", text or ""))
+    except InvalidOperation:
+        return None
+    return amount if amount > 0 else None
+
+def match_statement(path, pending):
+    """Stream a statement CSV against pending requests, keyed by normalized UTR.
+
+    A row's UTR is read from its UTR/reference column (sometimes zero-padded).
+    Only when that is missing or blank is it looked for inside the narration,
+    the way most bank exports embed UPI payments, and then only tokens shaped
+    like a UTR count: a narration also carries IFSC codes and names. Matched
+    and mismatched requests are removed from pending, so whatever is left
+    there afterwards was not found in the statement. Runs in constant memory
+    regardless of the statement size.
+    """
+    result = {'rows': 0, 'matched': [], 'mismatched': [], 'unmatched_rows': 0}
+    with open(path, newline='', encoding='utf-8-sig', errors='replace') as f:
+        reader = csv.reader(f)
+        for row in itertools.islice(reader, STATEMENT_HEADER_ROWS):
+            header = [" ".join(re.sub(r"[^a-z0-9]", " ", cell.lower()).split()) for cell in row]
+            amount_col = _statement_column(header, STATEMENT_AMOUNT_COLUMNS)
+            utr_col = _statement_column(header, STATEMENT_UTR_COLUMNS)
+            text_col = _statement_column(header, STATEMENT_TEXT_COLUMNS)
+            if amount_col is not None and (utr_col is not None or text_col is not None):
+                break
         else:
-            # Owner can always re-add accounts regardless of login status
-            await message.answer("✅ Account added to stock (already logged in).")
-            add_to_stock(phone)
-            # Start OTP listener for this phone
-            await start_otp_listener(phone)
-            # Clear owner state since we're done
-            owner_login_state.pop(message.from_user.id, None)
-        await client.disconnect()
-    elif isinstance(state, dict) and 'phone' in state and 'phone_code_hash' in state:
-        code = message.text.strip()
-        phone = state['phone']
-        phone_code_hash = state['phone_code_hash']
-        client = TelegramClient(f"{SESSION_DIR}/{phone}", API_ID, API_HASH)
-        await client.connect()
-        try:
-            await client.sign_in(phone, code, phone_code_hash=phone_code_hash)
-            await message.answer(f"✅ Account {phone} logged in and added to stock.")
-            add_to_stock(phone)
-            # Start OTP listener for this newly logged in phone
-            await start_otp_listener(phone)
-        except Exception as e:
-            await message.answer(f"❌ Login failed: {e}")
-        await client.disconnect()
-        owner_login_state.pop(message.from_user.id, None)
+            raise ValueError("no amount and UTR/narration columns in the first rows")
 
-@dp.message()
-async def handle_utr_input(message: types.Message):
-    user_id = message.from_user.id
+        for row in reader:
+            if len(row) <= amount_col:
+                continue
+            amount = _statement_amount(row[amount_col])
+            if amount is None:  # debits and blank lines
+                continue
+            result['rows'] += 1
+            reference = normalize_utr(row[utr_col]) if utr_col is not None and utr_col < len(row) else ""
+            if reference:
+                candidates = (reference, reference.lstrip("0"))
+            elif text_col is not None and text_col < len(row):
+                candidates = [t for t in _STATEMENT_TOKEN.findall(row[text_col].upper()) if is_valid_utr(t)]
+            else:
+                candidates = ()
+            utr = next((c for c in candidates if c in pending), None)
+            if utr is None:
+                result['unmatched_rows'] += 1
+                continue
+            request = pending.pop(utr)
+            if amount == request[2]:
+                result['matched'].append(request)
+            else:
+                result['mismatched'].append((request, amount))
+    return result
+
+def _approve_utr_requests(conn, requests):
+    approved = []
+    for request_id, _, _, _ in requests:
+        res = _approve_utr_request(conn, request_id)
+        if res:
+            approved.append((request_id, *res))
+    return approved
+
+PENDING_UTR_REQUESTS_SQL = "SELECT id, user_id, utr, amount FROM utr_requests WHERE status='pending'"
+
+async def reconcile_statement(path, dry_run=False):
+    """Approve every pending UTR request the statement shows as paid, in one transaction.
+
+    A request is approved only when the statement has its UTR with exactly
+    the requested amount; amount mismatches are left pending for the owner.
+    Returns a summary including what could not be matched.
+    """
+    started = time.monotonic()
+    rows = await db.fetchall(PENDING_UTR_REQUESTS_SQL)
+    pending = {utr: (request_id, user_id, amount, utr) for request_id, user_id, utr, amount in rows}
+    result = await asyncio.to_thread(match_statement, path, pending)
+    approved = [] if dry_run else await db.transaction(_approve_utr_requests, result['matched'])
+    await scheduler.cancel_many('utr_timeout', [str(request_id) for request_id, _, _ in approved])
+    for _, user_id, _ in approved:
+        balance_cache.invalidate(user_id)
+    result['notices'] = [outbox.send(user_id, f"✅ Payment approved! ₹{amount} added to your wallet.") for _, user_id, amount in approved]
+    result['approved'] = approved
+    result['not_found'] = sorted(pending.values())
+    result['dry_run'] = dry_run
+    result['seconds'] = time.monotonic() - started
+    return result
+
+def format_reconcile_summary(summary):
+    approved = summary['matched'] if summary['dry_run'] else summary['approved']
+    text = (
+        f"🏦 Statement {'checked' if summary['dry_run'] else 'reconciled'} in {summary['seconds']:.1f}s\n"
+        f"📄 Credits read: {summary['rows']}\n"
+        f"✅ {'Would approve' if summary['dry_run'] else 'Approved'}: {len(approved)} (₹{sum(r[2] for r in approved)})\n"
+        f"⚠️ Amount mismatch: {len(summary['mismatched'])}\n"
+        f"⏳ Pending, not in statement: {len(summary['not_found'])}\n"
+        f"❔ Credits without a request: {summary['unmatched_rows']}"
+    )
+    if summary['mismatched']:
+        text += "\n\nAmount mismatch:\n" + "\n".join(
+            f"#{request_id} {utr}: requested ₹{amount}, paid ₹{paid}"
+            for (request_id, _, amount, utr), paid in summary['mismatched'][:STATEMENT_REPORT_LIMIT]
+        )
+    if summary['not_found']:
+        text += "\n\nNot in statement:\n" + "\n".join(
+            f"#{request_id} {utr}: ₹{amount} from {user_id}"
+            for request_id, user_id, amount, utr in summary['not_found'][:STATEMENT_REPORT_LIMIT]
+        )
+    return text
 
-    # Handle UTR submission
-    if user_states.get(user_id) == 'awaiting_utr':
-        utr = message.text.strip()
-        if len(utr) < 8:  # Basic UTR validation
-            await message.answer("❌ Invalid UTR. Please provide a valid UTR number.")
-            return
+# === Bulk Stock Import ===
+IMPORT_CONCURRENCY = int(os.getenv("IMPORT_CONCURRENCY", "20"))
+ARCHIVE_SUFFIXES = ('.zip', '.tar', '.tar.gz', '.tgz')
 
-        # Ask for amount
-        user_states[user_id] = {'state': 'awaiting_amount', 'utr': utr}
-        await message.answer("💰 Please enter the amount you paid:")
+async def session_is_authorized(session):
+    """Non-destructive check that a session string still belongs to a logged-in account"""
+    client = new_client(session)
+    try:
+        await asyncio.wait_for(client.connect(), timeout=SESSION_CONNECT_TIMEOUT)
+        return await client.is_user_authorized()
+    except Exception:
+        return False
+    finally:
+        await client.disconnect()
 
-    elif isinstance(user_states.get(user_id), dict) and user_states[user_id].get('state') == 'awaiting_amount':
-        try:
-            amount = int(message.text.strip())
-            utr = user_states[user_id]['utr']
+def _find_session_files(root):
+    found = []
+    for dirpath, _, filenames in os.walk(root):
+        found.extend(os.path.join(dirpath, f) for f in filenames if f.endswith(".session"))
+    return sorted(found)
+
+async def bulk_import_sessions(path, concurrency=IMPORT_CONCURRENCY):
+    """Import every .session file in a directory or archive into stock.
+
+    Each file is converted to a StringSession and validated concurrently;
+    the accepted ones go into sessions and stock_queue/stock_log in a single
+    transaction. Returns a summary with the accepted, duplicate and invalid
+    phones. Raises ValueError for an unreadable archive, or a tar with
+    members that would land outside the work directory (absolute paths,
+    '..', links or device files).
+    """
+    started = time.monotonic()
+    with tempfile.TemporaryDirectory() as workdir:
+        root = path
+        if path.endswith(ARCHIVE_SUFFIXES):
+            try:
+                # zip members are already confined to workdir; the data filter does the same for tar
+                await asyncio.to_thread(shutil.unpack_archive, path, workdir, filter='data')
+            except (shutil.ReadError, tarfile.TarError) as e:
+                raise ValueError(f"{os.path.basename(path)}: {e}") from e
+            root = workdir
+        files = _find_session_files(root)
+
+        known = {row[0] for row in await db.fetchall("SELECT phone FROM stock_log")}
+        summary = {'accepted': [], 'duplicate': [], 'invalid': []}
+        candidates = {}
+        for session_path in files:
+            phone = os.path.basename(session_path)[:-len(".session")]
+            if phone in known or phone in candidates:
+                summary['duplicate'].append(phone)
+            else:
+                candidates[phone] = session_path
 
-            save_utr_request(user_id, utr, amount)
+        semaphore = asyncio.Semaphore(concurrency)
 
-            # Notify owner with verification buttons
+        async def check(phone, session_path):
+            async with semaphore:
+                try:
+                    session = await asyncio.to_thread(session_file_to_string, session_path)
+                except Exception:
+                    session = None
+                return phone, session, bool(session) and await session_is_authorized(session)
+
+        accepted = {}
+        for phone, session, ok in await asyncio.gather(*(check(p, f) for p, f in candidates.items())):
+            if not ok:
+                summary['invalid'].append(phone)
+                continue
+            accepted[phone] = session
+            summary['accepted'].append(phone)
+
+    def insert_imported_stock(conn):
+        rows = [(phone,) for phone in summary['accepted']]
+        conn.executemany(
+            "INSERT INTO sessions (phone, session, status, checked_at) VALUES (?, ?, 'valid', CURRENT_TIMESTAMP) "
+            "ON CONFLICT(phone) DO UPDATE SET session=excluded.session, status='valid', "
+            "checked_at=excluded.checked_at, error=NULL, updated_at=CURRENT_TIMESTAMP",
+            accepted.items(),
+        )
+        added = conn.executemany("INSERT OR IGNORE INTO stock_queue (phone) VALUES (?)", rows).rowcount
+        _bump(conn, 'stock_available', added, daily=False)
+        conn.executemany("INSERT OR IGNORE INTO stock_log (phone) VALUES (?)", rows)
+
+    await db.transaction(insert_imported_stock)
+    for phone in summary['accepted']:
+        listeners.register(phone)
+    summary['seconds'] = time.monotonic() - started
+    return summary
+
+def format_import_summary(summary):
+    text = (
+        f"📥 Import finished in {summary['seconds']:.1f}s\n"
+        f"✅ Accepted: {len(summary['accepted'])}\n"
+        f"♻️ Duplicate: {len(summary['duplicate'])}\n"
+        f"❌ Invalid: {len(summary['invalid'])}"
+    )
+    if summary['invalid']:
+        text += "\n\nInvalid: " + ", ".join(summary['invalid'][:50])
+    return text
+
+@dp.message(Command('import'), F.from_user.id == OWNER_ID)
+async def import_cmd(message: types.Message):
+    parts = message.text.split(maxsplit=1)
+    if len(parts) < 2 or not os.path.exists(parts[1]):
+        await message.answer("❌ Usage: /import <directory or archive on the server>, or send the archive as a document")
+        return
+    await message.answer("⏳ Importing sessions...")
+    try:
+        summary = await bulk_import_sessions(parts[1])
+    except ValueError as e:
+        await message.answer(f"❌ Could not read the archive: {e}")
+        return
+    await message.answer(format_import_summary(summary))
+
+@dp.message(F.document, F.from_user.id == OWNER_ID)
+async def owner_document(message: types.Message):
+    name = message.document.file_name or ""
+    if name.lower().endswith('.csv'):
+        await message.answer("⏳ Reconciling statement...")
+        with tempfile.TemporaryDirectory() as workdir:
+            statement = os.path.join(workdir, "statement.csv")
+            await bot.download(message.document, destination=statement)
             try:
-                verify_keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                    [
-                        InlineKeyboardButton(text="✅ Approve", callback_data=f'approve_{user_id}_{amount}'),
-                        InlineKeyboardButton(text="❌ Reject", callback_data=f'reject_{user_id}')
-                    ]
-                ])
-                await bot.send_message(
-                    OWNER_ID,
-                    f"🔔 New UTR Verification Request\n"
-                    f"👤 User ID: {user_id}\n"
-                    f"👤 Username: @{message.from_user.username or 'N/A'}\n"
-                    f"🏦 UTR: `{utr}`\n"
-                    f"💰 Amount: ₹{amount}",
-                    parse_mode='Markdown',
-                    reply_markup=verify_keyboard
-                )
-            except:
-                pass
+                summary = await reconcile_statement(statement)
+            except ValueError as e:
+                await message.answer(f"❌ Could not read the statement: {e}")
+                return
+        await message.answer(format_reconcile_summary(summary))
+        return
+    if not name.endswith(ARCHIVE_SUFFIXES):
+        await message.answer("❌ Send a .zip or .tar archive of .session files to import stock, or a .csv bank statement to approve deposits.")
+        return
+    await message.answer("⏳ Importing sessions...")
+    with tempfile.TemporaryDirectory() as workdir:
+        archive = os.path.join(workdir, os.path.basename(name))
+        await bot.download(message.document, destination=archive)
+        try:
+            summary = await bulk_import_sessions(archive)
+        except ValueError as e:
+            await message.answer(f"❌ Could not read the archive: {e}")
+            return
+    await message.answer(format_import_summary(summary))
 
-            await message.answer("✅ UTR submitted for verification. You'll be notified once approved.")
-            user_states.pop(user_id, None)
+async def cli_check_stats(fix):
+    await init_db()
+    try:
+        diffs = await check_dashboard(fix)
+    finally:
+        db.close()
+    print(format_dashboard_check(diffs, fixed=fix))
+    return 1 if diffs and not fix else 0
 
-        except ValueError:
-            await message.answer("❌ Invalid amount. Please enter a valid number.")
+async def cli_import(path):
+    await init_db()
+    try:
+        summary = await bulk_import_sessions(path)
+    finally:
+        db.close()
+    print(format_import_summary(summary))
 
-@dp.message(Command('addbal'))
-async def manual_add_balance(message: types.Message):
+async def cli_reconcile(path, dry_run):
+    await init_db()
     try:
-        amount = int(message.text.split()[1])
-        add_balance(message.from_user.id, amount)
-        await message.answer(f"✅ ₹{amount} added to your wallet.")
-    except:
-        await message.answer("❌ Usage: /addbal <amount>")
+        summary = await reconcile_statement(path, dry_run)
+        # Deliver the approval notices before exiting
+        sender = asyncio.create_task(outbox.run())
+        await asyncio.gather(*summary['notices'], return_exceptions=True)
+        sender.cancel()
+    finally:
+        db.close()
+    print(format_reconcile_summary(summary))
+
+def startup():
+    """Validate the environment and create what needs it, before main() or a CLI command.
+
+    Importing the module stays free of side effects, so tools can import it
+    without any secrets set; optional subsystems load when first used.
+    """
+    global bot
+    setup_logging()
+    check_env_vars()
+    if bot is None:
+        bot = Bot(token=API_TOKEN)
+    if RAZORPAY_WEBHOOK_ENABLED:
+        logger.info("✅ Razorpay webhook enabled")
+    else:
+        logger.warning("⚠️ Webhook server disabled - missing WEBHOOK_SECRET or Razorpay credentials")
+    return bot
 
 async def main():
-    init_db()
-    print("✅ Database initialized")
+    await init_db()
+    logger.info("✅ Database initialized")
     
-    # Start existing sessions only if they exist and are valid
+    # Validate existing sessions in the background so polling starts right away
+    validation = asyncio.create_task(start_existing_sessions())
+
+    # Only numbers still waiting for an OTP need a live connection
+    listeners.start()
+    for phone in await get_pending_numbers():
+        asyncio.create_task(start_otp_listener(phone))
+    asyncio.create_task(listeners.run())
+    asyncio.create_task(outbox.run())
+    if METRICS_ENABLED:
+        await start_metrics_server()
+    if isinstance(fsm_storage, SQLiteStorage):
+        asyncio.create_task(fsm_storage.run_purger())
+    recovered = await scheduler.recover()
+    asyncio.create_task(scheduler.run())
+    logger.info(f"✅ Scheduler started with {recovered} pending jobs")
+    
+    logger.info("✅ Bot started successfully!")
     try:
-        await start_existing_sessions()
+        if BOT_MODE == "webhook":
+            await run_webhook()
+        elif RAZORPAY_WEBHOOK_ENABLED:
+            # Payment webhooks still need an HTTP server while polling
+            runner = await start_web_server(build_web_app())
+            try:
+                await dp.start_polling(bot, skip_updates=True)
+            finally:
+                await runner.cleanup()
+        else:
+            await dp.start_polling(bot, skip_updates=True)
+    finally:
+        validation.cancel()
+        listeners.stop()
+        db.close()
+
+def build_web_app():
+    """aiohttp app serving Telegram updates (webhook mode) and payment webhooks"""
+    app = web.Application()
+    if BOT_MODE == "webhook":
+        from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+        SimpleRequestHandler(
+            dispatcher=dp,
+            bot=bot,
+            secret_token=TELEGRAM_WEBHOOK_SECRET,
+        ).register(app, path=BOT_WEBHOOK_PATH)
+        setup_application(app, dp, bot=bot)
+    if RAZORPAY_WEBHOOK_ENABLED:
+        app.router.add_post(RAZORPAY_WEBHOOK_PATH, razorpay_webhook)
+    return app
+
+async def metrics_endpoint(request):
+    STOCK_AVAILABLE.set(await get_stock_summary())
+    fsm = await fsm_storage.stats()
+    FSM_ENTRIES.set(fsm['entries'], backend=fsm['backend'])
+    FSM_BYTES.set(fsm['approx_bytes'], backend=fsm['backend'])
+    return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8")
+
+async def start_metrics_server():
+    app = web.Application()
+    app.router.add_get("/metrics", metrics_endpoint)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, METRICS_HOST, METRICS_PORT).start()
+    logger.info(f"📈 Metrics on http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+    return runner
+
+async def start_web_server(app):
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, WEB_SERVER_HOST, WEB_SERVER_PORT).start()
+    logger.info(f"✅ Web server listening on {WEB_SERVER_HOST}:{WEB_SERVER_PORT}")
+    return runner
+
+async def run_webhook():
+    app = build_web_app()
+    await bot.set_webhook(
+        WEBHOOK_BASE_URL + BOT_WEBHOOK_PATH,
+        secret_token=TELEGRAM_WEBHOOK_SECRET,
+        drop_pending_updates=True,
+    )
+    runner = await start_web_server(app)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+SESSION_CHECK_CONCURRENCY = int(os.getenv("SESSION_CHECK_CONCURRENCY", "20"))
+SESSION_CHECK_DEADLINE = int(os.getenv("SESSION_CHECK_DEADLINE", "300"))  # seconds, whole run
+SESSION_CONNECT_TIMEOUT = 10
+
+async def validate_session(phone):
+    """Check one stored session and record the outcome.
+
+    Returns 'valid', 'unauthorized', 'corrupt', 'timed_out' or 'error';
+    timed-out and errored sessions are kept and retried on the next start.
+    """
+    session = await session_store.get(phone)
+    try:
+        client = new_client(session) if session else None
+    except Exception as e:  # not a decodable StringSession
+        client = None
+        logger.warning(f"⚠️ Unreadable session for {phone}: {e}")
+    if client is None:
+        await session_store.mark(phone, 'corrupt', "no usable auth key")
+        return 'corrupt'
+
+    try:
+        # Set a connection timeout to prevent hanging
+        await asyncio.wait_for(client.connect(), timeout=SESSION_CONNECT_TIMEOUT)
+        authorized = await client.is_user_authorized()
+    except asyncio.TimeoutError:
+        # Transient: keep the session and try again on the next start
+        logger.warning(f"⚠️ Connection timeout for session {phone}")
+        await session_store.mark_error(phone, "connect timeout")
+        return 'timed_out'
     except Exception as e:
-        print(f"⚠️ Error starting existing sessions: {e}")
-    
-    print("✅ Bot started successfully!")
-    await dp.start_polling(bot, skip_updates=True)
+        kind = classify_session_error(e)
+        logger.warning(f"⚠️ Error checking session {phone}: {e}")
+        if kind in ('banned', 'unauthorized'):
+            # Also refunds a buyer still waiting on this number
+            await apply_session_health(phone, kind, f"{type(e).__name__}: {e}")
+            return 'unauthorized'
+        await session_store.mark_error(phone, str(e))
+        return 'error'
+    finally:
+        await client.disconnect()
 
-async def start_existing_sessions():
-    """Start OTP listeners for existing valid sessions only"""
-    if not os.path.exists(SESSION_DIR):
-        return
-        
-    for session_file in os.listdir(SESSION_DIR):
-        if session_file.endswith(".session"):
-            phone = session_file.replace(".session", "")
-            session_path = f"{SESSION_DIR}/{phone}.session"
-            
-            # Check if session file is valid before starting
+    if authorized:
+        # Also puts a quarantined number back in stock
+        await db.transaction(_apply_session_health, phone, 'valid', None)
+        listeners.register(phone)
+        logger.info(f"✅ Validated existing session: {phone}")
+        return 'valid'
+    await apply_session_health(phone, 'unauthorized', "not authorized")
+    return 'unauthorized'
+
+async def start_existing_sessions(concurrency=SESSION_CHECK_CONCURRENCY, deadline=SESSION_CHECK_DEADLINE):
+    """Validate stored sessions with a bounded worker pool and an overall deadline"""
+    started = time.monotonic()
+    pending = asyncio.Queue()
+    # Unauthorized, banned and corrupt sessions stay recorded but are not retried
+    for phone in await session_store.phones(('unchecked', 'valid', 'quarantined', 'error')):
+        pending.put_nowait(phone)
+    total = pending.qsize()
+    summary = {'valid': 0, 'unauthorized': 0, 'corrupt': 0, 'timed_out': 0, 'error': 0}
+
+    async def worker():
+        while not pending.empty():
+            phone = pending.get_nowait()
             try:
-                # Check if session file is empty or corrupted
-                if os.path.getsize(session_path) < 1024:  # Very small session files are likely corrupted
-                    print(f"⚠️ Session file too small, removing: {phone}")
-                    os.remove(session_path)
-                    continue
-                
-                client = TelegramClient(session_path, API_ID, API_HASH)
-                
-                # Set a connection timeout to prevent hanging
-                await asyncio.wait_for(client.connect(), timeout=10)
-                
-                if await client.is_user_authorized():
-                    await client.disconnect()
-                    await start_otp_listener(phone)
-                    print(f"✅ Started listener for existing session: {phone}")
-                else:
-                    await client.disconnect()
-                    print(f"⚠️ Session not authorized, removing: {phone}")
-                    # Remove unauthorized session files to prevent future issues
-                    try:
-                        os.remove(session_path)
-                    except:
-                        pass
-                    
-            except asyncio.TimeoutError:
-                print(f"⚠️ Connection timeout for session {phone}, removing")
-                try:
-                    os.remove(session_path)
-                except:
-                    pass
+                summary[await validate_session(phone)] += 1
             except Exception as e:
-                print(f"⚠️ Error checking session {phone}: {e}")
-                # Remove problematic session files
-                try:
-                    os.remove(session_path)
-                    print(f"🗑️ Removed problematic session file: {phone}")
-                except:
-                    pass
-                continue
+                logger.warning(f"⚠️ Error checking session {phone}: {e}")
+                summary['error'] += 1
+
+    workers = [asyncio.create_task(worker()) for _ in range(min(concurrency, total))]
+    if workers:
+        done, not_done = await asyncio.wait(workers, timeout=deadline)
+        for task in not_done:
+            task.cancel()
+        await asyncio.gather(*not_done, return_exceptions=True)
+
+    unchecked = total - sum(summary.values())
+    logger.info(
+        f"✅ Session validation: {summary['valid']} valid, {summary['unauthorized']} unauthorized, "
+        f"{summary['corrupt']} corrupt, {summary['timed_out']} timed out, {summary['error']} failed, "
+        f"{unchecked} unchecked of {total} in {time.monotonic() - started:.1f}s"
+    )
+    return summary
 
 if __name__ == '__main__':
-    asyncio.run(main())
+    parser = argparse.ArgumentParser(description="Telegram OTP bot")
+    subcommands = parser.add_subparsers(dest="command")
+    import_parser = subcommands.add_parser("import", help="bulk import .session files into stock")
+    import_parser.add_argument("path", help="directory or archive (.zip/.tar/.tar.gz) of .session files")
+    check_parser = subcommands.add_parser("check-stats", help="compare dashboard totals with the raw tables")
+    check_parser.add_argument("--fix", action="store_true", help="replace the totals with the rebuilt ones")
+    reconcile_parser = subcommands.add_parser("reconcile", help="approve pending deposits found in a bank statement CSV")
+    reconcile_parser.add_argument("path", help="statement CSV with UTR (or narration) and amount columns")
+    reconcile_parser.add_argument("--dry-run", action="store_true", help="report matches without approving them")
+    args = parser.parse_args()
+
+    startup()
+    if args.command == "import":
+        asyncio.run(cli_import(args.path))
+    elif args.command == "check-stats":
+        sys.exit(asyncio.run(cli_check_stats(args.fix)))
+    elif args.command == "reconcile":
+        asyncio.run(cli_reconcile(args.path, args.dry_run))
+    else:
+        asyncio.run(main())
@@ -0,0 +1,25 @@
+import asyncio
+import os
+import sys
+from collections import OrderedDict
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import telegram_otp_bot
+
+
+@pytest.fixture
+def bot(tmp_path, monkeypatch):
+    """The bot module with a fresh database in a temporary directory"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(telegram_otp_bot, "balance_cache", telegram_otp_bot.BalanceCache())
+    monkeypatch.setattr(telegram_otp_bot.scheduler, "_heap", [])
+    monkeypatch.setattr(telegram_otp_bot.scheduler, "_due", {})
+    if isinstance(telegram_otp_bot.fsm_storage, telegram_otp_bot.SQLiteStorage):
+        monkeypatch.setattr(telegram_otp_bot.fsm_storage, "cache", OrderedDict())
+    asyncio.run(telegram_otp_bot.init_db())
+    yield telegram_otp_bot
+    telegram_otp_bot.db.close()
@@ -0,0 +1,111 @@
+"""Minimal stand-ins for aiogram objects, recording what handlers send"""
+
+import itertools
+from datetime import datetime
+
+
+class FakeUser:
+    def __init__(self, user_id):
+        self.id = user_id
+        self.username = f"user{user_id}"
+
+
+class FakeChat:
+    def __init__(self, chat_id):
+        self.id = chat_id
+
+
+class FakeMessage:
+    def __init__(self, user_id, text="", message_id=1):
+        self.from_user = FakeUser(user_id)
+        self.chat = FakeChat(user_id)
+        self.message_id = message_id
+        self.text = text
+        self.sent = []
+
+    async def answer(self, text, **kwargs):
+        self.sent.append(text)
+
+    async def edit_text(self, text, **kwargs):
+        self.text = text
+
+
+class FakeCallbackQuery:
+    def __init__(self, user_id, data, message=None):
+        self.from_user = FakeUser(user_id)
+        self.data = data
+        self.message = message or FakeMessage(user_id)
+        self.answers = []
+
+    async def answer(self, text=None, **kwargs):
+        self.answers.append(text)
+
+
+class FakeState:
+    """FSMContext stand-in keeping state and data in memory"""
+
+    def __init__(self, data=None):
+        self.state = None
+        self.data = dict(data or {})
+
+    async def set_state(self, state=None):
+        self.state = state
+
+    async def get_data(self):
+        return dict(self.data)
+
+    async def update_data(self, data=None, **kwargs):
+        self.data.update(data or {}, **kwargs)
+        return dict(self.data)
+
+    async def clear(self):
+        self.state = None
+        self.data = {}
+
+
+def fake_bot():
+    """aiogram Bot whose API calls are answered locally; calls are recorded on bot.session.calls"""
+    from aiogram import Bot
+    from aiogram.client.session.base import BaseSession
+    from aiogram.methods import EditMessageText, SendMessage
+    from aiogram.types import Chat, Message
+
+    class FakeBotSession(BaseSession):
+        def __init__(self):
+            super().__init__()
+            self.calls = []
+
+        async def make_request(self, bot, method, timeout=None):
+            self.calls.append(method)
+            if isinstance(method, (SendMessage, EditMessageText)):
+                return Message(
+                    message_id=getattr(method, "message_id", None) or len(self.calls),
+                    date=datetime.now(),
+                    chat=Chat(id=method.chat_id, type="private"),
+                    text=method.text,
+                ).as_(bot)
+            return True
+
+        async def stream_content(self, *args, **kwargs):
+            yield b""
+
+        async def close(self):
+            pass
+
+    return Bot(token="123456:TEST", session=FakeBotSession())
+
+
+_update_ids = itertools.count(1)
+
+
+def callback_update(user_id, data):
+    from aiogram.types import CallbackQuery, Chat, Message, Update, User
+
+    user = User(id=user_id, is_bot=False, first_name=f"user{user_id}")
+    return Update(update_id=next(_update_ids), callback_query=CallbackQuery(
+        id=str(next(_update_ids)),
+        from_user=user,
+        chat_instance="test",
+        data=data,
+        message=Message(message_id=1, date=datetime.now(), chat=Chat(id=user_id, type="private"), from_user=user, text="menu"),
+    ))
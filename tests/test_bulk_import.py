@@ -0,0 +1,104 @@
+import asyncio
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+
+import pytest
+from telethon.crypto import AuthKey
+from telethon.sessions import SQLiteSession
+
+from simulate import FakeTelegramClient
+
+SESSIONS = 3000
+
+
+@pytest.fixture
+def fake_clients(bot, monkeypatch):
+    monkeypatch.setattr(FakeTelegramClient, "instances", {})
+    monkeypatch.setattr(FakeTelegramClient, "faults", {})
+    monkeypatch.setattr(bot, "TelegramClient", FakeTelegramClient)
+    monkeypatch.setattr(bot, "listeners", bot.ListenerManager())
+    return FakeTelegramClient
+
+
+def session_template(path, authorized=True):
+    session = SQLiteSession(path[:-len(".session")])
+    if authorized:
+        session.set_dc(2, "149.154.167.51", 443)
+        session.auth_key = AuthKey(os.urandom(256))
+    session.save()
+    session.close()
+    return path
+
+
+def session_dir(root, phones, template):
+    os.makedirs(root, exist_ok=True)
+    for i, phone in enumerate(phones):
+        # Nested folders, as sellers' archives usually are
+        folder = os.path.join(root, f"batch{i // 500}")
+        os.makedirs(folder, exist_ok=True)
+        shutil.copy(template, os.path.join(folder, f"{phone}.session"))
+    return root
+
+
+def test_imports_thousands_of_sessions_with_bounded_concurrency(bot, fake_clients, tmp_path, monkeypatch):
+    running, peak = [0], [0]
+
+    class SlowClient(FakeTelegramClient):
+        async def connect(self):
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+            await asyncio.sleep(0)
+            running[0] -= 1
+            self.connected = True
+
+    monkeypatch.setattr(bot, "TelegramClient", SlowClient)
+    good = session_template(str(tmp_path / "good.session"))
+    empty = session_template(str(tmp_path / "empty.session"), authorized=False)
+    phones = [f"+91{9000000000 + i}" for i in range(SESSIONS)]
+    root = session_dir(str(tmp_path / "stock"), phones[:-20], good)
+    session_dir(str(tmp_path / "stock" / "logged_out"), phones[-20:-10], empty)
+    for phone in phones[-10:]:
+        (tmp_path / "stock" / f"{phone}.session").write_bytes(b"not a database")
+
+    async def scenario():
+        await bot.db.execute("INSERT INTO stock_log (phone) VALUES (?)", (phones[0],))
+        summary = await bot.bulk_import_sessions(root, concurrency=8)
+        stock = (await bot.db.fetchone("SELECT COUNT(*) FROM stock_queue"))[0]
+        stored = (await bot.db.fetchone("SELECT COUNT(*) FROM sessions WHERE status='valid'"))[0]
+        return summary, stock, stored
+
+    summary, stock, stored = asyncio.run(scenario())
+    assert len(summary['accepted']) == SESSIONS - 21
+    assert summary['duplicate'] == [phones[0]]
+    assert sorted(summary['invalid']) == phones[-20:]
+    assert stock == stored == SESSIONS - 21
+    assert len(bot.listeners.known) == SESSIONS - 21
+    assert peak[0] == 8
+
+
+def test_imports_a_tar_archive(bot, fake_clients, tmp_path):
+    template = session_template(str(tmp_path / "good.session"))
+    phones = [f"+91{9100000000 + i}" for i in range(50)]
+    session_dir(str(tmp_path / "stock"), phones, template)
+    archive = shutil.make_archive(str(tmp_path / "stock"), "gztar", str(tmp_path / "stock"))
+
+    summary = asyncio.run(bot.bulk_import_sessions(archive))
+    assert sorted(summary['accepted']) == phones
+
+
+def test_rejects_tar_members_outside_the_work_directory(bot, fake_clients, tmp_path):
+    archive = str(tmp_path / "evil.tar")
+    with tarfile.open(archive, "w") as tar:
+        data = b"not a database"
+        member = tarfile.TarInfo("../../escaped.session")
+        member.size = len(data)
+        tar.addfile(member, io.BytesIO(data))
+
+    with pytest.raises(ValueError):
+        asyncio.run(bot.bulk_import_sessions(archive))
+    # Unpacked under a directory in tempfile.gettempdir(), so ../../ would be its parent
+    assert not os.path.exists(os.path.join(os.path.dirname(tempfile.gettempdir()), "escaped.session"))
+    assert asyncio.run(bot.db.fetchone("SELECT COUNT(*) FROM stock_queue"))[0] == 0
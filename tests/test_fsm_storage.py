@@ -0,0 +1,111 @@
+import asyncio
+import tracemalloc
+
+from aiogram.fsm.storage.base import StorageKey
+
+
+class FakeClock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def key(user_id):
+    return StorageKey(bot_id=1, chat_id=user_id, user_id=user_id)
+
+
+async def abandon_deposit(storage, user_id):
+    # The deposit flow up to the point where the user walks away
+    await storage.set_state(key(user_id), "DepositFlow:utr")
+    await storage.set_data(key(user_id), {'amount': 100 + user_id % 1000})
+
+
+def test_a_million_abandoned_flows_stay_bounded(bot):
+    clock = FakeClock()
+    storage = bot.TTLMemoryStorage(ttl=600, max_entries=10_000, clock=clock)
+
+    async def abandon(users):
+        for user_id in users:
+            await abandon_deposit(storage, user_id)
+            clock.now += 0.001
+
+    async def scenario():
+        await abandon(range(0, 900_000))
+        # Steady state: once every traced entry has replaced an evicted one,
+        # further flows must not add memory
+        tracemalloc.start()
+        await abandon(range(900_000, 950_000))
+        settled, _ = tracemalloc.get_traced_memory()
+        await abandon(range(950_000, 1_000_000))
+        after, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return after - settled, await storage.stats()
+
+    growth, stats = asyncio.run(scenario())
+    assert stats['entries'] == 10_000
+    assert stats['evicted'] == 990_000
+    assert growth < 64 * 1024
+
+
+def test_abandoned_flows_expire(bot):
+    clock = FakeClock()
+    storage = bot.TTLMemoryStorage(ttl=600, clock=clock)
+
+    async def scenario():
+        await abandon_deposit(storage, 7)
+        clock.now += 601
+        return await storage.get_state(key(7)), await storage.get_data(key(7)), await storage.stats()
+
+    state, data, stats = asyncio.run(scenario())
+    assert (state, data, stats['entries']) == (None, {}, 0)
+
+
+def test_sqlite_storage_survives_a_restart_and_purges_expired_flows(bot):
+    clock = FakeClock()
+
+    async def scenario():
+        storage = bot.SQLiteStorage(ttl=600, clock=clock)
+        await storage.set_state(key(7), "OwnerLogin:code")
+        await storage.set_data(key(7), {'phone': '+15550001'})
+        await abandon_deposit(storage, 8)
+        restarted = bot.SQLiteStorage(ttl=600, clock=clock)
+        kept = await restarted.get_state(key(7)), await restarted.get_data(key(7))
+        clock.now += 601
+        expired = await restarted.get_state(key(8))
+        purged = await restarted.purge_expired()
+        return kept, expired, purged, await restarted.stats()
+
+    kept, expired, purged, stats = asyncio.run(scenario())
+    assert kept == ("OwnerLogin:code", {'phone': '+15550001'})
+    assert expired is None
+    assert purged == 2
+    assert stats['entries'] == 0
+
+
+def test_sqlite_storage_reads_each_key_once(bot, monkeypatch):
+    queries = []
+    run = bot.db.run
+
+    async def counting_run(fn, *args, **kwargs):
+        queries.append(kwargs.get('name'))
+        return await run(fn, *args, **kwargs)
+    monkeypatch.setattr(bot.db, "run", counting_run)
+    storage = bot.SQLiteStorage(cache_size=100)
+
+    async def scenario():
+        for _ in range(50):
+            await storage.get_state(key(7))  # outside any flow, as on every button tap
+        reads = len(queries)
+        await storage.set_state(key(7), "DepositFlow:utr")
+        data = await storage.get_data(key(7))
+        data['amount'] = 1  # callers mutate what they get back
+        for user_id in range(1000):
+            await storage.get_state(key(user_id))
+        return reads, await storage.get_data(key(7)), len(storage.cache)
+
+    reads, data, cached = asyncio.run(scenario())
+    assert reads == 1
+    assert data == {}
+    assert cached == 100
@@ -0,0 +1,215 @@
+import asyncio
+
+import pytest
+from telethon import errors
+
+from simulate import FakeTelegramClient
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def fake_clients(bot, monkeypatch):
+    monkeypatch.setattr(FakeTelegramClient, "instances", {})
+    monkeypatch.setattr(FakeTelegramClient, "faults", {})
+    monkeypatch.setattr(bot, "TelegramClient", FakeTelegramClient)
+    monkeypatch.setattr(bot, "StringSession", lambda session=None: session)
+    return FakeTelegramClient
+
+
+def manager(bot, clock, reports=None, **kwargs):
+    on_health = None
+    if reports is not None:
+        async def on_health(phone, status, error):
+            reports.append((phone, status))
+    listeners = bot.ListenerManager(on_health=on_health, **kwargs)
+    listeners.health = bot.SessionHealth(threshold=3, base=5, cap=1800, clock=clock)
+    return listeners
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+async def stock(bot, listeners, phone):
+    await bot.session_store.save(phone, phone)
+    await bot.add_to_stock(phone)
+    listeners.register(phone)
+
+
+async def in_stock(bot, phone):
+    return await bot.db.fetchone("SELECT 1 FROM stock_queue WHERE phone=?", (phone,)) is not None
+
+
+def test_dropped_listener_backs_off_then_reconnects(bot, fake_clients):
+    clock, reports = Clock(), []
+
+    async def scenario():
+        listeners = manager(bot, clock, reports)
+        first = await listeners.acquire("+15550001", session="+15550001")
+        await settle()
+        first.drop()
+        await settle()
+        assert "+15550001" not in listeners
+        assert listeners.stats()["backing_off"] == 1
+
+        await listeners.check_health()  # still backing off
+        assert "+15550001" not in listeners
+
+        clock.now += 1800
+        await listeners.check_health()
+        assert "+15550001" in listeners
+        assert fake_clients.instances["+15550001"] is not first
+        return listeners.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["backing_off"] == 0
+    assert reports == []  # one drop never quarantines
+
+
+def test_repeated_failures_quarantine_stock_number_until_it_recovers(bot, fake_clients):
+    clock = Clock()
+
+    async def scenario():
+        listeners = manager(bot, clock)  # reports through apply_session_health
+        await stock(bot, listeners, "+15550002")
+        fake_clients.faults["+15550002"] = ConnectionError("network down")
+        for _ in range(3):
+            await listeners.check_health()
+            clock.now += 1800
+        quarantined = listeners.stats()["quarantined"], await in_stock(bot, "+15550002")
+
+        del fake_clients.faults["+15550002"]
+        await listeners.check_health()
+        return quarantined, listeners.stats()["quarantined"], await in_stock(bot, "+15550002")
+
+    (quarantined, was_in_stock), after, back_in_stock = asyncio.run(scenario())
+    assert (quarantined, was_in_stock) == (1, False)
+    assert (after, back_in_stock) == (0, True)
+
+
+def test_flood_wait_quarantines_at_once_for_at_least_the_wait(bot, fake_clients):
+    clock, reports = Clock(), []
+
+    async def scenario():
+        listeners = manager(bot, clock, reports)
+        listeners.register("+15550003")
+        listeners.sessions["+15550003"] = "+15550003"
+        fake_clients.faults["+15550003"] = errors.FloodWaitError(request=None, capture=3600)
+        await listeners.check_health()
+        assert reports == [("+15550003", "quarantined")]
+
+        del fake_clients.faults["+15550003"]
+        clock.now += 3599
+        await listeners.check_health()
+        assert listeners.stats()["quarantined"] == 1  # not probed before the wait ends
+
+        clock.now += 1
+        await listeners.check_health()
+
+    asyncio.run(scenario())
+    assert reports == [("+15550003", "quarantined"), ("+15550003", "valid")]
+
+
+def test_auth_key_unregistered_on_sold_number_refunds_the_buyer(bot, fake_clients, monkeypatch):
+    clock = Clock()
+
+    async def scenario():
+        monkeypatch.setattr(bot, "outbox", bot.Outbox())
+        listeners = manager(bot, clock)
+        await bot.add_balance(7, bot.ACCOUNT_PRICE, 'test')
+        await stock(bot, listeners, "+15550004")
+        status, number, _ = await bot.claim_account(7, bot.ACCOUNT_PRICE)
+        assert (status, number) == ("ok", "+15550004")
+
+        fake_clients.faults["+15550004"] = errors.AuthKeyUnregisteredError(request=None)
+        client = await listeners.acquire("+15550004", session="+15550004")
+        purchase = await bot.db.fetchone("SELECT status FROM purchases WHERE number=?", ("+15550004",))
+        return client, listeners, purchase[0], await bot.get_balance(7), bot.outbox.stats()
+
+    client, listeners, purchase, balance, outbox = asyncio.run(scenario())
+    assert client is None
+    assert "+15550004" not in listeners.pinned and "+15550004" not in listeners.known
+    assert purchase == "cancelled"
+    assert balance == bot.ACCOUNT_PRICE
+    assert sum(outbox["depth"].values()) == 1
+
+
+def test_idle_probes_rotate_through_stock_with_bounded_concurrency(bot, fake_clients, monkeypatch):
+    clock, running, peak, probed = Clock(), [0], [0], []
+
+    class SlowClient(FakeTelegramClient):
+        async def get_me(self, input_peer=False):
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+            await asyncio.sleep(0.001)
+            running[0] -= 1
+            probed.append(self.phone)
+            return True
+
+    monkeypatch.setattr(bot, "TelegramClient", SlowClient)
+
+    async def scenario():
+        listeners = manager(bot, clock, [])
+        phones = [f"+1555100{i:02d}" for i in range(12)]
+        for phone in phones:
+            listeners.register(phone)
+            listeners.sessions[phone] = phone
+        for _ in range(3):
+            await listeners.probe_idle(batch=4, concurrency=2)
+        return phones, listeners
+
+    phones, listeners = asyncio.run(scenario())
+    assert sorted(probed) == phones  # every session once over three checks
+    assert peak[0] == 2
+    assert listeners.clients == {}  # probes do not leave listeners connected
+
+
+def test_startup_validation_counts_timeouts_separately(bot, fake_clients, monkeypatch):
+    class HangingClient(FakeTelegramClient):
+        async def connect(self):
+            if self.phone.endswith("9"):
+                await asyncio.sleep(1)
+            self.connected = True
+
+    monkeypatch.setattr(bot, "TelegramClient", HangingClient)
+    monkeypatch.setattr(bot, "SESSION_CONNECT_TIMEOUT", 0.01)
+    monkeypatch.setattr(bot, "listeners", bot.ListenerManager())
+    monkeypatch.setattr(bot, "StringSession", lambda session=None: session)
+
+    async def scenario():
+        for phone in ("+15550008", "+15550009"):
+            await bot.session_store.save(phone, phone, status='unchecked')
+        summary = await bot.start_existing_sessions()
+        return summary, await bot.session_store.get("+15550009")
+
+    summary, kept = asyncio.run(scenario())
+    assert summary == {'valid': 1, 'unauthorized': 0, 'corrupt': 0, 'timed_out': 1, 'error': 0}
+    assert kept == "+15550009"  # retried on the next start
+
+
+def test_startup_validation_refunds_a_sold_number_that_logged_out(bot, fake_clients, monkeypatch):
+    class LoggedOutClient(FakeTelegramClient):
+        async def is_user_authorized(self):
+            return False
+
+    monkeypatch.setattr(bot, "TelegramClient", LoggedOutClient)
+    monkeypatch.setattr(bot, "StringSession", lambda session=None: session)
+
+    async def scenario():
+        monkeypatch.setattr(bot, "outbox", bot.Outbox())
+        await bot.add_balance(7, bot.ACCOUNT_PRICE, 'test')
+        await bot.session_store.save("+15550010", "+15550010")
+        await bot.add_to_stock("+15550010")
+        await bot.claim_account(7, bot.ACCOUNT_PRICE)
+        summary = await bot.start_existing_sessions()
+        return summary['unauthorized'], await bot.get_balance(7), sum(bot.outbox.stats()["depth"].values())
+
+    assert asyncio.run(scenario()) == (1, bot.ACCOUNT_PRICE, 1)
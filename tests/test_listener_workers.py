@@ -0,0 +1,81 @@
+import asyncio
+import queue
+
+
+class FakeProcess:
+    def __init__(self, target, args, name, daemon):
+        self.args = args
+        self.started = False
+        self.alive = True
+        self.exitcode = None
+
+    def start(self):
+        self.started = True
+
+    def is_alive(self):
+        return self.alive
+
+    def kill(self):
+        self.alive = False
+        self.exitcode = -9
+
+
+class FakeContext:
+    Process = FakeProcess
+
+    def Queue(self):
+        return queue.Queue()
+
+
+def coordinator(bot, monkeypatch, workers=2):
+    listeners = bot.ListenerCoordinator(workers)
+    listeners.ctx = FakeContext()
+    listeners.start()
+    acquired = []
+
+    async def acquire(phone):
+        acquired.append((phone, listeners.ring.get(phone)))
+    monkeypatch.setattr(listeners, "acquire", acquire)
+    return listeners, acquired
+
+
+def pin_shard(listeners, worker_id, count=20):
+    phones = [p for p in (f"+1555{i:06d}" for i in range(200)) if listeners.ring.get(p) == worker_id][:count]
+    for phone in phones:
+        listeners.pinned.add(phone)
+        listeners.owners[phone] = worker_id
+    return phones
+
+
+def test_dead_worker_is_respawned_and_gets_its_phones_back(bot, monkeypatch):
+    listeners, acquired = coordinator(bot, monkeypatch)
+    phones = pin_shard(listeners, 0)
+    dead = listeners.workers[0][0]
+    dead.kill()
+
+    async def scenario():
+        listeners._fail_over(0, dead.exitcode)
+        await asyncio.sleep(0)
+    asyncio.run(scenario())
+
+    process, _ = listeners.workers[0]
+    assert process is not dead and process.started
+    assert sorted(acquired) == [(phone, 0) for phone in sorted(phones)]
+
+
+def test_worker_that_keeps_dying_hands_its_shard_to_the_survivors(bot, monkeypatch):
+    listeners, acquired = coordinator(bot, monkeypatch)
+    phones = pin_shard(listeners, 0)
+
+    async def scenario():
+        for _ in range(bot.WORKER_MAX_RESTARTS + 1):
+            for phone in phones:
+                listeners.owners[phone] = 0
+            acquired.clear()
+            listeners.workers[0][0].kill()
+            listeners._fail_over(0, -9)
+            await asyncio.sleep(0)
+    asyncio.run(scenario())
+
+    assert 0 not in listeners.workers and 1 in listeners.workers
+    assert sorted(acquired) == [(phone, 1) for phone in sorted(phones)]
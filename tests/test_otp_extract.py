@@ -0,0 +1,43 @@
+import json
+import os
+
+import pytest
+
+import telegram_otp_bot as m
+
+CORPUS_PATH = os.path.join(os.path.dirname(__file__), "otp_corpus.jsonl")
+
+
+def load_corpus():
+    with open(CORPUS_PATH, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+CORPUS = load_corpus()
+
+
+@pytest.mark.parametrize("case", CORPUS, ids=[c["text"][:40] or "<empty>" for c in CORPUS])
+def test_corpus(case):
+    otp, _ = m.extract_otp(case["text"], case["sender"])
+    assert otp == case["otp"]
+
+
+def test_corpus_covers_both_classes():
+    assert sum(1 for c in CORPUS if c["otp"]) >= 20
+    assert sum(1 for c in CORPUS if not c["otp"]) >= 20
+
+
+@pytest.mark.parametrize("text", ["Order #123456 shipped", "In 2024 you saved 15000", "lol 123456", "Your account balance is 87214"])
+def test_bare_digits_from_untrusted_senders_are_rejected(text):
+    otp, confidence = m.extract_otp(text, 12345)
+    assert otp is None
+    assert confidence < m.OTP_MIN_CONFIDENCE
+
+
+def test_bare_digits_from_telegram_are_accepted():
+    assert m.extract_otp("Код для входа в Telegram: 38195", 777000)[0] == "38195"
+    assert m.extract_otp("Код для входа в Telegram: 38195", 12345)[0] is None
+
+
+def test_keyword_outranks_earlier_numbers():
+    assert m.extract_otp("Rs 2500 paid. Your OTP is 889120", 12345)[0] == "889120"
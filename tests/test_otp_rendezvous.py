@@ -0,0 +1,169 @@
+import asyncio
+import time
+
+from fakes import FakeCallbackQuery, callback_update, fake_bot
+
+
+class QueryCounter:
+    def __init__(self, run):
+        self._run = run
+        self.count = 0
+
+    async def __call__(self, fn, *args, **kwargs):
+        self.count += 1
+        return await self._run(fn, *args, **kwargs)
+
+
+def setup_rendezvous(bot, monkeypatch):
+    monkeypatch.setattr(bot, "otp_waits", bot.OtpRendezvous())
+    started = []
+
+    async def start_otp_listener(phone):
+        started.append(phone)
+    monkeypatch.setattr(bot, "start_otp_listener", start_otp_listener)
+    counter = QueryCounter(bot.db.run)
+    monkeypatch.setattr(bot.db, "run", counter)
+    return counter, started
+
+
+async def buy(bot, user_id, phone):
+    await bot.add_balance(user_id, bot.ACCOUNT_PRICE, 'test')
+    await bot.add_to_stock(phone)
+    status, number, _ = await bot.claim_account(user_id, bot.ACCOUNT_PRICE)
+    assert (status, number) == ('ok', phone)
+
+
+async def click(bot, user_id):
+    query = FakeCallbackQuery(user_id, "get_otp")
+    await bot.callback_router.dispatch(query, None)
+    return query
+
+
+def test_clicks_while_waiting_are_served_from_memory(bot, monkeypatch):
+    counter, _ = setup_rendezvous(bot, monkeypatch)
+
+    async def scenario():
+        await buy(bot, 7, "+15550001")
+        bot.otp_waits.open("+15550001", 7, 7, 1)  # as get_account does after sending the number
+        counter.count = 0
+        queries = [await click(bot, 7) for _ in range(20)]
+        return queries, counter.count
+
+    queries, count = asyncio.run(scenario())
+    assert count == 0
+    assert all(q.answers and q.answers[0].startswith("⏳") for q in queries)
+
+
+def test_after_a_restart_only_the_first_click_reads_the_database(bot, monkeypatch):
+    counter, started = setup_rendezvous(bot, monkeypatch)
+
+    async def scenario():
+        await buy(bot, 7, "+15550001")
+        counter.count = 0
+        await click(bot, 7)
+        first = counter.count
+        for _ in range(20):
+            await click(bot, 7)
+        return first, counter.count
+
+    first, total = asyncio.run(scenario())
+    assert first == 1
+    assert total == 1
+    assert started == ["+15550001"]
+
+
+def test_resolved_otp_is_answered_without_queries(bot, monkeypatch):
+    counter, _ = setup_rendezvous(bot, monkeypatch)
+
+    async def scenario():
+        await buy(bot, 7, "+15550001")
+        bot.otp_waits.open("+15550001", 7, 7, 1)
+        bot.otp_waits.resolve("+15550001", "52814")
+        counter.count = 0
+        query = await click(bot, 7)
+        return query, counter.count
+
+    query, count = asyncio.run(scenario())
+    assert count == 0
+    assert "52814" in query.message.sent[0]
+
+
+def test_click_without_purchase_costs_one_query(bot, monkeypatch):
+    counter, _ = setup_rendezvous(bot, monkeypatch)
+    query = asyncio.run(click(bot, 8))
+    assert counter.count == 1
+    assert query.message.sent == ["❌ No pending purchase found."]
+
+
+def test_waiting_buyers_do_not_hold_handler_slots(bot, monkeypatch):
+    setup_rendezvous(bot, monkeypatch)
+    backpressure = bot.CallbackBackpressure(concurrency=1, queue_size=0)
+
+    async def handler(event, data):
+        return await bot.callback_router.dispatch(event, None)
+
+    async def scenario():
+        for user_id in range(10, 60):
+            await buy(bot, user_id, f"+1555{user_id:04d}")
+            bot.otp_waits.open(f"+1555{user_id:04d}", user_id, user_id, 1)
+        queries = [FakeCallbackQuery(user_id, "get_otp") for user_id in range(10, 60)]
+        started = time.perf_counter()
+        await asyncio.gather(*(backpressure(handler, query, {}) for query in queries))
+        return queries, time.perf_counter() - started
+
+    queries, seconds = asyncio.run(scenario())
+    assert all(q.answers[0].startswith("⏳") for q in queries)
+    assert backpressure.shed['overloaded'] == 0
+    assert seconds < 1
+
+
+def test_repeated_clicks_through_the_dispatcher_cost_no_queries(bot, monkeypatch):
+    counter, _ = setup_rendezvous(bot, monkeypatch)
+    monkeypatch.setattr(bot.callback_backpressure, "buckets", type(bot.callback_backpressure.buckets)())
+    api = fake_bot()
+
+    async def scenario():
+        await buy(bot, 7, "+15550001")
+        bot.otp_waits.open("+15550001", 7, 7, 1)
+        await bot.dp.feed_update(api, callback_update(7, "get_otp"))  # first tap loads the (empty) FSM state
+        counter.count = 0
+        for _ in range(20):  # the later ones are shed by the rate limit
+            await bot.dp.feed_update(api, callback_update(7, "get_otp"))
+        return counter.count
+
+    assert asyncio.run(scenario()) == 0
+    answers = [call.text for call in api.session.calls if type(call).__name__ == "AnswerCallbackQuery"]
+    assert len(answers) == 21
+    assert answers[0].startswith("⏳")
+
+
+def test_callback_is_timed_once_into_update_seconds(bot, monkeypatch):
+    histogram = bot.Histogram("otp_bot_update_seconds", "test")
+    monkeypatch.setattr(bot, "UPDATE_SECONDS", histogram)
+    setup_rendezvous(bot, monkeypatch)
+
+    async def scenario():
+        await buy(bot, 7, "+15550001")
+        bot.otp_waits.open("+15550001", 7, 7, 1)
+        for _ in range(3):
+            await click(bot, 7)
+    asyncio.run(scenario())
+
+    name = bot.callback_router.routes["get_otp"].handler.__name__
+    assert list(histogram.series) == [(("handler", name),)]
+    stats = bot.callback_router.stats()["get_otp"]
+    assert stats["count"] == 3
+    assert 0 < stats["p50"] <= stats["p99"]
+
+
+def test_perf_summary_lists_tapped_routes(bot, monkeypatch):
+    histogram = bot.Histogram("otp_bot_update_seconds", "test")
+    histogram.observe(0.004, handler="get_otp_callback")
+    monkeypatch.setattr(bot, "UPDATE_SECONDS", histogram)
+    monkeypatch.setattr(bot, "METRICS_ENABLED", True)
+
+    text = bot.format_callback_stats(bot.callback_router.stats(), {'in_flight': 2, 'waiting': 0, 'shed': {'duplicate': 3, 'overloaded': 0}})
+    assert text.splitlines() == [
+        "🔘 Callbacks: 2 running, 0 waiting, shed: duplicate 3",
+        "get_otp: 1 taps, p50 ≤5 ms, p99 ≤5 ms",
+    ]
@@ -0,0 +1,130 @@
+import asyncio
+import time
+
+import pytest
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+
+class FakeBot:
+    """Records send times; errors[chat_id] lists exceptions to raise on that chat's next attempts"""
+
+    def __init__(self, errors=None):
+        self.sent = []
+        self.texts = []
+        self.attempts = {}
+        self.errors = errors or {}
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await asyncio.sleep(0.001)
+        self.attempts.setdefault(chat_id, []).append(time.monotonic())
+        pending = self.errors.get(chat_id)
+        if pending:
+            raise pending.pop(0)
+        self.sent.append(time.monotonic())
+        self.texts.append(text)
+
+
+def retry_after(chat_id, seconds):
+    return TelegramRetryAfter(SendMessage(chat_id=chat_id, text=""), "Flood control exceeded", seconds)
+
+
+def network_error(chat_id):
+    return TelegramNetworkError(SendMessage(chat_id=chat_id, text=""), "Connection reset")
+
+
+async def run_outbox(outbox, seconds):
+    runner = asyncio.create_task(outbox.run())
+    await asyncio.sleep(seconds)
+    runner.cancel()
+
+
+def test_reserved_tokens_queue_up_behind_each_other(bot):
+    now = [0.0]
+    bucket = bot.TokenBucket(5, clock=lambda: now[0])
+    assert [bucket.reserve() for _ in range(5)] == [0.0] * 5
+    waits = [bucket.reserve() for _ in range(4)]
+    assert waits == pytest.approx([0.2, 0.4, 0.6, 0.8])
+    now[0] = 1.0  # the four reserved tokens have been paid for; the fifth is free
+    assert bucket.take() == 0.0
+
+
+def test_workers_hold_the_global_rate(bot, monkeypatch):
+    rate, seconds = 20, 1.5
+    fake = FakeBot()
+    monkeypatch.setattr(bot, "bot", fake)
+    outbox = bot.Outbox(global_rate=rate, workers=4)
+
+    async def scenario():
+        for chat_id in range(200):
+            outbox.send(chat_id, "hi")
+        runner = asyncio.create_task(outbox.run())
+        await asyncio.sleep(seconds)
+        runner.cancel()
+
+    asyncio.run(scenario())
+    # a full bucket goes out at once, then one message per 1/rate seconds
+    allowed = rate + rate * seconds
+    assert allowed * 0.8 <= len(fake.sent) <= allowed + 1
+    burst_end = fake.sent[rate - 1]
+    assert len([t for t in fake.sent if t > burst_end + 0.5]) <= rate + 1
+
+
+def test_retry_after_redelivers_only_after_the_requested_delay(bot, monkeypatch):
+    fake = FakeBot({7: [retry_after(7, 1)]})
+    monkeypatch.setattr(bot, "bot", fake)
+    outbox = bot.Outbox(workers=2)
+
+    async def scenario():
+        future = outbox.send(7, "hi")
+        outbox.send(8, "unaffected")
+        await run_outbox(outbox, 1.3)
+        return future.done() and not future.exception()
+
+    assert asyncio.run(scenario())
+    first, second = fake.attempts[7]
+    assert second - first >= 1.0
+    assert outbox.retries == 1 and outbox.sent == 2 and outbox.failed == 0
+    assert fake.texts == ["unaffected", "hi"]
+
+
+def test_network_errors_back_off_then_fail(bot, monkeypatch):
+    fake = FakeBot({7: [network_error(7) for _ in range(3)], 8: [network_error(8)]})
+    monkeypatch.setattr(bot, "bot", fake)
+    outbox = bot.Outbox(max_retries=2, backoff=0.05)
+
+    async def scenario():
+        failed = outbox.send(7, "lost")
+        recovered = outbox.send(8, "late")
+        await run_outbox(outbox, 0.8)
+        return failed, recovered
+
+    failed, recovered = asyncio.run(scenario())
+    assert isinstance(failed.exception(), TelegramNetworkError)
+    assert recovered.exception() is None
+    attempts = fake.attempts[7]
+    assert len(attempts) == 3
+    # 0.05 * 2**1, then 0.05 * 2**2
+    assert attempts[1] - attempts[0] >= 0.1 and attempts[2] - attempts[1] >= 0.2
+    assert outbox.retries == 3 and outbox.failed == 1 and outbox.sent == 1
+
+
+def test_otp_messages_overtake_queued_admin_messages(bot, monkeypatch):
+    fake = FakeBot()
+    monkeypatch.setattr(bot, "bot", fake)
+    outbox = bot.Outbox(global_rate=5, workers=1)
+
+    async def scenario():
+        for chat_id in range(10):
+            outbox.send(chat_id, f"admin {chat_id}", lane=bot.LANE_ADMIN)
+        runner = asyncio.create_task(outbox.run())
+        await asyncio.sleep(0.1)  # the first bucketful of admin messages is out
+        outbox.send(100, "otp", lane=bot.LANE_OTP)
+        outbox.send(101, "user", lane=bot.LANE_USER)
+        await asyncio.sleep(1)
+        runner.cancel()
+
+    asyncio.run(scenario())
+    assert fake.texts[:5] == [f"admin {i}" for i in range(5)]
+    assert fake.texts[5:7] == ["otp", "user"]
+    assert fake.texts[7] == "admin 5"
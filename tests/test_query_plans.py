@@ -0,0 +1,64 @@
+import sqlite3
+
+import pytest
+
+import telegram_otp_bot as m
+
+# Every query on a hot path, taken from the constants the helpers execute
+HOT_QUERIES = {
+    "get_pending_purchase": m.PENDING_PURCHASE_SQL,
+    "get_user_by_phone": m.USER_BY_PHONE_SQL,
+    "record_otp": m.PENDING_PURCHASE_ID_SQL,
+    "refund_purchase": m.CANCEL_PURCHASE_SQL,
+    "get_pending_numbers": m.PENDING_NUMBERS_SQL,
+    "claim_account": m.NEXT_STOCK_SQL,
+    "unstock": m.UNSTOCK_SQL,
+    "find_utr_request_amount": m.UTR_REQUEST_BY_AMOUNT_SQL,
+    "find_utr_request": m.UTR_REQUEST_BY_USER_SQL,
+    "approve_utr_request": m.PENDING_UTR_REQUEST_SQL,
+    "reconcile_statement": m.PENDING_UTR_REQUESTS_SQL,
+    "session_store_get": m.SESSION_SQL,
+    "session_store_phones": m.SESSION_PHONES_SQL.format(marks="?,?"),
+    "scheduler_cancel": m.DELETE_JOB_SQL,
+    "fsm_state": m.FSM_STATE_SQL,
+}
+
+# Queries whose rowid-ordered SCAN stops after the first row (LIMIT 1): a primary key walk, not a table scan
+ROWID_PEEKS = {"claim_account"}
+
+
+@pytest.fixture(scope="module")
+def conn():
+    conn = sqlite3.connect(":memory:")
+    m._migrate(conn)
+    # Give the planner a realistic picture rather than empty tables
+    conn.execute("ANALYZE")
+    yield conn
+    conn.close()
+
+
+@pytest.mark.parametrize("name", sorted(HOT_QUERIES))
+def test_hot_query_uses_an_index(conn, name):
+    sql = HOT_QUERIES[name]
+    plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, (None,) * sql.count("?"))]
+    assert plan, name
+    for step in plan:
+        # SCAN ... USING INDEX still reads the whole index; only SEARCH is a seek
+        assert step.startswith("SEARCH") or name in ROWID_PEEKS, f"{name}: {plan}"
+        assert "TEMP B-TREE" not in step, f"{name}: {plan}"
+
+
+def test_migrations_upgrade_a_legacy_database(tmp_path):
+    path = tmp_path / "users.db"
+    conn = sqlite3.connect(path)
+    m.MIGRATIONS[0](conn)
+    conn.execute("INSERT INTO purchases (user_id, number, status, otp) VALUES (1, '+1', 'pending', NULL)")
+    conn.execute("INSERT INTO utr_requests (user_id, utr, amount, status) VALUES (1, '123456789012', 100, 'pending')")
+    conn.execute("PRAGMA user_version = 1")
+    conn.commit()
+
+    assert m._migrate(conn) == (1, len(m.MIGRATIONS))
+    assert conn.execute("SELECT id, user_id, number, status, otp FROM purchases").fetchall() == [(1, 1, '+1', 'pending', '')]
+    assert conn.execute("SELECT id, utr, status FROM utr_requests").fetchall() == [(1, '123456789012', 'pending')]
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == len(m.MIGRATIONS)
+    conn.close()
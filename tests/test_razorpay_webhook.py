@@ -0,0 +1,85 @@
+import asyncio
+import hashlib
+import hmac
+import json
+
+from aiohttp.test_utils import TestClient, TestServer
+
+SECRET = "test-webhook-secret"
+
+
+def signed(payload):
+    body = json.dumps(payload).encode()
+    return body, {"X-Razorpay-Signature": hmac.new(SECRET.encode(), body, hashlib.sha256).hexdigest()}
+
+
+def captured(payment_id, user_id, amount):
+    return {
+        "event": "payment.captured",
+        "payload": {"payment": {"entity": {"id": payment_id, "amount": amount * 100, "notes": {"user_id": str(user_id)}}}},
+    }
+
+
+def post_all(bot, requests):
+    """POST each (body, headers) to the webhook in turn; returns the status codes"""
+    async def scenario():
+        async with TestClient(TestServer(bot.build_web_app())) as client:
+            statuses = []
+            for body, headers in requests:
+                response = await client.post(bot.RAZORPAY_WEBHOOK_PATH, data=body, headers=headers)
+                statuses.append(response.status)
+            return statuses
+    return asyncio.run(scenario())
+
+
+def setup_webhook(bot, monkeypatch):
+    monkeypatch.setattr(bot, "WEBHOOK_SECRET", SECRET)
+    monkeypatch.setattr(bot, "RAZORPAY_WEBHOOK_ENABLED", True)
+    monkeypatch.setattr(bot, "BOT_MODE", "polling")
+    monkeypatch.setattr(bot, "outbox", bot.Outbox())
+
+
+def notices(bot):
+    return [(message.chat_id, message.kwargs["text"]) for _, _, message in bot.outbox._ready]
+
+
+def test_signed_capture_credits_and_confirms(bot, monkeypatch):
+    setup_webhook(bot, monkeypatch)
+    assert post_all(bot, [signed(captured("pay_1", 42, 250))]) == [200]
+    assert asyncio.run(bot.get_balance(42)) == 250
+    assert notices(bot) == [(42, "✅ Payment received! ₹250 added to your wallet.")]
+
+
+def test_retries_credit_once(bot, monkeypatch):
+    setup_webhook(bot, monkeypatch)
+    request = signed(captured("pay_1", 42, 250))
+    assert post_all(bot, [request, request, request]) == [200, 200, 200]
+    assert asyncio.run(bot.get_balance(42)) == 250
+    assert len(notices(bot)) == 1
+
+
+def test_bad_signature_is_rejected(bot, monkeypatch):
+    setup_webhook(bot, monkeypatch)
+    body, _ = signed(captured("pay_1", 42, 250))
+    forged = {"X-Razorpay-Signature": hmac.new(b"wrong", body, hashlib.sha256).hexdigest()}
+    assert post_all(bot, [(body, forged), (body, {})]) == [400, 400]
+    assert asyncio.run(bot.get_balance(42)) == 0
+
+
+def test_tampered_body_is_rejected(bot, monkeypatch):
+    setup_webhook(bot, monkeypatch)
+    _, headers = signed(captured("pay_1", 42, 250))
+    tampered, _ = signed(captured("pay_1", 42, 25000))
+    assert post_all(bot, [(tampered, headers)]) == [400]
+    assert asyncio.run(bot.get_balance(42)) == 0
+
+
+def test_other_events_are_acknowledged_without_credit(bot, monkeypatch):
+    setup_webhook(bot, monkeypatch)
+    assert post_all(bot, [signed({"event": "payment.failed", "payload": {}})]) == [200]
+    assert notices(bot) == []
+
+
+def test_malformed_signed_payload_is_rejected(bot, monkeypatch):
+    setup_webhook(bot, monkeypatch)
+    assert post_all(bot, [signed({"event": "payment.captured", "payload": {}})]) == [400]
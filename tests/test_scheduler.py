@@ -0,0 +1,168 @@
+import asyncio
+import random
+
+from fakes import FakeCallbackQuery
+
+
+class FakeClock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+async def job_rows(bot, kind=None):
+    if kind is None:
+        return await bot.db.fetchall("SELECT kind, key FROM scheduled_jobs")
+    return await bot.db.fetchall("SELECT kind, key FROM scheduled_jobs WHERE kind=?", (kind,))
+
+
+def test_100k_jobs_fire_once_in_order_and_cancelled_ones_never(bot):
+    clock = FakeClock()
+    scheduler = bot.Scheduler(clock=clock)
+    rng = random.Random(10)
+    due = {str(i): clock.now + rng.uniform(0, 3600) for i in range(100_000)}
+
+    async def scenario():
+        def insert_jobs(conn):
+            conn.executemany("INSERT INTO scheduled_jobs (kind, key, due_at) VALUES ('job', ?, ?)", due.items())
+        await bot.db.run(insert_jobs)
+        assert await scheduler.recover() == 100_000
+
+        cancelled = [str(i) for i in range(0, 100_000, 50)]
+        await scheduler.cancel_many('job', cancelled)
+        for key in cancelled:
+            del due[key]
+        for key in [str(i) for i in range(1, 100_000, 50)]:
+            await scheduler.schedule('job', key, 7200)
+            due[key] = clock.now + 7200
+        assert len(scheduler) == len(due)
+        assert len(await job_rows(bot)) == len(due)
+
+        fired = {}
+        while clock.now <= 1_000_000 + 7200:
+            for kind, key in scheduler.pop_due(clock.now):
+                assert kind == 'job' and key not in fired
+                assert due[key] <= clock.now
+                fired[key] = clock.now
+            clock.now += 10
+        return fired
+
+    fired = asyncio.run(scenario())
+    assert fired.keys() == due.keys()
+    assert all(fired[key] - due[key] < 10 for key in due)
+    assert scheduler.next_due() is None
+
+
+def test_cancel_deletes_jobs_this_process_never_loaded(bot):
+    async def scenario():
+        await bot.scheduler.schedule('utr_timeout', '1', 60)
+        other = bot.Scheduler()  # e.g. the reconcile CLI, which never recovers
+        await other.cancel('utr_timeout', '1')
+        return await job_rows(bot)
+
+    assert asyncio.run(scenario()) == []
+
+
+def test_run_executes_due_jobs_and_clears_their_rows(bot):
+    scheduler = bot.Scheduler()
+    ran = []
+
+    @scheduler.handler('job')
+    async def job(key):
+        ran.append(key)
+
+    async def scenario():
+        runner = asyncio.create_task(scheduler.run())
+        await scheduler.schedule('job', 'a', 0)
+        await scheduler.schedule('job', 'b', 0.05)
+        await scheduler.schedule('job', 'c', 0.05)
+        await scheduler.cancel('job', 'c')
+        await asyncio.sleep(0.2)
+        runner.cancel()
+        return await job_rows(bot)
+
+    assert asyncio.run(scenario()) == []
+    assert ran == ['a', 'b']
+
+
+def setup_paths(bot, monkeypatch):
+    monkeypatch.setattr(bot, "outbox", bot.Outbox())
+
+    async def start_otp_listener(phone):
+        pass
+    monkeypatch.setattr(bot, "start_otp_listener", start_otp_listener)
+
+
+async def buy(bot, user_id, phone):
+    await bot.add_balance(user_id, bot.ACCOUNT_PRICE, 'test')
+    await bot.add_to_stock(phone)
+    status, number, _ = await bot.claim_account(user_id, bot.ACCOUNT_PRICE)
+    assert (status, number) == ('ok', phone)
+    await bot.scheduler.schedule('expire_purchase', f"{user_id}:{phone}", bot.PURCHASE_EXPIRY)
+
+
+def test_otp_receipt_cancels_the_purchase_expiry(bot, monkeypatch):
+    setup_paths(bot, monkeypatch)
+
+    async def scenario():
+        await buy(bot, 7, "+15550001")
+        await bot.set_otp_for_phone("+15550001", "12345")
+        return await job_rows(bot, 'expire_purchase')
+
+    assert asyncio.run(scenario()) == []
+    assert ('expire_purchase', "7:+15550001") not in bot.scheduler._due
+
+
+def test_cancel_cancels_the_purchase_expiry(bot, monkeypatch):
+    setup_paths(bot, monkeypatch)
+
+    async def scenario():
+        await buy(bot, 7, "+15550001")
+        await bot.cancel_callback(FakeCallbackQuery(7, "cancel"), None, None)
+        return await job_rows(bot)
+
+    assert asyncio.run(scenario()) == []
+    assert len(bot.scheduler) == 0
+
+
+async def submit(bot, user_id, utr, amount=500):
+    request_id = await bot.save_utr_request(user_id, utr, amount)
+    await bot.scheduler.schedule('utr_timeout', str(request_id), bot.UTR_REQUEST_TIMEOUT)
+    return request_id
+
+
+def test_owner_decisions_cancel_the_utr_timeout(bot, monkeypatch):
+    setup_paths(bot, monkeypatch)
+
+    async def scenario():
+        approved = await submit(bot, 7, "412345678901")
+        rejected = await submit(bot, 8, "412345678902")
+        for action, user_id, request_id in (('approve', 7, approved), ('reject', 8, rejected)):
+            payload = bot.UtrDecision(action=action, user_id=user_id, amount=500, request_id=request_id)
+            await bot.utr_decision_callback(FakeCallbackQuery(bot.OWNER_ID, payload.pack()), payload, None)
+        return await job_rows(bot)
+
+    assert asyncio.run(scenario()) == []
+    assert len(bot.scheduler) == 0
+
+
+def test_reconcile_cancels_the_utr_timeout_of_approved_requests(bot, monkeypatch, tmp_path):
+    setup_paths(bot, monkeypatch)
+    statement = tmp_path / "statement.csv"
+    statement.write_text(
+        "Date,Narration,Ref No,Deposit Amt\n"
+        "01/10/26,UPI-RAMESH-412345678901,412345678901,500.00\n"
+        "01/10/26,UPI-SURESH-412345678902,412345678902,499.00\n"
+    )
+
+    async def scenario():
+        await submit(bot, 7, "412345678901")
+        mismatched = await submit(bot, 8, "412345678902")
+        summary = await bot.reconcile_statement(statement)
+        assert len(summary['approved']) == 1
+        return mismatched, await job_rows(bot)
+
+    mismatched, rows = asyncio.run(scenario())
+    assert rows == [('utr_timeout', str(mismatched))]
@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+
+from fakes import FakeMessage, FakeState
+
+
+def write_statement(tmp_path, rows, header="Date,Narration,Ref No,Deposit Amt"):
+    path = tmp_path / "statement.csv"
+    path.write_text("\n".join([header, *rows]) + "\n")
+    return path
+
+
+@pytest.mark.parametrize("utr, valid", [
+    ("412345678901", True),               # UPI RRN
+    ("HDFCN52026101712345678", True),     # NEFT
+    ("SBIN226101712345", True),           # 16 characters
+    ("HDFC0000123", False),               # IFSC
+    ("41234567890", False),
+    ("4123456789012", False),
+    ("RAMESHKUMARSHARMA", False),         # no digits
+    ("HDFCN520261017123456789", False),   # 23 characters
+])
+def test_utr_format(bot, utr, valid):
+    assert bot.is_valid_utr(utr) is valid
+
+
+def test_an_ifsc_in_someone_elses_narration_does_not_approve_a_request(bot, tmp_path):
+    # Submitted before the format check: the attacker's "UTR" is the payer's IFSC
+    pending = {"HDFC0000123": (1, 66, 500, "HDFC0000123")}
+    path = write_statement(tmp_path, ["01/10/26,NEFT CR-HDFC0000123-RAMESH KUMAR,,500.00"])
+    result = bot.match_statement(path, pending)
+    assert result['matched'] == []
+    assert result['unmatched_rows'] == 1
+
+
+def test_reference_column_is_preferred_over_the_narration(bot, tmp_path):
+    pending = {
+        "412345678901": (1, 7, 500, "412345678901"),
+        "512345678901": (2, 8, 500, "512345678901"),
+    }
+    path = write_statement(tmp_path, [
+        "01/10/26,UPI/512345678901/paid to friend,0000412345678901,500.00",
+        "01/10/26,UPI/612345678901/RAMESH,,500.00",
+    ])
+    result = bot.match_statement(path, pending)
+    assert [request[0] for request in result['matched']] == [1]
+    assert list(pending) == ["512345678901"]
+
+
+def test_narration_is_the_fallback_without_a_reference(bot, tmp_path):
+    pending = {"612345678901": (3, 9, 500, "612345678901")}
+    path = write_statement(tmp_path, ["01/10/26,UPI/612345678901/RAMESH/HDFC0000123,,500.00"])
+    assert [request[0] for request in bot.match_statement(path, pending)['matched']] == [3]
+
+    pending = {"HDFCN52026101712345678": (4, 9, 500, "HDFCN52026101712345678")}
+    path = write_statement(tmp_path, ["01/10/26,NEFT CR-HDFCN52026101712345678-RAMESH,500.00"], header="Date,Narration,Credit")
+    assert [request[0] for request in bot.match_statement(path, pending)['matched']] == [4]
+
+
+def test_submission_rejects_what_is_not_a_utr(bot):
+    async def submit(text):
+        message = FakeMessage(7, text)
+        state = FakeState({'amount': 500})
+        await bot.handle_utr_input(message, state)
+        rows = await bot.db.fetchall("SELECT utr FROM utr_requests")
+        return message.sent, rows
+
+    sent, rows = asyncio.run(submit("HDFC0000123"))
+    assert sent[0].startswith("❌ Invalid UTR") and rows == []
+
+    sent, rows = asyncio.run(submit(" 4123 4567 8901 "))
+    assert sent[-1].startswith("✅") and rows == [("412345678901",)]
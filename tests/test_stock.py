@@ -0,0 +1,56 @@
+import asyncio
+
+
+def test_concurrent_buyers_never_share_a_number(bot):
+    buyers, stock, price = 300, 200, 50
+
+    async def scenario():
+        for user_id in range(buyers):
+            await bot.add_balance(user_id, price, 'test')
+        for i in range(stock):
+            await bot.add_to_stock(f"+91{i:010d}")
+        return await asyncio.gather(*(bot.claim_account(user_id, price) for user_id in range(buyers)))
+
+    results = asyncio.run(scenario())
+    sold = [number for status, number, _ in results if status == 'ok']
+    assert len(sold) == stock
+    assert len(set(sold)) == stock
+    assert [status for status, _, _ in results].count('out_of_stock') == buyers - stock
+
+    async def check():
+        purchases = await bot.db.fetchall("SELECT user_id, number FROM purchases WHERE status='pending'")
+        left = await bot.db.fetchone("SELECT COUNT(*) FROM stock_queue")
+        charged = await bot.db.fetchone("SELECT COUNT(*) FROM users WHERE balance = 0")
+        return purchases, left[0], charged[0], await bot.get_stock_summary()
+
+    purchases, left, charged, summary = asyncio.run(check())
+    assert sorted(number for _, number in purchases) == sorted(sold)
+    assert left == summary == 0
+    assert charged == stock  # only the buyers who got a number were charged
+
+
+def test_a_cancelled_number_is_never_back_on_sale(bot, monkeypatch):
+    sold_during_logout = []
+
+    async def disconnect(phone, log_out=False):
+        # Another buyer taps while the cancelled number is being logged out
+        sold_during_logout.append(await bot.claim_account(8, 50))
+        return True
+    monkeypatch.setattr(bot.listeners, "disconnect", disconnect)
+
+    async def scenario():
+        for user_id in (7, 8):
+            await bot.add_balance(user_id, 50, 'test')
+        await bot.add_to_stock("+910000000001")
+        status, number, _ = await bot.claim_account(7, 50)
+        assert status == 'ok'
+        assert await bot.refund_purchase(7, number, 50)
+        await bot.logout_session(number)
+        left = await bot.db.fetchone("SELECT COUNT(*) FROM stock_queue")
+        return left[0], await bot.get_stock_summary(), await bot.get_balance(7), await bot.check_dashboard()
+
+    left, summary, balance, diffs = asyncio.run(scenario())
+    assert [status for status, _, _ in sold_during_logout] == ['out_of_stock']
+    assert left == summary == 0
+    assert balance == 50
+    assert diffs == []
@@ -0,0 +1,55 @@
+import asyncio
+import random
+
+
+def test_one_wallet_under_hundreds_of_concurrent_tasks(bot):
+    user_id, price, topups, buys, reads = 7, 50, 200, 300, 500
+    seen = []
+
+    async def topup():
+        await bot.add_balance(user_id, 20, 'test')
+
+    async def read():
+        await asyncio.sleep(0)
+        seen.append(await bot.get_balance(user_id))
+
+    async def scenario():
+        for i in range(buys):
+            await bot.add_to_stock(f"+91{i:010d}")
+        tasks = [topup() for _ in range(topups)]
+        tasks += [bot.claim_account(user_id, price) for _ in range(buys)]
+        tasks += [read() for _ in range(reads)]
+        random.Random(11).shuffle(tasks)
+        results = await asyncio.gather(*tasks)
+        ledger = await bot.db.fetchone("SELECT SUM(delta) FROM ledger WHERE user_id=?", (user_id,))
+        stored = await bot.db.fetchone("SELECT balance FROM users WHERE id=?", (user_id,))
+        return results, ledger[0], stored[0], await bot.get_balance(user_id)
+
+    results, ledger, stored, cached = asyncio.run(scenario())
+    bought = sum(1 for r in results if isinstance(r, tuple) and r[0] == 'ok')
+    assert 0 < bought < buys
+    assert stored == ledger == cached == topups * 20 - bought * price
+    assert all(0 <= balance <= topups * 20 for balance in seen)
+    assert all(r[2] >= 0 for r in results if isinstance(r, tuple))
+
+
+def test_a_read_that_raced_a_write_is_not_cached(bot):
+    cache = bot.BalanceCache(max_size=100)
+    version = cache.version(7)
+    cache.invalidate(7)  # a write lands while the read is in flight
+    for user_id in range(1000, 1500):
+        cache.invalidate(user_id)  # ...and enough others that 7's stamp is forgotten
+    cache.put(7, 100, version)
+    assert cache.get(7) is None
+
+    cache.put(7, 100, cache.version(7))
+    assert cache.get(7) == 100
+
+
+def test_versions_stay_bounded(bot):
+    cache = bot.BalanceCache(max_size=100)
+    for user_id in range(50_000):
+        cache.put(user_id, 1, cache.version(user_id))
+        cache.invalidate(user_id)
+    assert len(cache._versions) <= 100
+    assert len(cache._balances) <= 100